@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_batch.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Tools for running process_UASDC.py unattended on many files.
+#                 Files can be taken from a glob of the RAW directory or
+#                 picked up as they arrive by watching RAW (inotify if the
+#                 inotify_simple module is installed, polling otherwise).
+#                 Files are handed to a bounded pool of worker processes
+#                 (or threads) so several flights move through the pipeline
+#                 at once.
+#
+#  USAGE        : called by process_UASDC.py
+#
+#  DEPENDENCIES : none. inotify_simple (optional, Linux only)
+
+import fnmatch, glob, os, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+# list the files in rawdir matching a glob pattern, oldest name first
+def find_files(rawdir, pattern='*.nc'):
+
+    return sorted(os.path.basename(f) for f in glob.glob(os.path.join(rawdir, pattern)))
+
+
+# Generator that yields the names of files that arrive in rawdir after it
+# is called. A file is only handed over once it has been closed (inotify) or
+# once its size has stopped changing between two polls (polling fallback),
+# so that files still being copied from the ground station are not touched.
+def watch_directory(rawdir, pattern='*.nc', interval=5.):
+
+    try:
+        from inotify_simple import INotify, flags
+    except ImportError:
+        INotify = None
+
+    if INotify is not None:
+        print('    Watching '+rawdir+' for new files (inotify).')
+        inotify = INotify()
+        inotify.add_watch(rawdir, flags.CLOSE_WRITE | flags.MOVED_TO)
+        while True:
+            for event in inotify.read(timeout=int(interval*1000)):
+                if fnmatch.fnmatch(event.name, pattern):
+                    yield event.name
+            yield None # give the caller a chance to collect results
+
+    print('    Watching '+rawdir+' for new files (polling every '+str(interval)+' s).')
+    seen = set(find_files(rawdir, pattern))
+    sizes = dict()
+    while True:
+        time.sleep(interval)
+        for f in find_files(rawdir, pattern):
+            if f in seen:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(rawdir, f))
+            except OSError:
+                continue
+            # wait for the size to settle before declaring the file ready
+            if sizes.get(f) == size:
+                seen.add(f)
+                del sizes[f]
+                yield f
+            else:
+                sizes[f] = size
+        yield None
+
+
+# Run worker(fname) for every file in fnames, and for every file that shows
+# up in watch_dir if it is given, with at most nworkers at a time. worker
+# must be picklable (a module-level function or a functools.partial of one)
+# when pool is 'process'. Processes are the default because netCDF4/HDF5 is
+# not thread safe; threads are fine when worker does no netCDF work of its
+# own. initializer(*initargs) is run once in each worker process. Returns a
+# dict of fname : result.
+def process_batch(worker, fnames, nworkers=4, pool='process', watch_dir=None, pattern='*.nc', interval=5., initializer=None, initargs=()):
+
+    if pool == 'thread':
+        if initializer is not None:
+            initializer(*initargs)
+        executor = ThreadPoolExecutor(max_workers=nworkers)
+    else:
+        executor = ProcessPoolExecutor(max_workers=nworkers, initializer=initializer, initargs=initargs)
+
+    results = dict()
+    pending = dict()
+
+    def collect(block):
+        if not pending:
+            return
+        done, _ = wait(list(pending), timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            fname = pending.pop(future)
+            try:
+                results[fname] = future.result()
+            except BaseException as e:
+                results[fname] = 'failed: '+str(e)
+            print('    '+fname+': '+str(results[fname]))
+
+    with executor:
+        for fname in fnames:
+            pending[executor.submit(worker, fname)] = fname
+
+        if watch_dir is not None:
+            try:
+                for fname in watch_directory(watch_dir, pattern, interval):
+                    if fname is not None:
+                        pending[executor.submit(worker, fname)] = fname
+                    collect(False)
+            except KeyboardInterrupt:
+                print('')
+                print('    Stopped watching. Finishing files already submitted.')
+
+        while pending:
+            collect(True)
+
+    return results
@@ -9,144 +9,317 @@
 #  SUMMARY      : This code checks files for consistency with WMO format, as 
 #                 here: https://github.com/synoptic/wmo-uasdc/tree/main/raw_uas_to_netCDF
 #
+#                 STAGE files are written by convert_file, in one pass from
+#                 RAW. check_vars_atts, which fixes a copy of the RAW file in
+#                 place (with rewrite_atts/apply_atts, writing only the atts
+#                 that differ), is no longer used by the processing; it is
+#                 kept as the legacy entry point for files already copied
+#                 and for the benchmarks (bench_check_attributes.py and the
+#                 check stage of bench_pipeline.py).
+#
 #  USAGE        : 
 #
 #  DEPENDENCIES : netCDF4 1.6.2+ 
 
+# Legacy: rename, convert and fix the atts of path+fname in place. Only the
+# benchmarks call this now; STAGE files come from convert_file.
 def check_vars_atts(path,fname,airframeID):
     
-    import netCDF4 as nc
-    from wmo_definitions import define_wmo_globals, define_wmo_atts, define_alt_names
-    from datetime import datetime
-
-    # assign wmo_definitions
-    global_atts = define_wmo_globals()
-    wmo_atts = define_wmo_atts()
-    namelist = define_alt_names()
+    import netCDF4 as nc, os
+    from PSL_UASDC_schema import get_schema
+    from PSL_UASDC_convert import plan_conversions, convert_var
+    from PSL_UASDC_metrics import timed
+
+    # the wmo_definitions, compiled once per process
+    schema = get_schema(airframeID)
     
     print('    Checking and correcting UASDC formatting')   
     print('')
     
     
     # open the file
-    file = nc.Dataset(path+fname,'r+')
+    with timed('check_open',fname,bytes=os.path.getsize(path+fname)):
+        file = nc.Dataset(path+fname,'r+')
 
     
-    # # # STEP 1. Make some changes to data contents, just units!
-    
-    # (a) Change the time stamp from seconds since flight to epoch # # #
+    # # # STEP 1. Rename the variable names # # # 
     
-    # We need to change the values of the time stamp, which are in seconds 
-    # since flight time, but need to be seconds since epoch
-    time_var = file.variables['time']
-    epoch = datetime(1970, 1, 1)
-    add_offset = (datetime.strptime(fname[-18:-4], '%Y%m%d%H%M%S') - epoch).total_seconds()
-    # check to make sure there isn't already epoch formatting
-    if max(time_var) < 86400:
-        time_var[:] = time_var[:]+add_offset
-     
-    # (b) Change rel_hum from fraction to %
-    file.variables['rel_hum'][:] = file.variables['rel_hum'][:]*100
+    with timed('check_rename',fname):
+        rename_vars(file,schema)
 
 
-    # # # STEP 2. Rename the variable names # # # 
-    
-    for wmo_var_name, wmo_var_atts in wmo_atts.items():
+    # # # STEP 2. Make some changes to data contents, just units!
     
-        # if the wmo variable name is not found in the file
-        if wmo_var_name not in file.variables:
+    # e.g., the time stamp from seconds since flight to seconds since epoch and
+    # rel_hum from fraction to %, see define_unit_conversions(). Variables 
+    # already in WMO units are left alone.
+    with timed('check_data',fname) as m:
+        for wmo_var_name, (scale, offset) in plan_conversions(file.variables,fname,schema['conversions']).items():
+            convert_var(file.variables[wmo_var_name],scale,offset)
+            m['bytes'] = m['bytes']+file.variables[wmo_var_name].size*file.variables[wmo_var_name].dtype.itemsize
     
-            # try to find a similar name
-            for old_name in namelist[wmo_var_name]:
     
-                if old_name in file.variables:
-                    # success! rename
-                    file.renameVariable(old_name,wmo_var_name)
+    # # # STEP 3 & 4. Check the variable and global attributes # # # 
     
-    
-    
-    # # # STEP 3. Check the attributes # # # 
-    
-    for file_var_name, file_var_atts in file.variables.items():
-    
-        # make a dictionary of all attributes and delete the att
-        attdict = dict()        
-        for att in file.variables[file_var_name].ncattrs():
-            attdict.update({att:file.variables[file_var_name].getncattr(att)})
-            file.variables[file_var_name].delncattr(att)
+    with timed('check_attributes',fname) as m:
+        nwrites = rewrite_atts(file,schema,airframeID)
+        m['writes'] = nwrites
+            
+    with timed('check_close',fname):
+        file.close()
 
+    return nwrites
 
-        # if the variable in the file is not requried by WMO, we will still update 
-        # the attributes to be consistent
-        if file_var_name not in wmo_atts:
-            
-            # the first att will be fill value
-            file.variables[file_var_name].setncattr('varname__FillValue','NaN')
-           
-            for att in attdict.items():
-                
-                if att[0] == 'standard_name':
-                    file.variables[file_var_name].setncattr('long_name',att[1])
-                else:
-                    file.variables[file_var_name].setncattr(att[0],att[1])
-            
-        # if the variable is a wmo requirement
-        elif file_var_name in wmo_atts:
-                  
-            # write wmo atts
-            for att in wmo_atts[file_var_name].items():    
-                if att[0] == 'varname__FillValue':
-                    file.variables[file_var_name].setncattr('varname__FillValue','NaN')
-                else:
-                    file.variables[file_var_name].setncattr(att[0], att[1])
-
-            # write any extra atts that remain    
-            for att in attdict.items(): 
-                if att[0] not in file.variables[file_var_name].ncattrs():
-                    if att[0] != 'standard_name':
-                        file.variables[file_var_name].setncattr(att[0],att[1])
+
+# rename variables found under one of their alternative names to the WMO name
+def rename_vars(file,schema):
+
+    for old_name, wmo_var_name in rename_map(file.variables,schema).items():
+        # success! rename
+        file.renameVariable(old_name,wmo_var_name)
+
+
+# old name : WMO name for the variables in file_vars that need renaming, one
+# lookup in the alias index per variable. A WMO variable already in the
+# file is left alone, and only the first alias found is renamed to it.
+def rename_map(file_vars,schema):
+
+    renames = dict()
+    taken = set()
+    for old_name in file_vars:
+        wmo_var_name = schema['aliases'].get(old_name)
+        if wmo_var_name is None or wmo_var_name in file_vars or wmo_var_name in taken:
+            continue
+        renames[old_name] = wmo_var_name
+        taken.add(wmo_var_name)
+
+    return renames
+
+
+# The attributes a variable should end up with, given the ones it has now 
+# (attdict). WMO variables get the WMO atts (compiled in the schema) plus
+# any extras they had; other variables keep theirs, with standard_name 
+# moved to long_name. 
+def plan_var_atts(file_var_name,attdict,schema):
+
+    from collections import OrderedDict
+
+    wmo_atts = schema['var_atts'].get(file_var_name)
+
+    # if the variable in the file is not requried by WMO, we will still update 
+    # the attributes to be consistent
+    if wmo_atts is None:
         
-    
-    # # # STEP 4. Check global attributes # # # 
+        # the first att will be fill value
+        target = OrderedDict()
+        target['varname__FillValue'] = 'NaN'
+        for att in attdict.items():
+            if att[0] == 'standard_name':
+                target['long_name'] = att[1]
+            else:
+                target[att[0]] = att[1]
+
+    # if the variable is a wmo requirement
+    else:
+
+        # wmo atts
+        target = OrderedDict(wmo_atts)
+
+        # any extra atts that remain    
+        for att in attdict.items(): 
+            if att[0] not in target and att[0] != 'standard_name':
+                target[att[0]] = att[1]
+
+    return target
 
-    # make a dictionary of all attributes and delete the att
-    attdict = dict()        
-    for att in file.ncattrs():
-        attdict.update({att:file.getncattr(att)})
-        file.delncattr(att)
+
+# The global attributes the file should end up with, given the ones it has 
+# now (attdict): the globals wmo expects followed by any extras.
+def plan_global_atts(attdict,schema,airframeID):
+
+    from collections import OrderedDict
+
+    target = OrderedDict()
 
     # write the globals wmo expects   
     pn = ''                 
-    for att in global_atts.items():
+    for att in schema['globals'].items():
      
         if att[0] not in attdict: 
             print('    Warning: '+att[0]+' not found in file global attributes')    
     
         if att[0] == 'platform_name':
-            #file.setncattr('platform_name',attdict['platform_name'])
-            file.setncattr('platform_name',airframeID)
-            pn = attdict['platform_name'] # will move this to source
+            target['platform_name'] = airframeID
+            pn = attdict.get('platform_name','') # will move this to source
         elif att[0] == 'flight_id':
-            file.setncattr('flight_id',attdict['flight_id'])   
+            target['flight_id'] = attdict.get('flight_id','')
         elif att[0] == 'processing_level':
-            file.setncattr('processing_level','raw') 
+            target['processing_level'] = 'raw'
             print('    Assigning processing level to raw.')
         elif att[0] == 'source':
-            file.setncattr('source',pn)
+            target['source'] = pn
             print('    Assigning default platform_name to source att.')
         else:
-            file.setncattr(att[0],att[1]) 
-        
-        if att[0] in attdict:
-            del attdict[att[0]]
-    
-     # write extra globals
+            target[att[0]] = att[1]
+
+    # extra globals
     for att in attdict.items():
-        file.setncattr(att[0],att[1]) 
-            
-    file.close()
+        if att[0] not in target:
+            target[att[0]] = att[1]
 
-        
-        
-        
-        
\ No newline at end of file
+    return target
+
+
+# Bring the attributes of obj (a variable or the dataset itself) to target, 
+# touching only what differs: atts not in target are deleted, new or changed
+# atts are written together in one setncatts call (one trip into define mode).
+# Atts that already match are left alone. Returns the number of att writes.
+def apply_atts(obj,target):
+
+    import numpy as np
+
+    current = {att: obj.getncattr(att) for att in obj.ncattrs()}
+
+    # by value: 1 and 1.0, or an int32 att and a Python int, are the same; a
+    # string and a number are not
+    def same(a, b):
+        if isinstance(a, str) or isinstance(b, str):
+            return type(a) == type(b) and a == b
+        a, b = np.asarray(a), np.asarray(b)
+        if a.dtype.kind not in 'biuf' or b.dtype.kind not in 'biuf':
+            return a.dtype.kind == b.dtype.kind and a.shape == b.shape and np.array_equal(a, b)
+        return a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+
+    nwrites = 0
+    for att in current:
+        if att not in target:
+            obj.delncattr(att)
+            nwrites = nwrites+1
+
+    changes = {att: val for att, val in target.items() if att not in current or not same(current[att], val)}
+    if changes:
+        obj.setncatts(changes)
+
+    return nwrites+len(changes)
+
+
+# Make the variable and global attributes of an open file conform, writing 
+# only the differences. Returns the number of att writes.
+def rewrite_atts(file,schema,airframeID):
+
+    nwrites = 0
+
+    for file_var_name, file_var in file.variables.items():
+        attdict = {att: file_var.getncattr(att) for att in file_var.ncattrs()}
+        nwrites = nwrites+apply_atts(file_var, plan_var_atts(file_var_name,attdict,schema))
+
+    attdict = {att: file.getncattr(att) for att in file.ncattrs()}
+    nwrites = nwrites+apply_atts(file, plan_global_atts(attdict,schema,airframeID))
+
+    return nwrites
+
+
+# Write a conforming STAGE file (path+new_fname) from the RAW file in one 
+# pass: the RAW file is read once (plus a range check of the variables with
+# unit conversions) and a fresh file is written with the WMO variable names, 
+# converted units and final attributes, copying each variable in blocks of at
+# most max_bytes. Replaces copying RAW to STAGE and then fixing 
+# the copy in place, which reads and writes the file twice and leaves the 
+# HDF5 file fragmented. The variables are stored as set_storage() says
+# (compressed and chunked along time, optionally as float32), so the file
+# that goes over the field link is as small as it can be. The file is
+# written as new_fname.tmp and renamed once complete, so a failed write
+# never leaves a truncated STAGE file. Returns the number of att writes.
+def convert_file(rawfile,path,new_fname,airframeID,max_bytes=8*1024**2):
+
+    import netCDF4 as nc, os, time
+    from PSL_UASDC_schema import get_schema
+    from PSL_UASDC_convert import plan_conversions, convert_block, chunks, storage_args, storage_format
+    from PSL_UASDC_metrics import record_stage
+
+    # the wmo_definitions, compiled once per process
+    schema = get_schema(airframeID)
+
+    print('    Writing UASDC formatted file to STAGE')   
+    print('')
+
+    # time spent opening/planning, on attributes, on data and closing
+    start = time.perf_counter()
+    seconds = {'check_open':0., 'check_attributes':0., 'check_data':0., 'check_close':0.}
+    nbytes = 0
+
+    src = nc.Dataset(rawfile,'r')
+    dst = nc.Dataset(path+new_fname+'.tmp','w',format=storage_format(src.data_model))
+
+    try:
+        for dim_name, dim in src.dimensions.items():
+            dst.createDimension(dim_name, None if dim.isunlimited() else len(dim))
+
+        renames = rename_map(src.variables,schema)
+
+        # unit conversions, planned on the RAW variables under their WMO names
+        plan = plan_conversions({renames.get(v,v): src.variables[v] for v in src.variables},new_fname,schema['conversions'],max_bytes)
+        seconds['check_open'] = time.perf_counter()-start
+
+        # globals
+        start = time.perf_counter()
+        attdict = {att: src.getncattr(att) for att in src.ncattrs()}
+        target = plan_global_atts(attdict,schema,airframeID)
+        dst.setncatts(target)
+        nwrites = len(target)
+        seconds['check_attributes'] = time.perf_counter()-start
+    
+        for src_name, src_var in src.variables.items():
+
+            start = time.perf_counter()
+            dst_name = renames.get(src_name, src_name)
+            attdict = {att: src_var.getncattr(att) for att in src_var.ncattrs()}
+            fill_value = attdict.pop('_FillValue', None)
+
+            datatype, storage = storage_args(dst_name, src_var)
+            if fill_value is not None and datatype != src_var.datatype:
+                fill_value = datatype.type(fill_value)
+            dst_var = dst.createVariable(dst_name, datatype, src_var.dimensions, fill_value=fill_value, **storage)
+            target = plan_var_atts(dst_name,attdict,schema)
+            target.pop('_FillValue', None)
+            dst_var.setncatts(target) # before the data, so any packing atts apply
+            nwrites = nwrites+len(target)
+            seconds['check_attributes'] = seconds['check_attributes']+time.perf_counter()-start
+
+            start = time.perf_counter()
+            scale, offset = plan.get(dst_name, (1., 0.))
+
+            # scalars
+            if not src_var.dimensions:
+                dst_var.assignValue(convert_block(src_var.getValue(),scale,offset))
+            else:
+                for i, j in chunks(src_var,max_bytes):
+                    block = convert_block(src_var[i:j],scale,offset)
+                    dst_var[i:j] = block
+                    nbytes = nbytes+block.nbytes
+            seconds['check_data'] = seconds['check_data']+time.perf_counter()-start
+
+    # nothing half-written is ever left under the final name
+    except:
+        src.close()
+        if dst.isopen():
+            dst.close()
+        os.remove(path+new_fname+'.tmp')
+        raise
+
+    start = time.perf_counter()
+    src.close()
+    dst.close()
+    os.replace(path+new_fname+'.tmp',path+new_fname)
+    seconds['check_close'] = time.perf_counter()-start
+
+    record_stage('check_open', seconds['check_open'], file=new_fname, bytes=os.path.getsize(rawfile))
+    record_stage('check_attributes', seconds['check_attributes'], file=new_fname, writes=nwrites)
+    record_stage('check_data', seconds['check_data'], file=new_fname, bytes=nbytes)
+    raw_bytes, stage_bytes = os.path.getsize(rawfile), os.path.getsize(path+new_fname)
+    record_stage('check_close', seconds['check_close'], file=new_fname, bytes=stage_bytes, raw_bytes=raw_bytes)
+    change = 100*(1-stage_bytes/max(raw_bytes, 1))
+    print(f"    STAGE file {stage_bytes/1024:.1f} kB, RAW {raw_bytes/1024:.1f} kB ({abs(change):.0f}% {'smaller' if change >= 0 else 'larger'})")
+    print('')
+
+    return nwrites
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_convert.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Unit conversions for UASDC files, driven by the table in
+#                 wmo_definitions.define_unit_conversions(). Variables are
+#                 reduced and converted with NumPy in blocks of bounded size,
+#                 so memory use stays flat for long, high-rate flights. Also
+#                 decides how the STAGE variables are stored (compression,
+#                 chunks, float32), from define_storage() and set_storage().
+#
+#  USAGE        : called by PSL_UASDC_check_attributes.py
+#
+#  DEPENDENCIES : netCDF4, numpy
+
+import numpy as np
+from datetime import datetime
+from wmo_definitions import define_storage
+
+# how STAGE variables are stored in this process, see set_storage
+_storage = dict(define_storage(), float32=set())
+
+
+# Storage of the STAGE files written by this process: deflate level (0 for
+# none), shuffle, records per chunk, and whether the variables listed in
+# define_storage() are written as float32. None leaves a setting as it is.
+def set_storage(complevel=None, shuffle=None, chunk_records=None, float32=None):
+
+    settings = {'complevel':complevel, 'shuffle':shuffle, 'chunk_records':chunk_records}
+    _storage.update({key: value for key, value in settings.items() if value is not None})
+    if float32 is not None:
+        _storage['float32'] = define_storage()['float32'] if float32 else set()
+
+
+# The datatype and createVariable keywords of the STAGE variable name, 
+# written from the netCDF variable var. Only numeric variables with 
+# dimensions are compressed, and only double precision floats are made float32.
+def storage_args(name, var):
+
+    return storage_for(name, var.datatype, var.dimensions, var.shape)
+
+
+# as storage_args, for a variable of datatype with dimensions and shape (a
+# growing variable is chunked as if it had shape)
+def storage_for(name, datatype, dimensions, shape):
+
+    if not isinstance(datatype, np.dtype) or datatype.kind not in 'biuf' or not dimensions:
+        return datatype, dict()
+
+    if name in _storage['float32'] and datatype.kind == 'f' and datatype.itemsize > 4:
+        datatype = np.dtype('f4')
+    if _storage['complevel'] <= 0:
+        return datatype, dict()
+
+    chunksizes = (max(1, min(shape[0], _storage['chunk_records'])),)+tuple(max(1, n) for n in shape[1:])
+
+    return datatype, {'zlib':True, 'complevel':_storage['complevel'], 'shuffle':_storage['shuffle'], 'chunksizes':chunksizes}
+
+
+# the netCDF format of a STAGE file written from a RAW file in format; 
+# netCDF-3 files cannot be compressed, so they become NETCDF4_CLASSIC
+def storage_format(format):
+
+    if format.startswith('NETCDF3') and _storage['complevel'] > 0:
+        return 'NETCDF4_CLASSIC'
+
+    return format
+
+
+# number of records (first dimension) of var that fit in max_bytes
+def chunk_len(var, max_bytes=8*1024**2):
+
+    record_bytes = var.dtype.itemsize if hasattr(var.dtype, 'itemsize') else 8
+    for n in var.shape[1:]:
+        record_bytes = record_bytes*n
+
+    return max(1, int(max_bytes//max(record_bytes, 1)))
+
+
+# generator of (start, end) record ranges covering var in blocks
+def chunks(var, max_bytes=8*1024**2):
+
+    if not var.dimensions:
+        return
+    step = chunk_len(var, max_bytes)
+    for i in range(0, var.shape[0], step):
+        yield i, min(i+step, var.shape[0])
+
+
+# maximum of a netCDF variable ignoring fill values, read block by block.
+# nan if there is no valid data.
+def var_max(var, max_bytes=8*1024**2):
+
+    if not var.dimensions:
+        values = [np.ma.masked_invalid(np.ma.asarray(var.getValue(), dtype=float)).max()]
+    else:
+        values = [np.ma.masked_invalid(np.ma.asarray(var[i:j], dtype=float)).max() for i, j in chunks(var, max_bytes)]
+    values = [v for v in values if v is not np.ma.masked]
+
+    return float(max(values)) if values else np.nan
+
+
+# Decide which conversions apply to the variables of a file. file_vars maps
+# the names the variables will have (WMO names) to the netCDF variables that 
+# hold the values still to be converted. new_fname is the UASDC file name, 
+# which carries the flight time. Returns WMO name : (scale, offset).
+def plan_conversions(file_vars, new_fname, conversions, max_bytes=8*1024**2):
+
+    maxima = {name: var_max(file_vars[name], max_bytes) for name in conversions if name in file_vars}
+
+    return plan_from_max(maxima, new_fname, conversions)
+
+
+# The conversions that apply given the maximum (WMO name : value, nan if no
+# valid data) of each variable. Returns WMO name : (scale, offset).
+def plan_from_max(maxima, new_fname, conversions):
+
+    plan = dict()
+    for wmo_var_name, rule in conversions.items():
+
+        if wmo_var_name not in maxima:
+            continue
+
+        # only while still in the UAS units
+        vmax = maxima[wmo_var_name]
+        if not vmax < rule['if_max_below']:
+            continue
+
+        offset = rule['offset']
+        if offset == 'flighttime':
+            epoch = datetime(1970, 1, 1)
+            offset = (datetime.strptime(new_fname[-18:-4], '%Y%m%d%H%M%S') - epoch).total_seconds()
+
+        plan[wmo_var_name] = (rule['scale'], offset)
+
+    return plan
+
+
+# apply one planned conversion to a block of data
+def convert_block(data, scale, offset):
+
+    if scale != 1.:
+        data = data*scale
+    if offset != 0.:
+        data = data+offset
+
+    return data
+
+
+# convert a variable in place, block by block
+def convert_var(var, scale, offset, max_bytes=8*1024**2):
+
+    if not var.dimensions:
+        var.assignValue(convert_block(var.getValue(), scale, offset))
+        return
+    for i, j in chunks(var, max_bytes):
+        var[i:j] = convert_block(var[i:j], scale, offset)
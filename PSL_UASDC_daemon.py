@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_daemon.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The plumbing between the warm daemon (process_UASDC.py
+#                 --daemon) and its thin client (submit_UASDC.py). A job is
+#                 a dict ({'cmd':'process', 'basedir':..., 'filename':...})
+#                 handed over either on a Unix socket, as one JSON line that
+#                 is answered with an 'accepted' line right away and a
+#                 'result' line when the job is done, or, where there are no
+#                 Unix sockets (Windows) or the client asks for it, as a
+#                 JSON file dropped in a spool directory: spool/new/<id>.json
+#                 in, spool/done/<id>.json out. Uses nothing outside the
+#                 standard library, so the client starts in milliseconds.
+#
+#  USAGE        : called by process_UASDC.py and submit_UASDC.py
+#
+#  DEPENDENCIES : none
+
+import getpass, json, os, socket, tempfile, threading, time, uuid
+
+has_unix_sockets = hasattr(socket, 'AF_UNIX')
+
+
+# where the daemon listens unless told otherwise, one per user
+def default_socket():
+
+    return os.path.join(tempfile.gettempdir(), 'uasdc-'+getpass.getuser()+'.sock')
+
+
+def default_spool():
+
+    return os.path.join(tempfile.gettempdir(), 'uasdc-'+getpass.getuser()+'-spool')
+
+
+# read one JSON line from a socket file
+def read_message(f):
+
+    line = f.readline()
+    if not line:
+        raise ConnectionError('daemon closed the connection')
+
+    return json.loads(line)
+
+
+def send_message(f, message):
+
+    f.write(json.dumps(message)+'\n')
+    f.flush()
+
+
+# Hand job to the daemon on the Unix socket sock, or through the spool
+# directory if sock is None. With wait, block until the job is done (or
+# timeout seconds) and return the daemon's reply ({'id', 'result'} or
+# {'error'}); otherwise return as soon as the job is accepted. Raises
+# ConnectionError if no daemon answers.
+def submit(job, sock=None, spool=None, wait=True, timeout=None):
+
+    job = dict(job, id=uuid.uuid4().hex, wait=wait)
+
+    if sock is not None:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(sock)
+        except OSError as e:
+            conn.close()
+            raise ConnectionError('no daemon on '+sock+' ('+str(e)+')')
+        conn.settimeout(timeout)
+        with conn, conn.makefile('rw') as f:
+            send_message(f, job)
+            reply = read_message(f)
+            if 'error' in reply or not wait:
+                return reply
+            return read_message(f)
+
+    # the job only appears under new/ once it is complete
+    for d in ['new', 'done']:
+        os.makedirs(os.path.join(spool, d), exist_ok=True)
+    tmp = os.path.join(spool, job['id']+'.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp, os.path.join(spool, 'new', job['id']+'.json'))
+    if not wait:
+        return {'id': job['id'], 'accepted': True}
+
+    done = os.path.join(spool, 'done', job['id']+'.json')
+    start = time.time()
+    while not os.path.exists(done):
+        if timeout is not None and time.time()-start > timeout:
+            raise TimeoutError('no result for job '+job['id']+' after '+str(timeout)+' s')
+        time.sleep(0.05)
+    with open(done) as f:
+        reply = json.load(f)
+    os.remove(done)
+
+    return reply
+
+
+# Serve jobs until stopped. run_job(job) starts a job and returns a future
+# (concurrent.futures) of its result, or raises if the job is refused; it
+# is called from one thread per connection, so it must be thread safe.
+# Listens on the Unix socket sock (if not None and the platform has them)
+# and watches the spool directory spool (if not None) every interval
+# seconds. A job {'cmd':'stop'} or Ctrl-C stops the daemon; jobs already
+# running are finished by the caller.
+def serve(run_job, sock=None, spool=None, interval=0.05):
+
+    stop = threading.Event()
+
+    def handle(job):
+        if job.get('cmd') == 'stop':
+            stop.set()
+            return None
+        return run_job(job)
+
+    def result(future):
+        try:
+            return {'result': future.result()}
+        except BaseException as e:
+            return {'error': 'failed: '+str(e)}
+
+    def connection(conn):
+        with conn, conn.makefile('rw') as f:
+            try:
+                job = read_message(f)
+                try:
+                    future = handle(job)
+                except Exception as e:
+                    send_message(f, {'id': job.get('id'), 'error': 'refused: '+str(e)})
+                    return
+                send_message(f, {'id': job.get('id'), 'accepted': True})
+                if future is not None and job.get('wait', True):
+                    send_message(f, dict(result(future), id=job.get('id')))
+            except (OSError, ValueError) as e:
+                print('    Daemon: dropped a connection ('+str(e)+').')
+
+    def listen(server):
+        while not stop.is_set():
+            try:
+                conn, _ = server.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=connection, args=(conn,), daemon=True).start()
+
+    def done(job_id, future=None, error=None):
+        reply = dict(result(future) if error is None else {'error': error}, id=job_id)
+        tmp = os.path.join(spool, 'done', job_id+'.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(reply, f)
+        os.replace(tmp, os.path.join(spool, 'done', job_id+'.json'))
+
+    def watch_spool():
+        while not stop.is_set():
+            for entry in sorted(os.scandir(os.path.join(spool, 'new')), key=lambda e: e.name):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    with open(entry.path) as f:
+                        job = json.load(f)
+                    os.remove(entry.path)
+                except (OSError, ValueError):
+                    continue
+                job_id = job.get('id', entry.name[:-5])
+                try:
+                    future = handle(job)
+                except Exception as e:
+                    done(job_id, error='refused: '+str(e))
+                    continue
+                if future is not None:
+                    future.add_done_callback(lambda future, job_id=job_id: done(job_id, future))
+            stop.wait(interval)
+
+    threads = []
+    server = None
+    if sock is not None and has_unix_sockets:
+        server = bind_socket(sock)
+        threads.append(threading.Thread(target=listen, args=(server,), daemon=True))
+        print('    Daemon listening on '+sock)
+    if spool is not None:
+        for d in ['new', 'done']:
+            os.makedirs(os.path.join(spool, d), exist_ok=True)
+        threads.append(threading.Thread(target=watch_spool, daemon=True))
+        print('    Daemon watching spool '+spool)
+    for thread in threads:
+        thread.start()
+
+    try:
+        while not stop.wait(1.):
+            pass
+    except KeyboardInterrupt:
+        print('')
+        print('    Stopping the daemon.')
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if server is not None:
+            server.close()
+            os.remove(sock)
+
+
+# listen on the Unix socket sock, taking over the path if no daemon answers
+# on it (left behind by a daemon that was killed)
+def bind_socket(sock):
+
+    if os.path.exists(sock):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(sock)
+            probe.close()
+            raise RuntimeError('a daemon is already listening on '+sock)
+        except OSError:
+            probe.close()
+            os.remove(sock)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(sock)
+    os.chmod(sock, 0o600)
+    server.listen(16)
+    server.settimeout(0.5) # so a stop is noticed
+
+    return server
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_flight.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Steps 1 and 2 of the processing of one flight, shared by
+#                 process_UASDC.py and the pipeline (PSL_UASDC_pipeline.py):
+#                 the flight time and airframe of a RAW file, which give its
+#                 UASDC name, and the STAGE file written from it, checked
+#                 and QC'd, with the ledger saying what is already done.
+#
+#  USAGE        : called by process_UASDC.py and PSL_UASDC_pipeline.py
+#
+#  DEPENDENCIES : netCDF4 1.6.2+
+
+import os
+from contextlib import nullcontext
+from PSL_UASDC_check_attributes import convert_file
+from PSL_UASDC_ledger import file_hash, open_ledger, stage_done, mark_done, forget
+from PSL_UASDC_metrics import profiled
+from PSL_UASDC_schema import get_schema
+from PSL_UASDC_qc import qc_file
+
+
+# Flight time (yyyymmddhhmmssZ) and airframe ID of a RAW file, from the
+# arguments if given, otherwise from the time units and the platform_name
+# global. Returns (flighttime, airframeID, None), or (None, None, status) if
+# either cannot be found.
+def flight_info(rawfile, airframeID=None, flighttime=None):
+
+    import netCDF4 as nc
+
+    with nc.Dataset(rawfile,'r') as file:
+
+        # try to get the flight time from the file name if not passed as arg. if that
+        # fails, tell user to manually supply it.
+        if flighttime:
+            if flighttime[-1] != 'Z':
+                flighttime = flighttime+'Z'
+        else:
+            ftmp = file.variables['time'].getncattr('units')[14:-1]
+            flighttime = ftmp[0:4]+ftmp[5:7]+ftmp[8:10]+ftmp[11:13]+ftmp[14:16]+ftmp[17:19]
+            if not flighttime.isdigit():
+                print('')
+                print('    Exiting. Filename unexpected format. Please supply flighttime as argument; i.e., -t yyyymmddhhmmss')
+                print('')
+                return None, None, 'skipped, no flighttime'
+            flighttime = flighttime+'Z'
+
+        # try to get the platform ID (airframe ID) from the globals if not provided
+        if not airframeID:
+            try:
+                airframeID = file.getncattr('platform_name')
+            except:
+                print('')
+                print('    Exiting. platform_name not found in global atts. Please supply it as airframeID argument; i.e., -a name')
+                print('')
+                return None, None, 'skipped, no airframeID'
+
+    return flighttime, airframeID, None
+
+
+# Steps 1 and 2: write RAW/fname to STAGE/new_fname, checking vars and atts
+# and QC of the values (the ledger entry qc keeps the fraction flagged of
+# the worst variable), unless the ledger says the STAGE file there is the
+# one we wrote for this RAW file. overwrite (True/False, or a function asked
+# for the answer) decides whether an existing STAGE file may be replaced.
+# Returns the ledger entries of the later steps (None where not done; all
+# None after the file was written again), or None if the file was left
+# alone. With profile the check is profiled and the reports saved next to
+# the STAGE file.
+def stage_flight(base_dir, fname, new_fname, airframeID, ledger, key, done, overwrite, profile=False):
+
+    # the STAGE file is only as good as the one we wrote
+    stage_hash = None
+    if done['stage'] == new_fname and os.path.exists(base_dir+'STAGE/'+new_fname):
+        stage_hash = file_hash(base_dir+'STAGE/'+new_fname)
+        if stage_done(ledger, key, 'stage_hash') != stage_hash:
+            stage_hash = None
+
+    if stage_hash is not None:
+        print('    '+new_fname+' already in STAGE for this RAW file, skipping check.')
+        return done
+
+    if os.path.exists(base_dir+'STAGE/'+new_fname):
+        if not (overwrite() if callable(overwrite) else overwrite):
+            print('    Exiting. Nothing was accomplished.')
+            print('')
+            return None
+        os.remove(base_dir+'STAGE/'+new_fname)
+
+    # write the file from RAW to STAGE, renaming and correcting as we go
+    with profiled(base_dir+'STAGE/'+os.path.splitext(new_fname)[0]+'_check') if profile else nullcontext():
+        convert_file(base_dir+'RAW/'+fname,base_dir+'STAGE/',new_fname,airframeID)
+
+    # the values, flagged in the file before it is hashed
+    worst = '%.6f' % qc_file(base_dir+'STAGE/',new_fname,airframeID)['worst']
+
+    # anything done with an older STAGE file no longer counts
+    mark_done(ledger, key, 'stage', fname, new_fname)
+    mark_done(ledger, key, 'qc', fname, worst)
+    mark_done(ledger, key, 'stage_hash', fname, file_hash(base_dir+'STAGE/'+new_fname))
+    forget(ledger, key, ['upload', 'bufr', 'gsl', 'gsl_bufr'])
+
+    return dict({stage: None for stage in done}, qc=worst)
+
+
+# The check stage of the pipeline (PSL_UASDC_pipeline.py) for one RAW file,
+# run in a worker process. Returns a flight (dict) for the later stages, or
+# a status string if it goes no further.
+def check_flight(base_dir, fname, operatorID, airframeID, flighttime, overwrite, redo, profile=False):
+
+    flighttime, airframeID, status = flight_info(base_dir+'RAW/'+fname, airframeID, flighttime)
+    if status:
+        return status
+
+    # format: UASDC_operatorID_airframeID_YYYYMMDDHHMMSSZ.nc
+    new_fname = 'UASDC_'+operatorID+'_'+airframeID+'_'+flighttime+'.nc'
+
+    ledger = open_ledger(base_dir)
+    key = (file_hash(base_dir+'RAW/'+fname), get_schema(airframeID)['version'])
+    done = {stage: None if redo else stage_done(ledger, key, stage) for stage in ['stage', 'upload', 'bufr', 'gsl', 'qc']}
+    done = stage_flight(base_dir, fname, new_fname, airframeID, ledger, key, done, overwrite, profile)
+    ledger.close()
+    if done is None:
+        return 'skipped, already in STAGE'
+
+    return {'fname':fname, 'new_fname':new_fname, 'bufr_name':os.path.splitext(new_fname)[0]+'.bufr',
+            'operatorID':operatorID, 'airframeID':airframeID, 'key':key, 'done':done, 'sent':set(), 'uploaded':False, 'error':None}
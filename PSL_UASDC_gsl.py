@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_gsl.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Delivery of STAGE netCDFs and their BUFR files to the GSL
+#                 ftp server. Logged-in sessions are kept in a small pool
+#                 and reused, files are sent concurrently (one session each),
+#                 a transfer that drops is picked up where the server left
+#                 it with REST, and every upload is confirmed by comparing
+#                 the size on the server with the local size. Nothing
+#                 changes the working directory of the process.
+#
+#  USAGE        : called by process_UASDC.py. set_gsl() first.
+#
+#  DEPENDENCIES : none
+
+import ftplib, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from PSL_UASDC_metrics import record_stage
+
+# ftp server shared by every delivery in this process, see set_gsl
+_gsl = None
+_sessions = []
+_sessions_lock = threading.Lock()
+
+
+# Where and how to deliver: host, the directory on the server, login (empty
+# for anonymous), how many idle sessions to keep, the socket timeout and 
+# the port.
+def set_gsl(host, remote_dir, user='', passwd='', pool_size=2, timeout=60., port=21):
+
+    global _gsl
+
+    close_sessions()
+    _gsl = {'host':host, 'dir':remote_dir, 'user':user, 'passwd':passwd, 'pool_size':pool_size, 'timeout':timeout, 'port':port}
+
+
+# host and port of the ftp server, to probe the link with
+def gsl_endpoint():
+
+    return _gsl['host'], _gsl['port']
+
+
+# a logged-in session in the delivery directory, from the pool if one is
+# still alive
+def get_session():
+
+    while True:
+        with _sessions_lock:
+            session = _sessions.pop() if _sessions else None
+        if session is None:
+            break
+        try:
+            session.voidcmd('NOOP')
+            return session
+        except ftplib.all_errors:
+            session.close()
+
+    session = ftplib.FTP(timeout=_gsl['timeout'])
+    session.connect(_gsl['host'], _gsl['port'])
+    session.login(_gsl['user'], _gsl['passwd'])
+    session.cwd(_gsl['dir'])
+    session.voidcmd('TYPE I') # SIZE is in bytes in binary mode
+
+    return session
+
+
+# give a healthy session back to the pool, or log it out if the pool is full
+def put_session(session):
+
+    with _sessions_lock:
+        if len(_sessions) < _gsl['pool_size']:
+            _sessions.append(session)
+            return
+    try:
+        session.quit()
+    except ftplib.all_errors:
+        session.close()
+
+
+# log out every idle session
+def close_sessions():
+
+    with _sessions_lock:
+        sessions = _sessions[:]
+        del _sessions[:]
+    for session in sessions:
+        try:
+            session.quit()
+        except ftplib.all_errors:
+            session.close()
+
+
+# size of name on the server, None if it is not there
+def remote_size(session, name):
+
+    try:
+        return session.size(name)
+    except ftplib.error_perm:
+        return None
+
+
+# Send one file. The first attempt always sends the whole file; when the
+# connection drops, later attempts ask the server how much arrived and send
+# the rest with REST. With skip_same_size a file already on the server with
+# the same size is not sent again. Recorded as stage gsl, with the bytes
+# sent over all attempts. Returns True once the size on the server matches
+# the local size.
+def send_file(fullfile, retries=3, skip_same_size=False):
+
+    name = os.path.basename(fullfile)
+    size = os.path.getsize(fullfile)
+    first = time.time()
+    nbytes = 0
+
+    for attempt in range(retries+1):
+        session = None
+        try:
+            session = get_session()
+            offset = 0
+            if attempt > 0 or skip_same_size:
+                offset = remote_size(session, name) or 0
+                if skip_same_size and attempt == 0:
+                    if offset == size:
+                        print('    '+name+' already on GSL, skipping.')
+                        put_session(session)
+                        record_stage('gsl', time.time()-first, file=name, skipped=True)
+                        return True
+                    offset = 0
+                if offset >= size:
+                    offset = 0
+
+            start = time.time()
+            with open(fullfile, 'rb') as file:
+                file.seek(offset)
+                session.storbinary('STOR '+name, file, rest=offset if offset else None)
+
+            sent = remote_size(session, name)
+            put_session(session)
+            nbytes = nbytes+size-offset
+            if sent == size:
+                print(f"    {name} sent to GSL{' (resumed at '+str(offset)+' bytes)' if offset else ''}: {(size-offset)/1024:.1f} kB in {time.time()-start:.2f} s")
+                record_stage('gsl', time.time()-first, file=name, bytes=nbytes, retries=attempt)
+                return True
+            print('    '+name+' is '+str(sent)+' bytes on GSL, expected '+str(size)+'. Sending again.')
+
+        except ftplib.all_errors as e:
+            if session is not None:
+                session.close()
+            print('    GSL transfer of '+name+' failed ('+str(e)+'), attempt '+str(attempt+1)+' of '+str(retries+1)+'.')
+            if attempt < retries:
+                time.sleep(min(2**attempt, 30))
+
+    record_stage('gsl', time.time()-first, file=name, bytes=nbytes, retries=retries, ok=False)
+    return False
+
+
+# Send files at once, at most nthreads (default: the pool size) at a time,
+# each over its own pooled session. nthreads=1 pushes them one after the 
+# other over one connection. Files that do not exist are left out. Returns a
+# dict of fullfile : True/False.
+def send_files(fullfiles, nthreads=None, retries=3, skip_same_size=False):
+
+    fullfiles = [f for f in fullfiles if os.path.exists(f)]
+    nthreads = _gsl['pool_size'] if nthreads is None else nthreads
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+        sent = executor.map(lambda f: send_file(f, retries, skip_same_size), fullfiles)
+
+    return dict(zip(fullfiles, sent))
+
+
+# the BUFR (if we have it) and the netCDF that go to GSL for a STAGE file
+def gsl_files(base_dir, new_fname):
+
+    bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
+
+    return [f for f in [base_dir+'BUFR/'+bufr_name, base_dir+'STAGE/'+new_fname] if os.path.exists(f)]
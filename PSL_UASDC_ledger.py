@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_ledger.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : A processing ledger kept in base_dir as an SQLite file.
+#                 Each RAW file is identified by a hash of its contents plus
+#                 the version of wmo_definitions, and the ledger records 
+#                 which steps (stage, upload, bufr, gsl) have finished for it,
+#                 with details such as the hash of the STAGE file or the S3 
+#                 ETag. process_UASDC.py uses it to skip work that is 
+#                 already done when files are processed again.
+#
+#  USAGE        : called by process_UASDC.py
+#
+#  DEPENDENCIES : none
+
+import hashlib, sqlite3, time
+
+ledger_name = 'UASDC_ledger.sqlite'
+
+
+# sha256 of a file's contents, read in blocks
+def file_hash(fullfile, blocksize=1024**2):
+
+    sha = hashlib.sha256()
+    with open(fullfile, 'rb') as file:
+        for block in iter(lambda: file.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+# connect to the ledger in base_dir, creating it if needed. Several batch
+# workers may write at once, so use WAL and wait for locks.
+def open_ledger(base_dir):
+
+    conn = sqlite3.connect(base_dir+ledger_name, timeout=60)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS stages (
+                        hash     TEXT,
+                        spec     TEXT,
+                        stage    TEXT,
+                        fname    TEXT,
+                        detail   TEXT,
+                        finished REAL,
+                        PRIMARY KEY (hash, spec, stage))''')
+    conn.commit()
+
+    return conn
+
+
+# returns the detail recorded for a finished stage, or None if not done
+def stage_done(conn, key, stage):
+
+    row = conn.execute('SELECT detail FROM stages WHERE hash=? AND spec=? AND stage=?', (key[0], key[1], stage)).fetchone()
+
+    return None if row is None else row[0]
+
+
+# record a finished stage. key is (RAW file hash, spec version)
+def mark_done(conn, key, stage, fname, detail=''):
+
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO stages VALUES (?,?,?,?,?,?)', (key[0], key[1], stage, fname, detail, time.time()))
+
+
+# forget stages of a file (all of them if stages is None), e.g. the ones 
+# that were done with a STAGE file that has since been rewritten
+def forget(conn, key, stages=None):
+
+    with conn:
+        if stages is None:
+            conn.execute('DELETE FROM stages WHERE hash=? AND spec=?', key)
+        for stage in stages or []:
+            conn.execute('DELETE FROM stages WHERE hash=? AND spec=? AND stage=?', (key[0], key[1], stage))
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_metrics.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Instrumentation for the processing steps. Every stage
+#                 (opening the netCDF, attributes, data, S3 upload, BUFR
+#                 wait, GSL) is timed, with the bytes it moved, how many
+#                 times it had to retry and the peak memory of the process,
+#                 and written as one JSON line per stage to a metrics file
+#                 that all worker processes append to. The metrics file can
+#                 be summed up into a Prometheus textfile (node_exporter
+#                 textfile collector). profiled() wraps a block of code in
+#                 cProfile and tracemalloc and saves the reports.
+#
+#  USAGE        : called by process_UASDC.py and quicklooks.py
+#
+#  DEPENDENCIES : none
+
+import cProfile, io, json, os, pstats, socket, sys, time, tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+# metrics file of this process, see set_metrics
+_jsonl = None
+
+
+# Write the metrics of this process to jsonl (None to only time things)
+def set_metrics(jsonl=None):
+
+    global _jsonl
+
+    _jsonl = jsonl
+
+
+# peak resident memory of this process so far, in MB (None if unknown)
+def peak_rss_mb():
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kB on Linux, bytes on macOS
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+
+# Write one stage record: stage name, seconds and any other fields (file,
+# bytes, retries, ok, error).
+def record_stage(stage, seconds, **fields):
+
+    record = {'time': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ'), 'host': socket.gethostname(),
+              'pid': os.getpid(), 'stage': stage, 'seconds': round(seconds, 6), 'bytes': 0, 'retries': 0, 'ok': True,
+              'peak_rss_mb': peak_rss_mb()}
+    record.update(fields)
+    if _jsonl is not None:
+        # one write per line, so lines from several processes do not mix
+        with open(_jsonl, 'a') as f:
+            f.write(json.dumps(record)+'\n')
+
+    return record
+
+
+# Time the block as stage. The block can fill in the yielded dict (bytes,
+# retries, ok, ...); an exception marks the stage as failed and is passed on.
+@contextmanager
+def timed(stage, fname='', **fields):
+
+    fields = dict({'bytes':0, 'retries':0}, **fields, file=fname)
+    start = time.perf_counter()
+    try:
+        yield fields
+    except BaseException as e:
+        fields.update(ok=False, error=repr(e))
+        raise
+    finally:
+        record_stage(stage, time.perf_counter()-start, **fields)
+
+
+# Sum the records in jsonl up by stage into a Prometheus textfile (written
+# to a temporary file and moved into place, as the textfile collector wants).
+def write_prometheus(jsonl, prom):
+
+    totals = dict()
+    with open(jsonl) as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except ValueError:
+                continue
+            t = totals.setdefault(r['stage'], {'runs':0, 'failures':0, 'seconds':0., 'bytes':0, 'retries':0, 'last_seconds':0., 'peak_rss_mb':0.})
+            t['runs'] = t['runs']+1
+            t['failures'] = t['failures']+(not r.get('ok', True))
+            t['seconds'] = t['seconds']+r['seconds']
+            t['bytes'] = t['bytes']+(r.get('bytes') or 0)
+            t['retries'] = t['retries']+(r.get('retries') or 0)
+            t['last_seconds'] = r['seconds']
+            t['peak_rss_mb'] = max(t['peak_rss_mb'], r.get('peak_rss_mb') or 0.)
+
+    metrics = [('uasdc_stage_runs_total', 'counter', 'runs', 'Stage runs'),
+               ('uasdc_stage_failures_total', 'counter', 'failures', 'Stage runs that failed'),
+               ('uasdc_stage_seconds_total', 'counter', 'seconds', 'Time spent in the stage'),
+               ('uasdc_stage_bytes_total', 'counter', 'bytes', 'Bytes moved by the stage'),
+               ('uasdc_stage_retries_total', 'counter', 'retries', 'Retries in the stage'),
+               ('uasdc_stage_last_seconds', 'gauge', 'last_seconds', 'Duration of the last run of the stage'),
+               ('uasdc_stage_peak_rss_bytes', 'gauge', 'peak_rss_mb', 'Largest peak memory of a process running the stage')]
+    lines = []
+    for name, kind, key, help in metrics:
+        lines.append('# HELP '+name+' '+help)
+        lines.append('# TYPE '+name+' '+kind)
+        for stage in sorted(totals):
+            value = totals[stage][key]*1024**2 if key == 'peak_rss_mb' else totals[stage][key]
+            lines.append(name+'{stage="'+stage+'"} '+repr(float(value)))
+
+    with open(prom+'.tmp', 'w') as f:
+        f.write('\n'.join(lines)+'\n')
+    os.replace(prom+'.tmp', prom)
+
+
+# Profile the block with cProfile and tracemalloc and save the reports as
+# prefix+'.prof' (for pstats/snakeviz) and prefix+'_profile.txt' (the top
+# functions by cumulative time and the lines that allocated the most).
+@contextmanager
+def profiled(prefix, nlines=30):
+
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'): # Python 3.9+
+        tracemalloc.reset_peak()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+        profiler.dump_stats(prefix+'.prof')
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(nlines)
+        report.write('Python memory: peak %.1f MB, %.1f MB still allocated at the end\n\n' % (peak/1024**2, current/1024**2))
+        for stat in snapshot.statistics('lineno')[:nlines]:
+            report.write(str(stat)+'\n')
+        with open(prefix+'_profile.txt', 'w') as f:
+            f.write(report.getvalue())
+        print('    Profile written to '+prefix+'.prof and '+prefix+'_profile.txt')
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_outbox.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Store-and-forward delivery. Every STAGE netCDF and BUFR
+#                 file that is to go somewhere enters the outbox before it
+#                 is sent: the file is linked (or copied) into OUTBOX/ in
+#                 the base directory and an entry (file, destination) is
+#                 added to an outbox table in the ledger. Destinations are
+#
+#                   s3   : the netCDF to the entry bucket
+#                   bufr : the BUFR of the netCDF, to fetch from the
+#                          product bucket once the Synoptic pipeline has
+#                          made it (no file in OUTBOX/)
+#                   gsl  : the netCDF or the BUFR to the GSL ftp server
+#
+#                 and an entry only leaves the outbox once it is delivered,
+#                 so nothing is lost when the link is down or the laptop is
+#                 shut off. A sender (run_sender) probes S3 and GSL with a
+#                 plain TCP connect and, as soon as one answers, drains its
+#                 entries newest flight first, so after an outage the latest
+#                 profile reaches the models first. An entry is claimed for
+#                 the time it is being sent, so the sender and a process
+#                 working on the same flight never send it both.
+#
+#  USAGE        : called by process_UASDC.py and PSL_UASDC_pipeline.py
+#
+#  DEPENDENCIES : Boto3 Python module supported for Python 3.8+
+
+import os, shutil, socket, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from PSL_UASDC_ledger import open_ledger, stage_done, mark_done
+from PSL_UASDC_uploadfiles import upload_file, fetch_bufr, s3_endpoint
+from PSL_UASDC_gsl import send_file, gsl_endpoint
+from PSL_UASDC_metrics import record_stage
+
+outbox_dir = 'OUTBOX/'
+
+# entries are claimed for this long while they are sent
+claim_seconds = 3600.
+
+
+# connect to the ledger in base_dir with its outbox table
+def open_outbox(base_dir):
+
+    conn = open_ledger(base_dir)
+    conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                        name       TEXT,
+                        dest       TEXT,
+                        flighttime TEXT,
+                        new_fname  TEXT,
+                        rawname    TEXT,
+                        operatorID TEXT,
+                        airframeID TEXT,
+                        hash       TEXT,
+                        spec       TEXT,
+                        added      REAL,
+                        attempts   INTEGER,
+                        error      TEXT,
+                        claimed    REAL,
+                        PRIMARY KEY (name, dest))''')
+    conn.commit()
+
+    return conn
+
+
+# Put a file in the outbox for dest. flight has the fname (RAW), new_fname,
+# operatorID, airframeID and key (ledger key) of the flight it belongs to.
+# fullfile is linked into OUTBOX/ (copied where links are not possible);
+# for dest bufr it is None and the entry is new_fname. A file that is
+# already in the outbox is replaced and its entry starts over.
+def enqueue(conn, base_dir, fullfile, dest, flight):
+
+    name = os.path.basename(fullfile) if fullfile else flight['new_fname']
+    if fullfile:
+        os.makedirs(base_dir+outbox_dir, exist_ok=True)
+        spooled = base_dir+outbox_dir+name
+        # already there as a link (e.g. the netCDF for GSL after S3)
+        if not (os.path.exists(spooled) and os.path.samefile(fullfile, spooled)):
+            if os.path.exists(spooled+'.tmp'):
+                os.remove(spooled+'.tmp')
+            try:
+                os.link(fullfile, spooled+'.tmp')
+            except OSError:
+                shutil.copyfile(fullfile, spooled+'.tmp')
+            os.replace(spooled+'.tmp', spooled)
+
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO outbox VALUES (?,?,?,?,?,?,?,?,?,?,0,'',0)",
+                     (name, dest, flight['new_fname'].split('_')[-1][:14], flight['new_fname'], flight['fname'],
+                      flight['operatorID'], flight['airframeID'], flight['key'][0], flight['key'][1], time.time()))
+        conn.execute("UPDATE outbox SET added=?, attempts=0, error='' WHERE name=? AND dest=?", (time.time(), name, dest))
+
+
+# Take an entry out of the outbox, and its file once no other entry needs it
+def dequeue(conn, base_dir, name, dest):
+
+    with conn:
+        conn.execute('DELETE FROM outbox WHERE name=? AND dest=?', (name, dest))
+        others = conn.execute("SELECT COUNT(*) FROM outbox WHERE name=? AND dest IN ('s3', 'gsl')", (name,)).fetchone()[0]
+    if not others and os.path.exists(base_dir+outbox_dir+name):
+        os.remove(base_dir+outbox_dir+name)
+
+
+# the entries waiting, newest flight first, as dicts. With dests, only
+# those for these destinations.
+def pending(conn, dests=None):
+
+    cursor = conn.execute('SELECT * FROM outbox ORDER BY flighttime DESC, added DESC')
+    columns = [c[0] for c in cursor.description]
+    entries = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    return [e for e in entries if dests is None or e['dest'] in dests]
+
+
+# Claim an entry for sending. Returns the entry, or None if it is not in
+# the outbox or someone else is sending it (or, for bufr, it is not due).
+def claim(conn, name, dest):
+
+    now = time.time()
+    with conn:
+        claimed = conn.execute('UPDATE outbox SET claimed=? WHERE name=? AND dest=? AND claimed<?', (now+claim_seconds, name, dest, now)).rowcount
+    if not claimed:
+        return None
+    entries = [e for e in pending(conn, [dest]) if e['name'] == name]
+
+    return entries[0] if entries else None
+
+
+# give a claimed entry back after a failed attempt, to be tried again from
+# not_before on
+def release(conn, name, dest, error='', not_before=0.):
+
+    with conn:
+        conn.execute('UPDATE outbox SET claimed=?, attempts=attempts+1, error=? WHERE name=? AND dest=?', (not_before, error, name, dest))
+
+
+# Can a TCP connection be made to endpoint (host, port)? A cheap probe of
+# the link that sends no data.
+def reachable(endpoint, timeout=3.):
+
+    try:
+        socket.create_connection(endpoint, timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+# Send one outbox entry, recording it in the ledger as process_file would:
+#
+#   s3   : upload, then the BUFR of the file is looked for (bufr entry)
+#   bufr : fetch the BUFR if it is there yet, and queue it for GSL if the
+#          netCDF goes there; after bufr_expire seconds it is given up
+#   gsl  : send; the ledger entry gsl says which BUFR (if any) is on GSL
+#          with the netCDF, as in process_file
+#
+# Opens its own ledger connection, so it can run in any thread or process.
+# Returns True once delivered, False if it stays in the outbox, None if the
+# entry is not in the outbox or is being sent by someone else.
+def deliver(base_dir, name, dest, retries=3, bufr_expire=6*3600., bufr_every=60.):
+
+    conn = open_outbox(base_dir)
+    try:
+        entry = claim(conn, name, dest)
+        if entry is None:
+            return None
+        key = (entry['hash'], entry['spec'])
+        bufr_name = os.path.splitext(entry['new_fname'])[0]+'.bufr'
+        flight = {'fname':entry['rawname'], 'new_fname':entry['new_fname'], 'operatorID':entry['operatorID'],
+                  'airframeID':entry['airframeID'], 'key':key}
+        ok, error, not_before = False, '', 0.
+
+        try:
+            if dest == 's3':
+                etag = upload_file(base_dir+outbox_dir, name, entry['operatorID'], entry['airframeID'], base_dir+'RAW/'+entry['rawname'], retries)
+                if etag:
+                    mark_done(conn, key, 'upload', entry['rawname'], etag)
+                    enqueue(conn, base_dir, None, 'bufr', flight)
+                    ok = True
+
+            elif dest == 'bufr':
+                os.makedirs(base_dir+'BUFR/', exist_ok=True)
+                ok = fetch_bufr(base_dir+'BUFR/', name, entry['operatorID'], entry['airframeID'])
+                if ok:
+                    mark_done(conn, key, 'bufr', entry['rawname'], bufr_name)
+                    to_gsl = stage_done(conn, key, 'gsl') is not None or any(e['name'] == name for e in pending(conn, ['gsl']))
+                    if to_gsl and stage_done(conn, key, 'gsl_bufr') != bufr_name:
+                        enqueue(conn, base_dir, base_dir+'BUFR/'+bufr_name, 'gsl', flight)
+                elif time.time()-entry['added'] > bufr_expire:
+                    print('    No bufr file for '+name+' after '+'%.1f' % (bufr_expire/3600)+' h, no longer looking.')
+                    dequeue(conn, base_dir, name, dest)
+                    return False
+                else:
+                    not_before = time.time()+bufr_every
+
+            elif dest == 'gsl':
+                ok = send_file(base_dir+outbox_dir+name, retries)
+                if ok and name == bufr_name:
+                    mark_done(conn, key, 'gsl_bufr', entry['rawname'], bufr_name)
+                    if stage_done(conn, key, 'gsl') is not None:
+                        mark_done(conn, key, 'gsl', entry['rawname'], bufr_name)
+                elif ok:
+                    mark_done(conn, key, 'gsl', entry['rawname'], stage_done(conn, key, 'gsl_bufr') or '')
+
+        except Exception as e:
+            print('    Delivery of '+name+' ('+dest+') failed: '+str(e))
+            error = str(e)
+
+        if ok:
+            dequeue(conn, base_dir, name, dest)
+            record_stage('outbox_wait', time.time()-entry['added'], file=name, dest=dest, retries=entry['attempts'])
+        else:
+            release(conn, name, dest, error, not_before)
+
+        return ok
+    finally:
+        conn.close()
+
+
+# Deliver the entries for dests, newest flight first, while endpoint can
+# be reached. An entry that fails while the endpoint still answers is left
+# for the next round and the next one is tried. Returns the number delivered.
+def drain(base_dir, dests, endpoint, stop=None, retries=0):
+
+    tried = set()
+    delivered = 0
+    while stop is None or not stop.is_set():
+        conn = open_outbox(base_dir)
+        now = time.time()
+        entries = [e for e in pending(conn, dests) if e['claimed'] < now and (e['name'], e['dest']) not in tried]
+        conn.close()
+        if not entries:
+            break
+        entry = entries[0]
+        tried.add((entry['name'], entry['dest']))
+        ok = deliver(base_dir, entry['name'], entry['dest'], retries)
+        if ok:
+            delivered = delivered+1
+        elif ok is False and entry['dest'] != 'bufr' and not reachable(endpoint):
+            break
+
+    return delivered
+
+
+# Background sender: every interval seconds, probe S3 and GSL and drain
+# the outbox to whichever can be reached (each over its own thread, so one
+# link being down does not hold up the other), until stop is set.
+def run_sender(base_dir, stop=None, interval=30.):
+
+    stop = stop if stop is not None else threading.Event()
+    links = {'S3': (['s3', 'bufr'], s3_endpoint()), 'GSL': (['gsl'], gsl_endpoint())}
+    up = {link: None for link in links}
+
+    conn = open_outbox(base_dir)
+    waiting = pending(conn)
+    conn.close()
+    print('    Outbox sender for '+base_dir+outbox_dir+', '+str(len(waiting))+' entries waiting.')
+
+    def send(link):
+        dests, endpoint = links[link]
+        conn = open_outbox(base_dir)
+        waiting = pending(conn, dests)
+        conn.close()
+        if not waiting:
+            return
+        now = reachable(endpoint)
+        if now != up[link]:
+            print('    '+time.strftime('%H:%M:%S')+' '+link+' is '+('reachable, sending '+str(len(waiting))+' entries.' if now else 'not reachable, '+str(len(waiting))+' entries wait in the outbox.'))
+            up[link] = now
+        if now:
+            drain(base_dir, dests, endpoint, stop)
+
+    with ThreadPoolExecutor(max_workers=len(links)) as executor:
+        while not stop.is_set():
+            list(executor.map(send, links))
+            stop.wait(interval)
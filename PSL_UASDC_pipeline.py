@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_pipeline.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The steps of process_UASDC.py as an asyncio pipeline for
+#                 clearing a backlog of flights. Each step is a stage with
+#                 its own number of workers, and stages hand flights on
+#                 through bounded queues:
+#
+#                   check --> S3 upload --> BUFR poll --> GSL (BUFR)
+#                     \
+#                      `--> GSL (netCDF)
+#
+#                 so the netCDF goes to GSL while it goes to S3, and later
+#                 flights are checked and uploaded while earlier ones are
+#                 still waiting for their BUFR. The check runs in worker
+#                 processes (netCDF4/HDF5 is not thread safe), transfers in
+#                 threads, and the BUFR wait is an asyncio sleep that holds
+#                 no thread at all. The ledger is honoured as in
+#                 process_file, and the y/n prompts are answered by a policy.
+#                 Transfers go through the outbox (PSL_UASDC_outbox.py), so
+#                 whatever fails is left there for the outbox sender.
+#
+#  USAGE        : called by process_UASDC.py (--pipeline)
+#
+#  DEPENDENCIES : netCDF4 1.6.2+, Boto3 Python module supported for Python 3.8+
+
+import asyncio, os, random, time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from PSL_UASDC_uploadfiles import fetch_bufr
+from PSL_UASDC_ledger import stage_done, mark_done
+from PSL_UASDC_outbox import open_outbox, enqueue, dequeue, deliver
+from PSL_UASDC_metrics import record_stage
+from PSL_UASDC_flight import check_flight
+from PSL_UASDC_qc import qc_held
+
+# workers per stage, see run_pipeline
+default_limits = {'check':2, 'upload':4, 'bufr':16, 'gsl':2}
+
+
+# the status of a flight once it has left the pipeline, as in process_file
+def flight_status(flight):
+
+    if flight['error']:
+        return flight['error']
+    if not flight['uploaded']:
+        return 'staged, not uploaded'
+    if flight['new_fname'] in flight['sent']:
+        return 'uploaded and sent to GSL'
+
+    return 'uploaded, not sent to GSL'
+
+
+# Run RAW files through check, S3 upload, BUFR poll and GSL delivery with
+# bounded queues (queue_size flights) between stages and limits[stage]
+# workers per stage (see default_limits). answers are the policy answers of
+# process_UASDC.py ({'overwrite':'y', 'upload':'y', 'gsl':'y'}). Each
+# flight waits up to bufr_deadline seconds after its upload for the BUFR.
+# initializer(*initargs) is run in each check process and in this one.
+# profile profiles the check of each file (see stage_flight). Returns a dict
+# of fname : status and one of stage : busy seconds.
+async def run_pipeline(base_dir, fnames, operatorID, airframeID=None, flighttime=None, answers=None, redo=False,
+                       limits=None, queue_size=8, bufr_deadline=120., first_wait=2., max_wait=30., initializer=None, initargs=(),
+                       profile=False):
+
+    answers = answers if answers else {'overwrite':'n', 'upload':'y', 'gsl':'y'}
+    limits = dict(default_limits, **(limits if limits else {}))
+    if initializer is not None:
+        initializer(*initargs)
+
+    loop = asyncio.get_running_loop()
+    processes = ProcessPoolExecutor(max_workers=limits['check'], initializer=initializer, initargs=initargs)
+    threads = ThreadPoolExecutor(max_workers=limits['upload']+limits['bufr']+limits['gsl'])
+    queues = {stage: asyncio.Queue(maxsize=queue_size) for stage in ['check', 'upload', 'bufr', 'gsl']}
+    results = dict()
+    busy = {stage: 0. for stage in queues}
+
+    # the ledger is only written from this thread (and by deliver, which
+    # has its own connection)
+    ledger = open_outbox(base_dir)
+
+    async def run(stage, executor, fn, *args):
+        start = time.time()
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        finally:
+            busy[stage] = busy[stage]+time.time()-start
+
+    async def check():
+        while True:
+            fname = await queues['check'].get()
+            try:
+                flight = await run('check', processes, check_flight, base_dir, fname, operatorID, airframeID, flighttime, answers['overwrite'] == 'y', redo, profile)
+                if isinstance(flight, str):
+                    results[fname] = flight
+                    continue
+                results[fname] = flight
+                done = flight['done']
+                if answers['upload'] != 'y' and not done['upload']:
+                    continue
+                if qc_held(done['qc']) and not done['upload']:
+                    print('    '+flight['new_fname']+' failed QC, not uploading.')
+                    flight['error'] = 'staged, held back by QC'
+                    continue
+
+                # the netCDF goes to GSL while it goes to the bucket
+                if done['gsl'] is not None:
+                    flight['sent'].add(flight['new_fname'])
+                elif answers['gsl'] == 'y':
+                    enqueue(ledger, base_dir, base_dir+'STAGE/'+flight['new_fname'], 'gsl', flight)
+                    await queues['gsl'].put((flight, flight['new_fname']))
+
+                if done['upload']:
+                    print('    '+flight['new_fname']+' already uploaded to bucket, skipping upload.')
+                    flight['uploaded'] = True
+                    await queues['bufr'].put((flight, time.time()))
+                else:
+                    enqueue(ledger, base_dir, base_dir+'STAGE/'+flight['new_fname'], 's3', flight)
+                    await queues['upload'].put(flight)
+            except Exception as e:
+                results[fname] = 'failed: '+str(e)
+            finally:
+                queues['check'].task_done()
+
+    async def upload():
+        while True:
+            flight = await queues['upload'].get()
+            try:
+                uploaded = await run('upload', threads, deliver, base_dir, flight['new_fname'], 's3')
+                if not uploaded:
+                    flight['error'] = 'queued for upload' if uploaded is None else 'upload failed, queued for upload'
+                    continue
+                flight['uploaded'] = True
+                await queues['bufr'].put((flight, time.time()))
+            except Exception as e:
+                flight['error'] = 'failed: '+str(e)
+            finally:
+                queues['upload'].task_done()
+
+    async def bufr():
+        while True:
+            flight, uploaded = await queues['bufr'].get()
+            try:
+                path = base_dir+'BUFR/'
+                found = flight['done']['bufr'] and os.path.exists(path+flight['bufr_name'])
+                wait = first_wait/2
+                checks = 0
+                while not found:
+                    found = await run('bufr', threads, fetch_bufr, path, flight['new_fname'], flight['operatorID'], flight['airframeID'])
+                    checks = checks+1
+                    if found:
+                        mark_done(ledger, flight['key'], 'bufr', flight['fname'], flight['bufr_name'])
+                        dequeue(ledger, base_dir, flight['new_fname'], 'bufr')
+                        record_stage('bufr_wait', time.time()-uploaded, file=flight['new_fname'], retries=checks-1)
+                    elif time.time()-uploaded >= bufr_deadline:
+                        print('    No bufr file found in product bucket for '+flight['new_fname']+' after '+str(bufr_deadline)+' s.')
+                        record_stage('bufr_wait', time.time()-uploaded, file=flight['new_fname'], retries=checks-1, ok=False, error='deadline')
+                        break
+                    else:
+                        wait = min(wait*2, max_wait)
+                        await asyncio.sleep(min(wait*random.uniform(0.5, 1.), max(0., uploaded+bufr_deadline-time.time())))
+                # not if it is on GSL already, as in process_file
+                if found and answers['gsl'] == 'y' and flight['done']['gsl'] != flight['bufr_name'] and (redo or stage_done(ledger, flight['key'], 'gsl_bufr') != flight['bufr_name']):
+                    enqueue(ledger, base_dir, path+flight['bufr_name'], 'gsl', flight)
+                    await queues['gsl'].put((flight, flight['bufr_name']))
+            except Exception as e:
+                flight['error'] = 'failed: '+str(e)
+            finally:
+                queues['bufr'].task_done()
+
+    async def gsl():
+        while True:
+            flight, name = await queues['gsl'].get()
+            try:
+                if await run('gsl', threads, deliver, base_dir, name, 'gsl'):
+                    flight['sent'].add(name)
+                else:
+                    flight['error'] = 'uploaded, GSL transfer failed, queued for GSL'
+            except Exception as e:
+                flight['error'] = 'failed: '+str(e)
+            finally:
+                queues['gsl'].task_done()
+
+    start = time.time()
+    workers = [asyncio.ensure_future(worker()) for worker, stage in [(check, 'check'), (upload, 'upload'), (bufr, 'bufr'), (gsl, 'gsl')] for n in range(limits[stage])]
+    try:
+        for fname in fnames:
+            await queues['check'].put(fname)
+
+        # each stage only feeds the ones after it
+        for stage in queues:
+            await queues[stage].join()
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        processes.shutdown()
+        threads.shutdown()
+        ledger.close()
+
+    busy['total'] = time.time()-start
+
+    return {fname: flight_status(r) if isinstance(r, dict) else r for fname, r in results.items()}, busy
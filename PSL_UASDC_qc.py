@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_qc.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Quality control of the values of a STAGE file before it is
+#                 uploaded. The WMO variables are checked as define_qc() in
+#                 wmo_definitions.py says, for range, spikes, stuck sensors,
+#                 vertical gradients and time that does not increase. The
+#                 checks are NumPy operations on blocks of records (read
+#                 with a few records of overlap, so neighbours across block
+#                 edges are seen), so a long, high-rate flight takes no more
+#                 memory than a short one, plus one byte per record for the
+#                 flags of each variable.
+#
+#                 The results go in the file as CF flag variables, <name>_qc
+#                 (flag_masks/flag_meanings, linked from the variable by
+#                 ancillary_variables), and in a summary, STAGE/<name>_qc.json,
+#                 with the number of records each check flagged. Files with
+#                 a variable flagged in more than a fraction of its records
+#                 can be held back from S3 and GSL (see set_qc).
+#
+#  USAGE        : called by PSL_UASDC_pipeline.py
+#
+#  DEPENDENCIES : netCDF4, numpy
+
+import json, os, time
+import numpy as np
+import netCDF4 as nc
+from collections import OrderedDict
+from PSL_UASDC_schema import get_schema
+from PSL_UASDC_convert import chunk_len, storage_for
+from PSL_UASDC_metrics import record_stage
+
+# the bit each check sets in a flag
+flag_bits = OrderedDict([('out_of_range', 1), ('spike', 2), ('stuck_sensor', 4), ('excessive_vertical_gradient', 8), ('time_not_increasing', 16)])
+
+# a gradient is taken over at most this many records
+max_lag = 100
+
+# hold files back from upload in this process, see set_qc
+_qc = {'hold':None}
+
+
+# Files with a variable flagged in more than hold (a fraction, 0 to 1) of
+# its valid records are staged but not uploaded; None uploads everything.
+def set_qc(hold=None):
+
+    _qc['hold'] = hold
+
+
+# Is a file whose worst variable had a fraction worst of its records flagged
+# (as a string, the way the ledger keeps it) held back from upload?
+def qc_held(worst):
+
+    if _qc['hold'] is None or worst is None or worst == '':
+        return False
+
+    return float(worst) > _qc['hold']
+
+
+# Flags of the records of x (block of records i0 on, with the ones before at
+# x[:pad]) for range, spike and gradient, as int8 for the records x[pad:end]
+def block_flags(x, z, checks, pad, end, gradient_dz, lag):
+
+    flags = np.zeros(end-pad, dtype=np.int8)
+    xb = x[pad:end]
+    valid = np.isfinite(xb)
+
+    if 'range' in checks:
+        lo, hi = checks['range']
+        flags[valid & ((xb < lo) | (xb > hi))] |= flag_bits['out_of_range']
+
+    # departure from the mean of the two neighbours, less half their difference
+    if 'spike' in checks and len(x) > 2:
+        prev, nxt = x[pad-1:end-1] if pad > 0 else np.r_[np.nan, x[:end-1]], x[pad+1:end+1]
+        nxt = np.r_[nxt, np.full(end-pad-len(nxt), np.nan)]
+        with np.errstate(invalid='ignore'):
+            test = np.abs(xb-(nxt+prev)/2)-np.abs((nxt-prev)/2)
+        flags[test > checks['spike']] |= flag_bits['spike']
+
+    # change per m against the record lag back, where that is far enough away
+    if 'gradient' in checks and z is not None and lag < len(x):
+        start = max(pad, lag)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dz = z[start:end]-z[start-lag:end-lag]
+            grad = (x[start:end]-x[start-lag:end-lag])/dz
+        bad = (np.abs(dz) >= gradient_dz/2) & (np.abs(grad) > checks['gradient'])
+        flags[start-pad:][bad] |= flag_bits['excessive_vertical_gradient']
+
+    if checks.get('increasing'):
+        prev = x[pad-1:end-1] if pad > 0 else np.r_[np.nan, x[:end-1]]
+        with np.errstate(invalid='ignore'):
+            flags[valid & ~(xb > prev) & np.isfinite(prev)] |= flag_bits['time_not_increasing']
+
+    return flags
+
+
+# Flag the runs of values that stay exactly the same for at least seconds
+# (t the times of the records x, i0 the index of x[0] in the file). state
+# carries the run still going at the end of the block to the next one.
+def stuck_flags(x, t, i0, flags, seconds, state):
+
+    with np.errstate(invalid='ignore'):
+        changed = np.r_[not x[0] == state.get('value', np.nan), x[1:] != x[:-1]]
+    starts = np.flatnonzero(changed)
+    start_i, start_t = i0+starts, t[starts]
+    if not changed[0]:
+        start_i, start_t = np.r_[state['start_i'], start_i], np.r_[state['start_t'], start_t]
+    runid = np.cumsum(changed)-(1 if changed[0] else 0)
+    end_t = t[np.r_[starts[1:] if changed[0] else starts, len(x)]-1]
+
+    with np.errstate(invalid='ignore'):
+        long = end_t-start_t >= seconds
+    flags[i0:i0+len(x)][long[runid]] |= flag_bits['stuck_sensor']
+    if not changed[0] and long[0]:
+        flags[state['start_i']:i0] |= flag_bits['stuck_sensor']
+
+    state.update(value=x[-1], start_i=start_i[-1], start_t=start_t[-1])
+
+
+# QC of the STAGE file path+new_fname, checked by the schema of airframeID.
+# Adds or rewrites the <name>_qc variables and writes the summary. Returns
+# the summary: for each checked variable the valid records and the number
+# flagged by each check and by any, the fraction flagged of the worst
+# variable (worst) and the seconds it took.
+def qc_file(path, new_fname, airframeID, max_bytes=8*1024**2):
+
+    start = time.time()
+    schema = get_schema(airframeID)
+    checks = {name: c for name, c in schema['qc'].items() if isinstance(c, dict)}
+    gradient_dz = schema['qc'].get('gradient_dz', 5.)
+
+    file = nc.Dataset(path+new_fname, 'r+')
+    timevar = file.variables.get('time')
+    n = len(timevar) if timevar is not None and timevar.dimensions else 0
+    # the variables along time, one value per record
+    names = [name for name in checks if name in file.variables and file.variables[name].dimensions == ('time',)] if n else []
+
+    flags = {name: np.zeros(n, dtype=np.int8) for name in names}
+    stuck = {name: dict() for name in names}
+    valid = {name: 0 for name in names}
+
+    # records i to j of a variable as floats, nan where missing
+    def read(name, i, j):
+        return np.ma.filled(np.ma.asarray(file.variables[name][i:j], dtype=float), np.nan)
+
+    # records of overlap: the lag of the gradient check, from the typical
+    # climb per record of the flight
+    lag = 1
+    if 'altitude' in file.variables and file.variables['altitude'].dimensions == ('time',) and n > 1:
+        z = read('altitude', 0, min(n, 10000))
+        with np.errstate(invalid='ignore'):
+            climb = np.nanmedian(np.abs(np.diff(z))) if np.isfinite(z).sum() > 1 else np.nan
+        lag = int(min(max_lag, max(1, np.ceil(gradient_dz/climb)))) if climb > 0 else max_lag
+    pad = lag+1
+
+    step = max(chunk_len(timevar, max_bytes//max(len(names)+2, 1)), pad) if n else 1
+    for i in range(0, n, step):
+        j = min(i+step, n)
+        lo, hi = max(0, i-pad), min(n, j+1)
+        t = read('time', lo, hi)
+        z = read('altitude', lo, hi) if 'altitude' in file.variables and file.variables['altitude'].dimensions == ('time',) else None
+        for name in names:
+            x = t if name == 'time' else read(name, lo, hi)
+            flags[name][i:j] |= block_flags(x, z, checks[name], i-lo, j-lo, gradient_dz, lag)
+            if 'stuck' in checks[name]:
+                stuck_flags(x[i-lo:j-lo], t[i-lo:j-lo], i, flags[name], checks[name]['stuck'], stuck[name])
+            valid[name] = valid[name]+int(np.isfinite(x[i-lo:j-lo]).sum())
+
+    # # # The flag variables # # #
+
+    summary = OrderedDict()
+    for name in names:
+        var = file.variables[name]
+        qc_name = name+'_qc'
+        if qc_name not in file.variables:
+            datatype, storage = storage_for(qc_name, np.dtype('i1'), var.dimensions, var.shape)
+            file.createVariable(qc_name, datatype, var.dimensions, **storage)
+        qc_var = file.variables[qc_name]
+        qc_var.setncatts(OrderedDict([('long_name', 'Quality flag of '+(var.getncattr('long_name') if 'long_name' in var.ncattrs() else name)),
+                                      ('flag_masks', np.array(list(flag_bits.values()), dtype=np.int8)),
+                                      ('flag_meanings', ' '.join(flag_bits))]))
+        qc_var[:] = flags[name]
+        var.setncattr('ancillary_variables', qc_name)
+
+        counts = OrderedDict((check, int(np.count_nonzero(flags[name] & bit))) for check, bit in flag_bits.items())
+        flagged = int(np.count_nonzero(flags[name]))
+        summary[name] = OrderedDict([('records', valid[name])]+[(check, k) for check, k in counts.items() if k]+[('flagged', flagged)])
+    file.close()
+
+    fractions = [summary[name]['flagged']/max(summary[name]['records'], 1) for name in summary]
+    result = OrderedDict([('file', new_fname), ('records', n), ('variables', summary),
+                          ('worst', max(fractions) if fractions else 0.), ('seconds', time.time()-start)])
+    with open(path+os.path.splitext(new_fname)[0]+'_qc.json', 'w') as f:
+        json.dump(result, f, indent=1)
+
+    record_stage('qc', result['seconds'], file=new_fname, records=n, flagged=sum(s['flagged'] for s in summary.values()), worst=result['worst'])
+    print_summary(result)
+
+    return result
+
+
+# print the summary of qc_file, one line per variable with flags
+def print_summary(result):
+
+    print('    QC of '+str(result['records'])+' records in %.2f s' % result['seconds']+
+          (', nothing flagged.' if not any(s['flagged'] for s in result['variables'].values()) else ':'))
+    for name, s in result['variables'].items():
+        if s['flagged']:
+            checks = ', '.join(check+' '+str(s[check]) for check in flag_bits if check in s)
+            print('      '+name+': '+str(s['flagged'])+' of '+str(s['records'])+' flagged ('+checks+')')
+    print('')
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_s3index.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : A local index (SQLite) of the objects in the UASDC entry
+#                 and product buckets. The buckets are listed with paginators
+#                 (no 1000 key limit), the operator/airframe/year/month
+#                 prefixes are listed in parallel, and a refresh only asks S3
+#                 for keys after the last one already indexed in each prefix,
+#                 except for the most recent months, which are relisted so
+#                 that overwritten and deleted objects are picked up. Keys
+#                 backfilled into an older month that sort before its last
+#                 indexed key are only seen by a full relist, which a refresh
+#                 does by itself every full_every seconds. The index can then
+#                 be queried by operator, airframe, flight date or for
+#                 netCDF files that have no BUFR.
+#
+#  USAGE        : called by openS3.py
+#
+#  DEPENDENCIES : Boto3 Python module supported for Python 3.8+
+
+import os, re, sqlite3, time
+from concurrent.futures import ThreadPoolExecutor
+from PSL_UASDC_uploadfiles import get_s3, bufr_key
+
+default_index = os.path.expanduser('~/UASDC_s3index.sqlite')
+
+# number of prefix levels down to the month: operator/airframe/YYYY/MM/
+prefix_depth = 4
+
+
+# connect to the index, creating it if needed
+def open_index(index_file=default_index):
+
+    conn = sqlite3.connect(index_file, timeout=60)
+    conn.execute('''CREATE TABLE IF NOT EXISTS objects (
+                        bucket        TEXT,
+                        key           TEXT,
+                        size          INTEGER,
+                        etag          TEXT,
+                        last_modified REAL,
+                        operator      TEXT,
+                        airframe      TEXT,
+                        flighttime    TEXT,
+                        product_key   TEXT,
+                        PRIMARY KEY (bucket, key))''')
+    conn.execute('CREATE INDEX IF NOT EXISTS objects_flight ON objects (bucket, operator, airframe, flighttime)')
+    conn.execute('CREATE INDEX IF NOT EXISTS objects_product ON objects (product_key)')
+    # when each bucket/prefix was last listed in full
+    conn.execute('''CREATE TABLE IF NOT EXISTS relists (
+                        bucket        TEXT,
+                        prefix        TEXT,
+                        listed        REAL,
+                        PRIMARY KEY (bucket, prefix))''')
+    conn.commit()
+
+    return conn
+
+
+# split a key into (operator, airframe, flighttime yyyymmddhhmmss, key of the
+# BUFR the key should produce in the product bucket, for netCDFs)
+def parse_key(key):
+
+    parts = key.split('/')
+    fname = parts[-1]
+    match = re.search(r'_(\d{14})Z\.', fname)
+    flighttime = match.group(1) if match else ''
+    product_key = ''
+    if len(parts) >= 3 and fname.endswith('.nc') and match:
+        product_key = bufr_key(fname, parts[0], parts[1])
+
+    return (parts[0] if len(parts) > 1 else '', parts[1] if len(parts) > 2 else '', flighttime, product_key)
+
+
+# the prefixes directly below prefix ('' for the top of the bucket)
+def list_subprefixes(s3, bucket, prefix):
+
+    subprefixes = []
+    for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+        subprefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+
+    return subprefixes
+
+
+# every object under prefix after start_after (all of them if '')
+def list_objects(s3, bucket, prefix, start_after=''):
+
+    objects = []
+    kwargs = dict(Bucket=bucket, Prefix=prefix)
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    for page in s3.get_paginator('list_objects_v2').paginate(**kwargs):
+        objects.extend(page.get('Contents', []))
+
+    return objects
+
+
+# Discover the month prefixes below prefix, one level at a time with each
+# level's prefixes listed in parallel.
+def month_prefixes(s3, bucket, prefix, executor):
+
+    level = [prefix]
+    for depth in range(prefix.count('/'), prefix_depth):
+        below = list(executor.map(lambda p: list_subprefixes(s3, bucket, p), level))
+        level = [p for ps in below for p in ps]
+
+    return level
+
+
+# Bring the index up to date with bucket below prefix (e.g. an operator ID
+# followed by '/'). Months not seen before and the newest `recent` month
+# prefixes are listed in full; older months only after their last indexed
+# key. Indexed keys a full listing of their month does not return, and
+# months that are gone, are removed. full=True (or a last full relist of
+# this prefix longer than full_every seconds ago) lists every month in full,
+# which also picks up keys backfilled into older months. Returns the number
+# of objects added or updated.
+def refresh_index(conn, bucket, prefix='', full=False, recent=2, nthreads=8, full_every=7*86400.):
+
+    s3, entry_bucket, product_bucket = get_s3()
+
+    row = conn.execute('SELECT listed FROM relists WHERE bucket=? AND prefix=?', (bucket, prefix)).fetchone()
+    full = full or row is None or time.time()-row[0] > full_every
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+
+        months = month_prefixes(s3, bucket, prefix, executor)
+
+        # newest months of each operator/airframe are relisted in full
+        newest = dict()
+        for p in months:
+            newest.setdefault(p.rsplit('/', 3)[0], []).append(p)
+        relist = set(months) if full else set(p for ps in newest.values() for p in sorted(ps)[-recent:])
+
+        def last_key(p):
+            if p in relist:
+                return ''
+            row = conn.execute('SELECT MAX(key) FROM objects WHERE bucket=? AND substr(key, 1, ?)=?', (bucket, len(p), p)).fetchone()
+            return row[0] or ''
+
+        start_after = [last_key(p) for p in months]
+        listings = executor.map(lambda args: list_objects(s3, bucket, *args), zip(months, start_after))
+
+        nobj, ngone = 0, 0
+        with conn:
+            for p, objects in zip(months, listings):
+                rows = [(bucket, o['Key'], o['Size'], o['ETag'], o['LastModified'].timestamp())+parse_key(o['Key']) for o in objects]
+                conn.executemany('INSERT OR REPLACE INTO objects VALUES (?,?,?,?,?,?,?,?,?)', rows)
+                nobj = nobj+len(rows)
+
+                # a full listing of the month says what is no longer there
+                if p in relist:
+                    listed = set(o['Key'] for o in objects)
+                    indexed = conn.execute('SELECT key FROM objects WHERE bucket=? AND substr(key, 1, ?)=?', (bucket, len(p), p)).fetchall()
+                    gone = [(bucket, k) for (k,) in indexed if k not in listed]
+                    conn.executemany('DELETE FROM objects WHERE bucket=? AND key=?', gone)
+                    ngone = ngone+len(gone)
+
+            # months that are gone altogether
+            keep = set(months)
+            indexed = conn.execute('SELECT key FROM objects WHERE bucket=? AND substr(key, 1, ?)=?', (bucket, len(prefix), prefix)).fetchall()
+            gone = [(bucket, k) for (k,) in indexed if k.count('/') >= prefix_depth and '/'.join(k.split('/')[:prefix_depth])+'/' not in keep]
+            conn.executemany('DELETE FROM objects WHERE bucket=? AND key=?', gone)
+            ngone = ngone+len(gone)
+
+            if full:
+                conn.execute('INSERT OR REPLACE INTO relists VALUES (?,?,?)', (bucket, prefix, start))
+
+    print('    Indexed '+str(nobj)+' new or updated objects in '+str(len(months))+' prefixes of '+bucket+
+          (' (full relist)' if full else '')+', removed '+str(ngone)+', in '+'%.1f' % (time.time()-start)+' s.')
+
+    return nobj
+
+
+# Query the index. Dates are yyyymmdd (inclusive). missing_bufr=True returns
+# only netCDFs in bucket whose BUFR is not in product_bucket. Returns a list
+# of (key, size, last_modified) sorted by key.
+def query_index(conn, bucket, operator=None, airframe=None, start=None, end=None, missing_bufr=False, product_bucket=None):
+
+    sql = 'SELECT key, size, last_modified FROM objects AS o WHERE bucket=?'
+    args = [bucket]
+    if operator:
+        sql = sql+' AND operator=?'
+        args.append(operator)
+    if airframe:
+        sql = sql+' AND airframe=?'
+        args.append(airframe)
+    if start:
+        sql = sql+' AND flighttime>=?'
+        args.append(start.ljust(14, '0'))
+    if end:
+        sql = sql+' AND flighttime<=?'
+        args.append(end.ljust(14, '9'))
+    if missing_bufr:
+        sql = sql+" AND product_key!='' AND NOT EXISTS (SELECT 1 FROM objects AS p WHERE p.bucket=? AND p.key=o.product_key)"
+        args.append(product_bucket)
+
+    return conn.execute(sql+' ORDER BY key', args).fetchall()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_schema.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The definitions in wmo_definitions.py compiled, once per
+#                 process and profile, into the lookups the checker needs:
+#
+#                   version     : spec version (profile name appended
+#                                 unless default), used in the ledger key
+#                   profile     : name of the profile
+#                   globals     : WMO global attributes
+#                   var_atts    : WMO name : final attributes, in order
+#                   aliases     : name a UAS may use : WMO name
+#                   conversions : WMO name : unit conversion
+#                   qc          : WMO name : checks of the values, and
+#                                 gradient_dz
+#
+#                 so renaming and attribute planning are one dict lookup per
+#                 variable. The compiled schema is shared by every file a
+#                 process checks and must not be modified.
+#
+#  USAGE        : called by PSL_UASDC_check_attributes.py, process_UASDC.py
+#
+#  DEPENDENCIES : none
+
+import fnmatch
+from collections import OrderedDict
+from functools import lru_cache
+from wmo_definitions import define_wmo_globals, define_wmo_atts, define_alt_names, define_unit_conversions, define_qc, define_profiles, define_spec_version
+
+# profile used for every file in this process, see set_profile
+_profile = None
+
+
+# Check every file with profile (None picks one per airframe, see
+# select_profile). Raises ValueError for an unknown profile.
+def set_profile(profile=None):
+
+    global _profile
+
+    if profile is not None and profile not in define_profiles():
+        raise ValueError('unknown schema profile '+profile+', see define_profiles() in wmo_definitions.py')
+    _profile = profile
+
+
+# the profile for airframeID: the one set with set_profile, else the first
+# whose platforms match, else default
+def select_profile(airframeID=None):
+
+    if _profile is not None:
+        return _profile
+    for name, profile in define_profiles().items():
+        if any(fnmatch.fnmatchcase(airframeID or '', pattern) for pattern in profile.get('platforms', [])):
+            return name
+
+    return 'default'
+
+
+# Build the schema of a profile (cached, so only the first call per process
+# does any work). Raises ValueError for an unknown profile or for a name
+# that is an alias of two WMO variables.
+@lru_cache(maxsize=None)
+def compile_schema(profile='default'):
+
+    profiles = define_profiles()
+    if profile not in profiles:
+        raise ValueError('unknown schema profile '+profile+', see define_profiles() in wmo_definitions.py')
+    overrides = profiles[profile]
+
+    global_atts = define_wmo_globals()
+    global_atts.update(overrides.get('globals', {}))
+
+    wmo_atts = define_wmo_atts()
+    for name, atts in overrides.get('wmo_atts', {}).items():
+        wmo_atts[name] = OrderedDict(list(wmo_atts.get(name, {}).items())+list(atts.items()))
+
+    namelist = define_alt_names()
+    for name, names in overrides.get('alt_names', {}).items():
+        namelist[name] = set(namelist.get(name, set())) | set(names)
+
+    conversions = define_unit_conversions()
+    conversions.update(overrides.get('conversions', {}))
+
+    qc = define_qc()
+    qc.update(overrides.get('qc', {}))
+
+    # the atts each WMO variable ends up with, before any extras it carries
+    var_atts = OrderedDict()
+    for name, atts in wmo_atts.items():
+        var_atts[name] = OrderedDict((att, 'NaN' if att == 'varname__FillValue' else val) for att, val in atts.items())
+
+    # reverse index of the alternative names
+    aliases = dict()
+    for name in wmo_atts:
+        for alias in sorted(namelist.get(name, set())):
+            if alias in aliases:
+                raise ValueError(alias+' is an alternative name of both '+aliases[alias]+' and '+name)
+            aliases[alias] = name
+
+    version = define_spec_version() if profile == 'default' else define_spec_version()+'/'+profile
+
+    return {'version':version, 'profile':profile, 'globals':global_atts, 'var_atts':var_atts,
+            'aliases':aliases, 'conversions':conversions, 'qc':qc}
+
+
+# the compiled schema for a file from airframeID
+def get_schema(airframeID=None):
+
+    return compile_schema(select_profile(airframeID))
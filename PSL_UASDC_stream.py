@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : PSL_UASDC_stream.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Streaming ingest of a flight while it is flown. The ground
+#                 station writes the telemetry to a file (or a pipe), one
+#                 record per line, either CSV with a header line of variable
+#                 names or JSON ({"time": 12.0, "temp": 21.3, ...}), using
+#                 the names the UAS uses in its netCDF. Each record is
+#                 renamed and converted with the same schema and conversions
+#                 as a RAW file (PSL_UASDC_check_attributes.py) and appended
+#                 to a STAGE netCDF with an unlimited time dimension, which
+#                 has the WMO attributes from the start. A conversion is
+#                 decided on the first valid value of its variable rather
+#                 than on the maximum of the whole flight.
+#
+#                 Every snapshot_every seconds of flight, or snapshot_dz m
+#                 of climb or descent, a copy of the file so far is put in
+#                 the outbox and uploaded to the entry bucket under the
+#                 final file name, so the first part of the profile reaches
+#                 the models while the drone is still flying. Each snapshot
+#                 replaces the one before, and the RAW file, processed as
+#                 usual after the flight, replaces the last one.
+#
+#                 The file grows in STAGE/.stream_<UASDC name>, out of the
+#                 way of the normal processing of the RAW file.
+#
+#  USAGE        : called by process_UASDC.py (--stream)
+#
+#  DEPENDENCIES : netCDF4, numpy
+
+import csv, json, os, shutil, sys, time
+from itertools import chain
+import numpy as np
+import netCDF4 as nc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from PSL_UASDC_schema import get_schema
+from PSL_UASDC_check_attributes import rename_map, plan_var_atts, plan_global_atts
+from PSL_UASDC_convert import plan_from_max, convert_block, storage_for
+from PSL_UASDC_outbox import open_outbox, enqueue, deliver, pending, outbox_dir
+from PSL_UASDC_metrics import record_stage
+
+
+# a value of a record as a float, nan if it is missing or not a number
+def to_float(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+# Generator of the records (dicts) of a telemetry file as it is written, in
+# lists of the records that have come in since the last one. source '-'
+# reads a pipe on stdin until it is closed, records one at a time. A file
+# is waited for if it is not there yet, and read until nothing has been
+# added to it for idle seconds, looking for more every poll seconds.
+def read_telemetry(source, idle=120., poll=0.5):
+
+    if source == '-':
+        f = sys.stdin
+    else:
+        start = time.time()
+        while not os.path.exists(source):
+            if time.time()-start > idle:
+                return
+            time.sleep(poll)
+        f = open(source)
+
+    header = None
+    buffer = ''
+    records = []
+    last = time.time()
+    try:
+        while True:
+            line = f.readline()
+            buffer = buffer+line
+
+            # a whole line
+            if buffer.endswith('\n'):
+                line, buffer = buffer.strip(), ''
+                last = time.time()
+                if not line or line.startswith('#'):
+                    continue
+                if line.startswith('{'):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        print('    Skipping telemetry line that is not JSON: '+line[:80])
+                elif header is None:
+                    header = [name.strip() for name in next(csv.reader([line]))]
+                else:
+                    records.append(dict(zip(header, next(csv.reader([line])))))
+                if f is sys.stdin and records:
+                    yield records
+                    records = []
+                continue
+
+            # nothing more for now (or half a line still being written)
+            if records:
+                yield records
+                records = []
+            if f is sys.stdin or time.time()-last > idle:
+                return
+            time.sleep(poll)
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+# Ingest the telemetry in source (see read_telemetry) for operatorID into a
+# growing STAGE netCDF in base_dir and publish snapshots of it (see the
+# summary). airframeID and flighttime (yyyymmddhhmmss) are taken from the
+# arguments; otherwise the airframe from the platform_name of template and
+# the flight time from the first time stamp (if it is seconds since 1970)
+# or the clock when the stream starts. template, a RAW file of the same UAS
+# (e.g. its last flight), gives the attributes, fill values and globals
+# the telemetry does not carry. Returns a short status string.
+def stream_flight(base_dir, source, operatorID, airframeID=None, flighttime=None, template=None,
+                  snapshot_every=60., snapshot_dz=50., idle=120., poll=0.5):
+
+    # # # STEP 1. What the telemetry does not say # # #
+
+    var_atts, fills, global_atts = dict(), dict(), dict()
+    if template:
+        with nc.Dataset(template) as file:
+            for name, var in file.variables.items():
+                var_atts[name] = {att: var.getncattr(att) for att in var.ncattrs() if att != '_FillValue'}
+                if '_FillValue' in var.ncattrs():
+                    fills[name] = var.getncattr('_FillValue')
+            # the flight is a new one
+            global_atts = {att: file.getncattr(att) for att in file.ncattrs() if att != 'flight_id'}
+    airframeID = airframeID if airframeID else global_atts.get('platform_name')
+    if not airframeID:
+        print('')
+        print('    Exiting. No airframeID. Please supply it as argument; i.e., -a name, or a --template with platform_name')
+        print('')
+        return 'skipped, no airframeID'
+    global_atts.setdefault('platform_name', airframeID)
+
+    schema = get_schema(airframeID)
+    records = read_telemetry(source, idle, poll)
+    first = next(records, None)
+    if first is None:
+        print('    No telemetry in '+source+' after '+str(idle)+' s.')
+        return 'no telemetry'
+
+    names = list(first[0])
+    renames = rename_map(names, schema)
+    time_name = next((name for name in names if renames.get(name, name) == 'time'), None)
+
+    if flighttime:
+        flighttime = flighttime if flighttime[-1] == 'Z' else flighttime+'Z'
+    else:
+        t0 = to_float(first[0].get(time_name)) if time_name else np.nan
+        if t0 >= 86400.:
+            start = datetime.fromtimestamp(t0, timezone.utc)
+        else:
+            start = datetime.fromtimestamp(time.time()-(t0 if np.isfinite(t0) else 0.), timezone.utc)
+        flighttime = start.strftime('%Y%m%d%H%M%S')+'Z'
+        print('    Flight time '+flighttime+' from the '+('first time stamp.' if t0 >= 86400. else 'clock.'))
+
+    # format: UASDC_operatorID_airframeID_YYYYMMDDHHMMSSZ.nc
+    new_fname = 'UASDC_'+operatorID+'_'+airframeID+'_'+flighttime+'.nc'
+    work = base_dir+'STAGE/.stream_'+new_fname
+    flight = {'fname':os.path.basename(source), 'new_fname':new_fname, 'operatorID':operatorID,
+              'airframeID':airframeID, 'key':('stream:'+new_fname, schema['version'])}
+
+
+    # # # STEP 2. The STAGE file, with the WMO names and attributes # # #
+
+    os.makedirs(base_dir+'STAGE/', exist_ok=True)
+    os.makedirs(base_dir+outbox_dir, exist_ok=True)
+    dst = nc.Dataset(work, 'w', format='NETCDF4_CLASSIC')
+    dst.createDimension('time', None)
+    dst.setncatts(plan_global_atts(global_atts, schema, airframeID))
+    for name in names:
+        dst_name = renames.get(name, name)
+        # a growing variable, chunk_records (see set_storage) per chunk
+        datatype, storage = storage_for(dst_name, np.dtype('f8'), ('time',), (sys.maxsize,))
+        fill_value = datatype.type(fills[name]) if name in fills else None
+        var = dst.createVariable(dst_name, datatype, ('time',), fill_value=fill_value, **storage)
+        target = plan_var_atts(dst_name, var_atts.get(name, {}), schema)
+        target.pop('_FillValue', None)
+        var.setncatts(target)
+    print('    Streaming '+source+' into '+work)
+
+
+    # # # STEP 3. Records, converted one by one # # #
+
+    plan = dict()
+    undecided = {renames.get(name, name) for name in names} & set(schema['conversions'])
+
+    def convert(record):
+        row = dict()
+        for name in names:
+            dst_name = renames.get(name, name)
+            value = to_float(record.get(name))
+            # still in the UAS units? decided on the first valid value
+            if dst_name in undecided and np.isfinite(value):
+                plan.update(plan_from_max({dst_name: value}, new_fname, schema['conversions']))
+                undecided.discard(dst_name)
+            scale, offset = plan.get(dst_name, (1., 0.))
+            row[dst_name] = convert_block(value, scale, offset)
+        return row
+
+
+    # # # STEP 4. Snapshots through the outbox # # #
+
+    uploads = ThreadPoolExecutor(max_workers=1)
+    nrecords = 0
+    nsnapshots = 0
+    published = -1
+
+    # Put a copy of the file so far in the outbox and upload it. Skipped
+    # while the last one is still going up, unless final, and when nothing
+    # came since the last one.
+    def publish(final=False):
+        nonlocal dst, nsnapshots, published
+        start = time.time()
+        dst.close()
+        if nrecords == published:
+            print('    '+time.strftime('%H:%M:%S')+' The last snapshot of '+new_fname+' has all '+str(nrecords)+' records.')
+            return
+        conn = open_outbox(base_dir)
+        try:
+            while any(e['name'] == new_fname and e['claimed'] > time.time() for e in pending(conn, ['s3'])):
+                if not final:
+                    return
+                time.sleep(poll)
+            spooled = base_dir+outbox_dir+new_fname
+            shutil.copyfile(work, spooled+'.tmp')
+            os.replace(spooled+'.tmp', spooled)
+            enqueue(conn, base_dir, spooled, 's3', flight)
+        finally:
+            conn.close()
+            if not final:
+                dst = nc.Dataset(work, 'a')
+        uploads.submit(deliver, base_dir, new_fname, 's3', 0)
+        nsnapshots = nsnapshots+1
+        published = nrecords
+        record_stage('stream_snapshot', time.time()-start, file=new_fname, bytes=os.path.getsize(spooled), records=nrecords, final=final)
+        print('    '+time.strftime('%H:%M:%S')+(' Final file' if final else ' Snapshot')+' of '+new_fname+', '+str(nrecords)+' records, to the entry bucket.')
+
+    last_time, last_alt, last_clock = np.nan, np.nan, time.time()
+    try:
+        for batch in chain([first], records):
+            rows = [convert(record) for record in batch]
+            for dst_name, var in dst.variables.items():
+                var[nrecords:nrecords+len(rows)] = np.array([row[dst_name] for row in rows])
+            nrecords = nrecords+len(rows)
+
+            # first record: start counting from here
+            t, alt = rows[-1].get('time', np.nan), rows[-1].get('altitude', np.nan)
+            if nrecords == len(rows):
+                last_time, last_alt = rows[0].get('time', np.nan), rows[0].get('altitude', np.nan)
+            elapsed = t-last_time if np.isfinite(t-last_time) else time.time()-last_clock
+            if elapsed >= snapshot_every or abs(alt-last_alt) >= snapshot_dz:
+                publish()
+                last_time, last_alt, last_clock = t, alt, time.time()
+    except KeyboardInterrupt:
+        print('')
+        print('    Stream stopped.')
+
+    publish(final=True)
+    uploads.shutdown()
+    print('    Streamed '+str(nrecords)+' records, '+str(nsnapshots)+' uploads (what did not go up waits in the outbox).')
+
+    return 'streamed '+str(nrecords)+' records, '+str(nsnapshots)+' snapshots'
@@ -6,7 +6,17 @@
 #  AUTHOR       : Christopher J. Cox, NOAA/PSL
 #  DATE         : 8 May 2024  
 #
-#  SUMMARY      :
+#  SUMMARY      : Transfers to and from the UASDC AWS S3 buckets. All calls
+#                 in a process share one boto3 session/client, and with it 
+#                 one connection pool, so the TLS handshake is paid once. 
+#                 Multipart settings are set with set_transfer_config().
+#                 Large files go up as multipart uploads that can be resumed:
+#                 the upload ID and the ETag of every finished part are kept
+#                 next to the file that is sent, which for STAGE files is
+#                 the spooled copy in the outbox (OUTBOX/.<file>.upload),
+#                 so an upload cut off by a dropped link, here or in an
+#                 earlier run, goes on from the parts S3 already has. Uploads can be held under a
+#                 bandwidth cap, to leave room on the link for telemetry.
 #
 #  USAGE        : Note that you cannot access AWS S3 while using PSL VPN.
 #
@@ -14,17 +24,144 @@
 
 
 
-def upload_file(path,filename,operatorID,airframeID):
+# Get your modules out (boto3 and access_info only once S3 is used, see get_s3)
+import io, json, os, sys, time, threading
+from PSL_UASDC_metrics import record_stage
 
-    # # # # # MAIN # # # # 
+# S3 client shared by every upload/download in this process
+_s3 = None
+_s3_lock = threading.Lock()
+_buckets = None
+_transfer = {'multipart_threshold':8*1024**2, 'multipart_chunksize':8*1024**2, 'max_concurrency':10}
+_max_pool = 10
 
-    # Get your modules out
-    import boto3, os, sys
-    from access_info import access_info
+# upload bandwidth cap of this process, see set_transfer_config and pace
+_bandwidth = None
+_pace_lock = threading.Lock()
+_pace_next = 0.
+
+
+# Set the multipart/concurrency knobs used by all transfers. Sizes in bytes.
+# Files smaller than multipart_threshold go up in a single PUT. Call before 
+# the first transfer to also size the connection pool to max_concurrency.
+# max_bandwidth (bytes/s, None for none) caps all uploads of the process
+# together.
+def set_transfer_config(multipart_threshold=8*1024**2, multipart_chunksize=8*1024**2, max_concurrency=10, max_bandwidth=None):
+
+    global _max_pool, _bandwidth
+
+    _transfer.update(multipart_threshold=multipart_threshold, multipart_chunksize=multipart_chunksize, max_concurrency=max_concurrency)
+    _max_pool = max(10, max_concurrency)
+    _bandwidth = max_bandwidth
+
+
+# Wait until nbytes more may be sent under the bandwidth cap. The uploads
+# of all threads take turns on one schedule, so together they stay under it.
+def pace(nbytes):
+
+    global _pace_next
+
+    if not _bandwidth:
+        return
+    with _pace_lock:
+        now = time.monotonic()
+        start = max(now, _pace_next)
+        _pace_next = start+nbytes/_bandwidth
+    time.sleep(start-now)
+
+
+# The body of one PUT. botocore reads it for checksums and signing before
+# sending it; only the reads once sending has started (see start_pacing)
+# are paced, so the cap is on what goes over the link.
+class PacedBody(io.BytesIO):
+
+    pacing = False
+
+    def read(self, size=-1):
+        data = super().read(size)
+        if self.pacing:
+            pace(len(data))
+        return data
+
+
+# botocore event handler, called just before a request goes out
+def start_pacing(request, **kwargs):
+
+    # a body streamed with a checksum trailer is wrapped
+    body = getattr(request.body, '_raw', request.body)
+    if isinstance(body, PacedBody):
+        body.pacing = True
+
+
+# the boto3 TransferConfig of the settings of set_transfer_config
+def transfer_config():
+
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(**_transfer)
+
+
+# Returns the shared client and the bucket names, building them on first use
+def get_s3():
+
+    global _s3, _buckets
+
+    with _s3_lock:
+        if _s3 is None:
+
+            import boto3
+            from botocore.config import Config
+            from access_info import access_info
+
+            # this information is stored in a separate file, access_info.py
+            username, aws_key, aws_secret_key, entry_bucket, product_bucket = access_info()
+
+            # We are using AWS S3
+            print('    Accessing Amazon AWS S3.')
     
-    # this information is stored in a separate file, access_info.py
-    username, aws_key, aws_secret_key, entry_bucket, product_bucket = access_info()
-        
+            # Setauthentication credentials as environment variables
+            os.environ['AWS_ACCESS_KEY_ID'] = aws_key
+            os.environ['AWS_SECRET_ACCESS_KEY'] = aws_secret_key
+
+            # just in case
+            session = boto3.session.Session(aws_access_key_id=aws_key, aws_secret_access_key=aws_secret_key)
+            _s3 = session.client('s3', config=Config(max_pool_connections=_max_pool, retries={'mode':'standard'}))
+            _s3.meta.events.register('before-send.s3', start_pacing)
+            _buckets = (entry_bucket, product_bucket)
+
+    return _s3, _buckets[0], _buckets[1]
+
+
+# host and port of the S3 endpoint, to probe the link with
+def s3_endpoint():
+
+    from urllib.parse import urlsplit
+
+    url = urlsplit(get_s3()[0].meta.endpoint_url)
+
+    return url.hostname, url.port or (443 if url.scheme == 'https' else 80)
+
+
+# print the size and rate of a finished transfer
+def report_rate(nbytes, seconds):
+
+    rate = nbytes/max(seconds, 1e-6)
+    print(f"    {nbytes/1024:.1f} kB in {seconds:.2f} s ({rate/1024:.1f} kB/s)")
+
+    return rate
+
+
+# Upload a STAGE file to the entry bucket. Files from multipart_threshold
+# up are sent with upload_parts, and an attempt that fails is followed by 
+# up to retries more, each going on from the parts already in S3. With 
+# rawfile (the RAW file the STAGE file was written from), also report the 
+# bytes the STAGE storage saved and the upload time that saved at the rate
+# of this upload. Returns the ETag of the uploaded object, or None if the 
+# upload failed (a multipart upload is then resumed by the next call).
+def upload_file(path,filename,operatorID,airframeID,rawfile=None,retries=3):
+
+    # # # # # MAIN # # # # 
+
     # Filename
     fullfile = path+filename
 
@@ -33,61 +170,251 @@ def upload_file(path,filename,operatorID,airframeID):
         sys.exit()
         
     # this is how the path to file looks like in the bucket            
-    s3_filepath = operatorID+'/'+airframeID+'/'+fullfile[-18:-14]+'/'+fullfile[-14:-12]+'/'+filename
+    s3_filepath = entry_key(filename,operatorID,airframeID)
 
-    
-    # We are using AWS S3
-    print('    Accessing Amazon AWS S3.')
-    
-    # Setauthentication credentials as environment variables
-    os.environ['AWS_ACCESS_KEY_ID'] = aws_key
-    os.environ['AWS_SECRET_ACCESS_KEY'] = aws_secret_key
-    
-    # just in case
-    s3 = boto3.client('s3', aws_access_key_id=aws_key, aws_secret_access_key=aws_secret_key)
+    s3, entry_bucket, product_bucket = get_s3()
 
     # Upload the file to the S3 bucket
-    try:
-        s3.upload_file(fullfile, entry_bucket, s3_filepath)
-        print(f"File {fullfile} uploaded to {entry_bucket}/{s3_filepath}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+    size = os.path.getsize(fullfile)
+    start = time.time()
+    for attempt in range(retries+1):
+        try:
+            if size < _transfer['multipart_threshold']:
+                with open(fullfile, 'rb') as f:
+                    s3.put_object(Bucket=entry_bucket, Key=s3_filepath, Body=PacedBody(f.read()))
+                sent, resumed = size, 0
+            else:
+                sent, resumed = upload_parts(fullfile, entry_bucket, s3_filepath, path+'.'+filename+'.upload')
+            break
+        except Exception as e:
+            if attempt == retries:
+                print(f"An error occurred: {e}")
+                record_stage('upload', time.time()-start, file=filename, retries=attempt, ok=False, error=str(e))
+                return None
+            print('    S3 upload of '+filename+' failed ('+str(e)+'), attempt '+str(attempt+1)+' of '+str(retries+1)+'.')
+            time.sleep(min(2**attempt, 30))
+
+    print(f"File {fullfile} uploaded to {entry_bucket}/{s3_filepath}")
+    if resumed:
+        print(f"    {resumed/1024:.1f} kB were already in S3 from an earlier attempt")
+    rate = report_rate(sent, time.time()-start)
+    response = s3.head_object(Bucket=entry_bucket, Key=s3_filepath)
+    saving = dict()
+    if rawfile is not None and os.path.exists(rawfile):
+        saved = os.path.getsize(rawfile)-size
+        saving = {'saved_bytes':saved, 'saved_seconds':round(saved/rate, 3)}
+        print(f"    {abs(saved)/1024:.1f} kB {'less' if saved >= 0 else 'more'} than RAW, about {abs(saved)/rate:.2f} s of upload {'saved' if saved >= 0 else 'added'}")
+    record_stage('upload', time.time()-start, file=filename, bytes=sent, retries=attempt, resumed_bytes=resumed, **saving)
+    return response['ETag']
+
+
+# Upload fullfile to bucket/key as a multipart upload in parts of
+# multipart_chunksize, sent max_concurrency at a time. The upload ID and
+# the ETag of each part are saved to statefile as soon as S3 has the part,
+# so a later call goes on from there; S3 is asked which parts it holds 
+# (list_parts) before trusting the file. If fullfile has changed since, 
+# the old upload is aborted and a new one started. statefile is removed
+# once the upload is complete. Returns the bytes sent by this call and the
+# bytes that were already in S3.
+def upload_parts(fullfile, bucket, key, statefile):
+
+    # Get your modules out
+    from botocore.exceptions import ClientError
+    from concurrent.futures import ThreadPoolExecutor
+
+    s3 = get_s3()[0]
+    stat = os.stat(fullfile)
+
+    # S3 takes at most 10000 parts, all but the last at least 5 MB
+    part_size = max(_transfer['multipart_chunksize'], 5*1024**2, -(-stat.st_size//10000))
+    nparts = max(1, -(-stat.st_size//part_size))
+    sizes = {n: min(part_size, stat.st_size-(n-1)*part_size) for n in range(1, nparts+1)}
+    upload = {'bucket':bucket, 'key':key, 'size':stat.st_size, 'mtime_ns':stat.st_mtime_ns, 'part_size':part_size}
+
+    state = None
+    if os.path.exists(statefile):
+        with open(statefile) as f:
+            state = json.load(f)
+        if any(state.get(k) != upload[k] for k in upload):
+            print('    '+os.path.basename(fullfile)+' changed since its last upload was cut off, starting over.')
+            try:
+                s3.abort_multipart_upload(Bucket=state['bucket'], Key=state['key'], UploadId=state['upload_id'])
+            except ClientError:
+                pass
+            state = None
+        else:
+            try:
+                held = dict()
+                for page in s3.get_paginator('list_parts').paginate(Bucket=bucket, Key=key, UploadId=state['upload_id']):
+                    for part in page.get('Parts', []):
+                        held[part['PartNumber']] = part
+                # a part S3 holds with the wrong size is sent again
+                state['parts'] = {str(n): held[n]['ETag'] for n in held if n in sizes and held[n]['Size'] == sizes[n]}
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('NoSuchUpload', '404'):
+                    raise
+                state = None
+
+    if state is None:
+        state = dict(upload, upload_id=s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId'], parts=dict())
+    elif state['parts']:
+        print('    Resuming the upload of '+os.path.basename(fullfile)+', '+str(len(state['parts']))+' of '+str(nparts)+' parts already in S3.')
+    save_upload_state(statefile, state)
+
+    lock = threading.Lock()
+
+    def send(n):
+        with open(fullfile, 'rb') as f:
+            f.seek((n-1)*part_size)
+            body = PacedBody(f.read(part_size))
+        etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=state['upload_id'], PartNumber=n, Body=body)['ETag']
+        with lock:
+            state['parts'][str(n)] = etag
+            save_upload_state(statefile, state)
+        return sizes[n]
+
+    todo = [n for n in sizes if str(n) not in state['parts']]
+    with ThreadPoolExecutor(max_workers=_transfer['max_concurrency']) as executor:
+        sent = sum(executor.map(send, todo))
+
+    s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=state['upload_id'],
+                                 MultipartUpload={'Parts': [{'ETag':state['parts'][str(n)], 'PartNumber':n} for n in sizes]})
+    os.remove(statefile)
+
+    return sent, stat.st_size-sent
+
+
+# write the state of a multipart upload, replacing the old one in one step
+# so a crash never leaves half a file
+def save_upload_state(statefile, state):
+
+    with open(statefile+'.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(statefile+'.tmp', statefile)
         
         
 def download_bufr(path,new_fname,operatorID,airframeID):
 
     # # # # # MAIN # # # # 
     
-    # Get your modules out
-    import boto3, os
-    from access_info import access_info
-
     # file name
     bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
     
-    # this information is stored in a separate file, access_info.py
-    username, aws_key, aws_secret_key, entry_bucket, product_bucket = access_info()
-
     # this is how the path to file looks like in the bucket            
-    s3_filepath = operatorID+'/'+airframeID+'/'+bufr_name[-20:-16]+'/'+bufr_name[-16:-14]+'/'+bufr_name[-14:-12]+'/'+bufr_name
-
-    # We are using AWS S3
-    print('    Accessing Amazon AWS S3.')
+    s3_filepath = bufr_key(new_fname,operatorID,airframeID)
 
-    # Setauthentication credentials as environment variables
-    os.environ['AWS_ACCESS_KEY_ID'] = aws_key
-    os.environ['AWS_SECRET_ACCESS_KEY'] = aws_secret_key
-
-    # just in case
-    s3 = boto3.client('s3', aws_access_key_id=aws_key, aws_secret_access_key=aws_secret_key)
+    s3, entry_bucket, product_bucket = get_s3()
 
     # Upload the file to the S3 bucket
     try:
         #curr_d = os.getcwd()
         #os.chdir(path)
-        s3.download_file(product_bucket, s3_filepath, path+bufr_name)
+        start = time.time()
+        s3.download_file(product_bucket, s3_filepath, path+bufr_name, Config=transfer_config())
         #os.chdir(curr_d)
         print(f"File {bufr_name} downloaded from {product_bucket}/{s3_filepath}")
+        report_rate(os.path.getsize(path+bufr_name), time.time()-start)
+        return True
     except Exception as e:
         print(f"An error occurred: {e}")
-    
\ No newline at end of file
+        return False
+
+
+# this is how the path to the netcdf looks like in the entry bucket
+def entry_key(filename,operatorID,airframeID):
+
+    return operatorID+'/'+airframeID+'/'+filename[-18:-14]+'/'+filename[-14:-12]+'/'+filename
+
+
+# this is how the path to the bufr file looks like in the product bucket
+def bufr_key(new_fname,operatorID,airframeID):
+
+    bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
+    
+    return operatorID+'/'+airframeID+'/'+bufr_name[-20:-16]+'/'+bufr_name[-16:-14]+'/'+bufr_name[-14:-12]+'/'+bufr_name
+    
+
+# If the BUFR for new_fname is in the product bucket yet, download it to 
+# path. Checked with a cheap head_object. Returns True if it was downloaded.
+def fetch_bufr(path,new_fname,operatorID,airframeID):
+
+    from botocore.exceptions import ClientError
+
+    s3, entry_bucket, product_bucket = get_s3()
+    key = bufr_key(new_fname,operatorID,airframeID)
+
+    try:
+        s3.head_object(Bucket=product_bucket, Key=key)
+    except ClientError as e:
+        # 403 rather than 404 if we are not allowed to list the bucket
+        if e.response['Error']['Code'] in ('404', '403', 'NoSuchKey'):
+            return False
+        raise
+    bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
+    start = time.time()
+    s3.download_file(product_bucket, key, path+bufr_name, Config=transfer_config())
+    print(f"    File {bufr_name} downloaded from {product_bucket}/{key}")
+    report_rate(os.path.getsize(path+bufr_name), time.time()-start)
+    record_stage('bufr_download', time.time()-start, file=bufr_name, bytes=os.path.getsize(path+bufr_name))
+    return True
+
+
+# Wait for the Synoptic pipeline to put BUFR files in the product bucket and 
+# download each one as soon as it appears. jobs is a list of 
+# (new_fname, operatorID, airframeID), one per uploaded netCDF. Each key is
+# checked with fetch_bufr, first right away (e.g. on a rerun the BUFR may be
+# there already); the wait between checks of a key starts at first_wait and
+# doubles up to max_wait, with random jitter so that many keys are not
+# checked in lock-step. Gives up on keys still missing after deadline 
+# seconds. The wait for each key is recorded as stage bufr_wait, with the
+# checks after the first as retries. An S3 error on a key (e.g. the link
+# dropping) counts as the BUFR not being there yet; the netCDF is already
+# uploaded and the outbox sender keeps looking. Returns a dict of 
+# new_fname : True/False (downloaded).
+def poll_bufr(path,jobs,deadline=120.,first_wait=2.,max_wait=30.,nthreads=8):
+
+    # Get your modules out
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    def check(f):
+        try:
+            return fetch_bufr(path, *pending[f][0])
+        except (ClientError, BotoCoreError) as e:
+            print('    Checking for the BUFR of '+f+' failed ('+str(e)+'), trying again.')
+            return False
+
+    start = time.time()
+    found = {job[0]: False for job in jobs}
+    pending = {job[0]: [job, start, first_wait/2] for job in jobs} # job, next check, wait
+    checks = {job[0]: 0 for job in jobs}
+
+    print('    Waiting up to '+str(deadline)+' s for '+str(len(pending))+' BUFR file(s) in product bucket.')
+
+    with ThreadPoolExecutor(max_workers=nthreads) as executor:
+        while pending:
+            now = time.time()
+            if now-start >= deadline:
+                break
+
+            due = [f for f in pending if pending[f][1] <= now]
+            for f, ok in zip(due, executor.map(check, due)):
+                checks[f] = checks[f]+1
+                if ok:
+                    found[f] = True
+                    del pending[f]
+                    record_stage('bufr_wait', time.time()-start, file=f, retries=checks[f]-1)
+                else:
+                    wait = min(pending[f][2]*2, max_wait)
+                    pending[f][1] = time.time()+wait*random.uniform(0.5, 1.)
+                    pending[f][2] = wait
+
+            if pending:
+                time.sleep(max(0., min(min(p[1] for p in pending.values()), start+deadline)-time.time()))
+
+    for f in pending:
+        print('    No bufr file found in product bucket for '+f+' after '+str(deadline)+' s.')
+        record_stage('bufr_wait', time.time()-start, file=f, retries=max(checks[f]-1, 0), ok=False, error='deadline')
+
+    return found
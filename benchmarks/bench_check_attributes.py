@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : bench_check_attributes.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Compares the attribute rewrite in check_vars_atts before 
+#                 (delete and re-add every attribute) and after (write only 
+#                 the differences, one setncatts per variable). Reports the 
+#                 number of attribute writes and the wall time for raw 
+#                 files and for files that already conform. Works on copies
+#                 in a temporary directory; the input files are not touched.
+#                 check_vars_atts is the legacy in-place check; the STAGE
+#                 files themselves are written by convert_file.
+#
+#  USAGE        : python3 benchmarks/bench_check_attributes.py -p /path/to/RAW/ -f file_prefix -a airframeID -r 5
+#
+#  DEPENDENCIES : netCDF4
+
+import argparse, os, shutil, sys, tempfile, time
+import netCDF4 as nc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PSL_UASDC_check_attributes import check_vars_atts, rename_vars, rewrite_atts
+from PSL_UASDC_schema import compile_schema
+from wmo_definitions import define_wmo_globals, define_wmo_atts
+
+
+# The attribute rewrite as it was before: every att of every variable and 
+# every global att is deleted and written again, with the definitions
+# rebuilt on every call. Returns the att writes.
+def legacy_rewrite_atts(file, schema, airframeID):
+
+    wmo_atts = define_wmo_atts()
+    global_atts = define_wmo_globals()
+
+    nwrites = 0
+    for file_var_name, file_var in file.variables.items():
+        attdict = dict()
+        for att in file_var.ncattrs():
+            attdict[att] = file_var.getncattr(att)
+            file_var.delncattr(att)
+            nwrites = nwrites+1
+        if file_var_name not in wmo_atts:
+            file_var.setncattr('varname__FillValue', 'NaN')
+            nwrites = nwrites+1
+            for att in attdict.items():
+                file_var.setncattr('long_name' if att[0] == 'standard_name' else att[0], att[1])
+                nwrites = nwrites+1
+        else:
+            for att in wmo_atts[file_var_name].items():
+                file_var.setncattr(att[0], 'NaN' if att[0] == 'varname__FillValue' else att[1])
+                nwrites = nwrites+1
+            for att in attdict.items():
+                if att[0] not in file_var.ncattrs() and att[0] != 'standard_name':
+                    file_var.setncattr(att[0], att[1])
+                    nwrites = nwrites+1
+
+    attdict = dict()
+    for att in file.ncattrs():
+        attdict[att] = file.getncattr(att)
+        file.delncattr(att)
+        nwrites = nwrites+1
+    pn = attdict.get('platform_name', '')
+    for att in global_atts.items():
+        if att[0] == 'platform_name':
+            file.setncattr('platform_name', airframeID)
+        elif att[0] == 'flight_id':
+            file.setncattr('flight_id', attdict.get('flight_id', ''))
+        elif att[0] == 'source':
+            file.setncattr('source', pn)
+        else:
+            file.setncattr(att[0], att[1])
+        nwrites = nwrites+1
+        attdict.pop(att[0], None)
+    for att in attdict.items():
+        file.setncattr(att[0], att[1])
+        nwrites = nwrites+1
+
+    return nwrites
+
+
+# time one att rewrite of a copy of fullfile, returns (writes, seconds)
+def time_rewrite(rewrite, fullfile, tmpdir, airframeID):
+
+    copy = os.path.join(tmpdir, 'bench.nc')
+    shutil.copyfile(fullfile, copy)
+    file = nc.Dataset(copy, 'r+')
+    rename_vars(file, compile_schema())
+    start = time.perf_counter()
+    nwrites = rewrite(file, compile_schema(), airframeID)
+    file.close() # closing flushes the metadata, so it counts
+    seconds = time.perf_counter()-start
+    os.remove(copy)
+
+    return nwrites, seconds
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--filepath', metavar='str', help='Path to raw files')
+    parser.add_argument('-f', '--filename', metavar='str', default='', help='Filename prefix')
+    parser.add_argument('-a', '--airframeID', metavar='str', default='bench', help='Airframe ID')
+    parser.add_argument('-r', '--repeats', metavar='int', type=int, default=5, help='Repeats per file')
+    args = parser.parse_args()
+
+    path = os.path.join(args.filepath, '')
+    raw_files = sorted(f for f in os.listdir(path) if f.startswith(args.filename) and f.endswith('.nc'))
+
+    tmpdir = tempfile.mkdtemp()
+
+    # conformant versions of the raw files, made by the checker itself
+    conformant = []
+    stdout = sys.stdout
+    for n, f in enumerate(raw_files):
+        new_fname = 'UASDC_000_'+args.airframeID+'_'+str(20240101000000+n)+'Z.nc'
+        shutil.copyfile(path+f, os.path.join(tmpdir, new_fname))
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            check_vars_atts(tmpdir+'/', new_fname, args.airframeID)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        conformant.append(os.path.join(tmpdir, new_fname))
+
+    print('')
+    print('    %-10s %-8s %12s %12s %12s %12s' % ('files', 'method', 'att writes', 'mean [ms]', 'min [ms]', 'speedup'))
+    for label, files in [('raw', [path+f for f in raw_files]), ('conformant', conformant)]:
+        results = dict()
+        for method, rewrite in [('before', legacy_rewrite_atts), ('after', rewrite_atts)]:
+            nwrites, seconds = 0, []
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                for fullfile in files:
+                    for r in range(args.repeats):
+                        w, t = time_rewrite(rewrite, fullfile, tmpdir, args.airframeID)
+                        seconds.append(t)
+                    nwrites = nwrites+w
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            results[method] = (nwrites, 1000*sum(seconds)/len(seconds), 1000*min(seconds))
+        for method in ['before', 'after']:
+            speedup = results['before'][1]/results[method][1]
+            print('    %-10s %-8s %12d %12.2f %12.2f %11.1fx' % ((label, method)+results[method]+(speedup,)))
+
+    shutil.rmtree(tmpdir)
+    print('')
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : bench_pipeline.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Times each stage of the pipeline offline, for a range of
+#                 flight lengths and batch sizes, on synthetic flights (see
+#                 synthetic_flights.py). S3 is a local moto server (or any
+#                 S3 endpoint, e.g. MinIO, with --s3_endpoint) and GSL is a
+#                 local pyftpdlib server. Stages:
+#
+#                   check       check_vars_atts (legacy, in place) on copies of RAW
+#                   convert     convert_file RAW -> STAGE
+#                   qc          qc_file on STAGE
+#                   upload      upload_file STAGE -> entry bucket
+#                   bufr        poll_bufr product bucket -> BUFR
+#                   gsl         send_files STAGE + BUFR -> ftp
+#                   quicklooks  quicklooks.py on RAW
+#
+#                 Each stage runs in a fresh process, so its peak RSS is
+#                 its own. Wall time, peak RSS and bytes moved are appended
+#                 to a JSON history with the git commit, and compared with
+#                 the last run with the same settings so regressions show.
+#
+#  USAGE        : python3 benchmarks/bench_pipeline.py -m 10,60 -n 1,8 -r 1
+#                 python3 benchmarks/bench_pipeline.py -m 10 -n 4 -s check,convert --s3_endpoint http://localhost:9000
+#
+#  DEPENDENCIES : netCDF4, numpy, Boto3, moto[server] (unless --s3_endpoint),
+#                 pyftpdlib, matplotlib/xarray/pandas (quicklooks)
+
+import argparse, io, json, multiprocessing, os, platform, resource, shutil, socket
+import subprocess, sys, tempfile, threading, time
+from contextlib import redirect_stdout
+from datetime import datetime
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.join(bench_dir, '..')
+sys.path[:0] = [bench_dir, repo_dir]
+
+stages = ['check', 'convert', 'qc', 'upload', 'bufr', 'gsl', 'quicklooks']
+default_history = os.path.join(bench_dir, 'bench_history.json')
+
+# stand-in servers, see start_servers
+ftp_dir = 'its/psl_uas_fire_wx'
+buckets = ('bench-entry', 'bench-product')
+
+
+# a free local port
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# Start the local S3 (moto, unless endpoint is given) and ftp servers in
+# threads of this process. Returns (s3 endpoint, ftp port, stop function).
+def start_servers(workdir, endpoint=None):
+
+    import boto3, logging
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    moto = None
+    logging.getLogger('werkzeug').setLevel(logging.ERROR) # moto's request log
+    if endpoint is None:
+        from moto.server import ThreadedMotoServer
+        port = free_port()
+        moto = ThreadedMotoServer(port=port, verbose=False)
+        moto.start()
+        endpoint = 'http://127.0.0.1:'+str(port)
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    s3 = boto3.client('s3', endpoint_url=endpoint)
+    for bucket in buckets:
+        try:
+            s3.create_bucket(Bucket=bucket)
+        except s3.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+    os.makedirs(os.path.join(workdir, 'ftp', ftp_dir))
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(os.path.join(workdir, 'ftp'), perm='elradfmwMT')
+    handler = type('BenchFTPHandler', (FTPHandler,), {'authorizer': authorizer})
+    ftp = ThreadedFTPServer(('127.0.0.1', free_port()), handler)
+    # a handler of our own keeps pyftpdlib from logging every command
+    logging.getLogger('pyftpdlib').addHandler(logging.NullHandler())
+    logging.getLogger('pyftpdlib').propagate = False
+    threading.Thread(target=ftp.serve_forever, daemon=True).start()
+
+    def stop():
+        ftp.close_all()
+        if moto is not None:
+            moto.stop()
+
+    return endpoint, ftp.address[1], stop
+
+
+# point the pipeline modules of this process at the stand-ins
+def use_servers(endpoint, ftp_port):
+
+    import boto3
+    import PSL_UASDC_uploadfiles as uploadfiles
+    from PSL_UASDC_gsl import set_gsl
+
+    uploadfiles._s3 = boto3.client('s3', endpoint_url=endpoint)
+    uploadfiles._buckets = buckets
+    set_gsl('127.0.0.1', ftp_dir, pool_size=4, port=ftp_port)
+
+
+# The stages. Each takes the work directory (RAW, STAGE, BUFR) and the
+# names of the RAW files and returns the bytes it moved. Set-up that is
+# not part of the stage happens before the clock starts, see run_stage.
+def stage_check(workdir, fnames, clock):
+
+    from PSL_UASDC_check_attributes import check_vars_atts
+
+    os.makedirs(workdir+'CHECK/', exist_ok=True)
+    for fname in fnames:
+        shutil.copyfile(workdir+'RAW/'+fname, workdir+'CHECK/'+stage_name(fname))
+    clock.append(time.perf_counter())
+    for fname in fnames:
+        check_vars_atts(workdir+'CHECK/', stage_name(fname), 'meteodrone-00')
+    nbytes = sum(os.path.getsize(workdir+'CHECK/'+stage_name(f)) for f in fnames)
+    shutil.rmtree(workdir+'CHECK/')
+
+    return nbytes
+
+
+def stage_convert(workdir, fnames, clock):
+
+    from PSL_UASDC_check_attributes import convert_file
+
+    clock.append(time.perf_counter())
+    for fname in fnames:
+        convert_file(workdir+'RAW/'+fname, workdir+'STAGE/', stage_name(fname), 'meteodrone-00')
+
+    return sum(os.path.getsize(workdir+'RAW/'+f)+os.path.getsize(workdir+'STAGE/'+stage_name(f)) for f in fnames)
+
+
+def stage_qc(workdir, fnames, clock):
+
+    from PSL_UASDC_qc import qc_file
+
+    clock.append(time.perf_counter())
+    for fname in fnames:
+        qc_file(workdir+'STAGE/', stage_name(fname), 'meteodrone-00')
+
+    return sum(os.path.getsize(workdir+'STAGE/'+stage_name(f)) for f in fnames)
+
+
+def stage_upload(workdir, fnames, clock):
+
+    from PSL_UASDC_uploadfiles import upload_file
+
+    clock.append(time.perf_counter())
+    for fname in fnames:
+        upload_file(workdir+'STAGE/', stage_name(fname), '000', 'meteodrone-00')
+
+    return sum(os.path.getsize(workdir+'STAGE/'+stage_name(f)) for f in fnames)
+
+
+def stage_bufr(workdir, fnames, clock):
+
+    from PSL_UASDC_uploadfiles import get_s3, bufr_key, poll_bufr
+
+    # what the Synoptic pipeline would have made, about a tenth the size
+    s3, entry_bucket, product_bucket = get_s3()
+    for fname in fnames:
+        size = os.path.getsize(workdir+'STAGE/'+stage_name(fname))//10
+        s3.put_object(Bucket=product_bucket, Key=bufr_key(stage_name(fname), '000', 'meteodrone-00'), Body=os.urandom(size))
+    clock.append(time.perf_counter())
+    poll_bufr(workdir+'BUFR/', [(stage_name(f), '000', 'meteodrone-00') for f in fnames], deadline=60.)
+
+    return sum(os.path.getsize(workdir+'BUFR/'+f) for f in os.listdir(workdir+'BUFR/'))
+
+
+def stage_gsl(workdir, fnames, clock):
+
+    from PSL_UASDC_gsl import send_files, gsl_files, close_sessions
+
+    files = [f for fname in fnames for f in gsl_files(workdir, stage_name(fname))]
+    clock.append(time.perf_counter())
+    send_files(files)
+    close_sessions()
+
+    return sum(os.path.getsize(f) for f in files)
+
+
+def stage_quicklooks(workdir, fnames, clock):
+
+    clock.append(time.perf_counter())
+    subprocess.run([sys.executable, os.path.join(repo_dir, 'quicklooks.py'), '-p', workdir+'RAW/', '-f', fnames[0][:4], '-r'],
+                   env=dict(os.environ, MPLBACKEND='Agg'), check=True, stdout=subprocess.DEVNULL)
+
+    return sum(os.path.getsize(workdir+'RAW/'+f) for f in fnames)
+
+
+# STAGE name of a synthetic RAW file
+def stage_name(fname):
+
+    return 'UASDC_000_meteodrone-00_'+fname[:14]+'Z.nc'
+
+
+# Run one stage in this (fresh) process and put (seconds, peak RSS in MB,
+# bytes) on the queue. The peak includes the children, for quicklooks.
+def run_stage(stage, workdir, fnames, endpoint, ftp_port, queue):
+
+    use_servers(endpoint, ftp_port)
+    clock = []
+    try:
+        with redirect_stdout(io.StringIO()):
+            nbytes = globals()['stage_'+stage](workdir, fnames, clock)
+        seconds = time.perf_counter()-clock[0]
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        # kB on Linux, bytes on macOS
+        peak = peak/1024 if sys.platform != 'darwin' else peak/1024**2
+        queue.put((seconds, peak, nbytes, None))
+    except Exception as e:
+        queue.put((None, None, None, repr(e)))
+
+
+# the commit being measured, if this is a git checkout
+def git_commit():
+
+    try:
+        return subprocess.run(['git', '-C', repo_dir, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--minutes', metavar='list', default='10', help='Flight durations to try, comma separated')
+    parser.add_argument('-n', '--nfiles', metavar='list', default='1,4', help='Batch sizes to try, comma separated')
+    parser.add_argument('-r', '--rate', metavar='Hz', type=float, default=1., help='Sample rate of the synthetic flights')
+    parser.add_argument('-s', '--stages', metavar='list', default=','.join(stages), help='Stages to run, comma separated')
+    parser.add_argument('-o', '--history', metavar='str', default=default_history, help='JSON history file')
+    parser.add_argument('-l', '--label', metavar='str', default='', help='Note stored with the run')
+    parser.add_argument('--s3_endpoint', metavar='url', default=None, help='Use this S3 endpoint (e.g. MinIO) instead of moto')
+    parser.add_argument('--tolerance', metavar='float', type=float, default=1.2, help='Flag stages slower than this times the last run')
+    args = parser.parse_args()
+
+    from synthetic_flights import make_flights
+
+    minutes = [float(m) for m in args.minutes.split(',')]
+    nfiles = [int(n) for n in args.nfiles.split(',')]
+    run_stages = [s for s in args.stages.split(',') if s in stages]
+
+    tmpdir = tempfile.mkdtemp()
+    endpoint, ftp_port, stop = start_servers(tmpdir, args.s3_endpoint)
+    context = multiprocessing.get_context('spawn')
+
+    record = {'date': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'), 'commit': git_commit(), 'label': args.label,
+              'host': platform.node(), 'python': platform.python_version(), 'rate_hz': args.rate, 'results': []}
+
+    print('')
+    print('    %-10s %8s %6s %10s %10s %12s %12s' % ('stage', 'minutes', 'files', 'wall [s]', 'RSS [MB]', 'MB moved', 'MB/s'))
+    for m in minutes:
+        for n in nfiles:
+            workdir = os.path.join(tmpdir, 'm'+str(m)+'_n'+str(n), '')
+            for d in ['RAW', 'STAGE', 'BUFR']:
+                os.makedirs(workdir+d)
+            fnames = make_flights(workdir+'RAW/', n, 60*m, args.rate)
+
+            for stage in run_stages:
+                queue = context.Queue()
+                proc = context.Process(target=run_stage, args=(stage, workdir, fnames, endpoint, ftp_port, queue))
+                proc.start()
+                seconds, peak, nbytes, error = queue.get()
+                proc.join()
+                if error:
+                    print('    %-10s %8g %6d    failed: %s' % (stage, m, n, error))
+                    continue
+                record['results'].append({'stage': stage, 'minutes': m, 'nfiles': n, 'seconds': seconds, 'peak_rss_mb': peak, 'bytes': nbytes})
+                print('    %-10s %8g %6d %10.3f %10.1f %12.2f %12.2f' % (stage, m, n, seconds, peak, nbytes/1024**2, nbytes/1024**2/max(seconds, 1e-9)))
+
+            shutil.rmtree(workdir)
+
+    stop()
+    shutil.rmtree(tmpdir)
+
+    # compare with the last run that measured the same thing
+    history = json.load(open(args.history)) if os.path.exists(args.history) else []
+    previous = dict()
+    for run in history:
+        if run.get('rate_hz') == args.rate:
+            for r in run['results']:
+                previous[(r['stage'], r['minutes'], r['nfiles'])] = (run['commit'], r)
+    print('')
+    for r in record['results']:
+        old = previous.get((r['stage'], r['minutes'], r['nfiles']))
+        if old is not None and r['seconds'] > args.tolerance*old[1]['seconds']:
+            print('    Slower: %s (%g min, %d files) %.3f s, was %.3f s at %s' % (r['stage'], r['minutes'], r['nfiles'], r['seconds'], old[1]['seconds'], old[0]))
+
+    history.append(record)
+    with open(args.history, 'w') as f:
+        json.dump(history, f, indent=1)
+    print('    Added to '+args.history)
+    print('')
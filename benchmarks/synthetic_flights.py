@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : synthetic_flights.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Writes synthetic Meteodrone-style RAW netCDF files for the
+#                 benchmarks: one vertical profile (up and back down) per
+#                 file, sampled at a given rate for a given duration, in the
+#                 units the drone reports (C, hPa, fraction). Variables use
+#                 the raw names of define_alt_names() (the longest alias of
+#                 each WMO name, but time and altitude) plus the wind 
+#                 components and potential temperature that quicklooks.py
+#                 plots, so the files go through the same renames and 
+#                 conversions as real ones.
+#
+#  USAGE        : python3 benchmarks/synthetic_flights.py -p /tmp/RAW/ -n 10 -m 20 -r 10
+#
+#  DEPENDENCIES : netCDF4, numpy
+
+import argparse, os, sys
+import netCDF4 as nc
+import numpy as np
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from wmo_definitions import define_alt_names
+
+
+# the raw name of each WMO variable, as the drone would write it
+def raw_names():
+
+    names = {wmo: max(sorted(aliases), key=len) for wmo, aliases in define_alt_names().items()}
+
+    # the Meteodrone uses the WMO names for these
+    names['time'] = 'time'
+    names['altitude'] = 'altitude'
+
+    return names
+
+
+# Write one synthetic flight to fullfile starting at start (datetime),
+# sampled at rate Hz for duration seconds, climbing to top m above the
+# launch site and back. seed makes the noise repeatable.
+def make_flight(fullfile, start, duration=600., rate=1., top=300., seed=0):
+
+    rng = np.random.default_rng(seed)
+    n = int(duration*rate)
+    t = np.arange(n)/rate
+    ground = 272.
+    h = top*(1-np.abs(2*t/max(t[-1], 1.)-1))
+    noise = lambda scale: scale*rng.standard_normal(n)
+
+    temp = 20.-0.0065*h+noise(0.1)                           # C
+    press = 1013.25*np.exp(-(ground+h)/8000.)                 # hPa
+    rh = np.clip(0.5+0.0005*h+noise(0.01), 0., 1.)            # fraction
+    dew = temp-(100.-100.*rh)/5.
+    u, v, w = 2.+noise(1.), 1.+noise(1.), noise(0.1)
+    theta = (temp+273.15)*(1000./press)**0.286
+
+    data = {
+        'time':                        (t, 'seconds since '+start.strftime('%Y-%m-%dT%H:%M:%S')+'Z'),
+        'lat':                         (47.57+np.zeros(n), 'degrees_north'),
+        'lon':                         (9.04+np.zeros(n), 'degrees_east'),
+        'altitude':                    (ground+h, 'm'),
+        'air_temperature':             (temp, 'degC'),
+        'dew_point_temperature':       (dew, 'degC'),
+        'wind_direction':              (np.degrees(np.arctan2(-u, -v)) % 360, 'degrees'),
+        'wind_speed':                  (np.hypot(u, v), 'm/s'),
+        'relative_humidity':           (rh, '1'),
+        'humidity_mixing_ratio':       (0.008+noise(0.0001), 'kg/kg'),
+        'turbulent_kinetic_energy':    (np.abs(noise(0.2)), 'm2/s2'),
+        'eddy_dissipation_rate':       (np.abs(noise(0.001)), 'm2/s3'),
+        'air_pressure':                (press, 'hPa'),
+        'non_coordinate_geopotential': (9.80665*(ground+h), 'm2/s2'),
+        'geopotential_height':         (ground+h, 'm'),
+    }
+    extra = {'wind_u': (u, 'm/s'), 'wind_v': (v, 'm/s'), 'wind_w': (w, 'm/s'), 'potential_temp': (theta, 'K')}
+
+    names = raw_names()
+    with nc.Dataset(fullfile, 'w') as f:
+        f.createDimension('time', n)
+        for name, (values, units) in [(names[wmo], data[wmo]) for wmo in names]+list(extra.items()):
+            var = f.createVariable(name, 'f8', ('time',))
+            var.units = units
+            var[:] = values
+        f.platform_name = 'meteodrone-00'
+        f.flight_id = 'SYNTHETIC_'+str(int(top))+'m_VP'
+        f.Conventions = 'CF-1.8'
+
+    return fullfile
+
+
+# Write nfiles flights to path, one hour apart from start. Returns the names.
+def make_flights(path, nfiles, duration=600., rate=1., top=300., start=datetime(2024, 5, 1, 10)):
+
+    fnames = []
+    for n in range(nfiles):
+        flighttime = start+timedelta(hours=n)
+        fnames.append(flighttime.strftime('%Y%m%d%H%M%S')+'_synthetic.nc')
+        make_flight(path+fnames[-1], flighttime, duration, rate, top, seed=n)
+
+    return fnames
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--filepath', metavar='str', help='Where to write the files')
+    parser.add_argument('-n', '--nfiles', metavar='int', type=int, default=1, help='Number of flights')
+    parser.add_argument('-m', '--minutes', metavar='float', type=float, default=10., help='Duration of each flight')
+    parser.add_argument('-r', '--rate', metavar='Hz', type=float, default=1., help='Sample rate')
+    parser.add_argument('-t', '--top', metavar='m', type=float, default=300., help='Highest point above the launch site')
+    args = parser.parse_args()
+
+    path = os.path.join(args.filepath, '')
+    os.makedirs(path, exist_ok=True)
+    for fname in make_flights(path, args.nfiles, 60*args.minutes, args.rate, args.top):
+        print('    Wrote '+path+fname+' ('+'%.1f' % (os.path.getsize(path+fname)/1024**2)+' MB)')
@@ -16,23 +16,38 @@
 #                   python3 openS3.py -t entry   
 #                 This would show contents of the UASDC product bucket:
 #                   python3 openS3.py -t product
-#                 Optionally, you can also -i NNN to specify the OperatorID,
-#                 which is useful because without it output is truncated for
-#                 populous folders.                    
+#                 Optionally, you can also -i NNN to specify the OperatorID.
+#
+#                 Listings come from a local index of the buckets (see
+#                 PSL_UASDC_s3index.py) that is brought up to date first,
+#                 which only lists what is new. Use -c to skip that and 
+#                 query the index as it is, and --full to relist every month
+#                 (done by itself once a week, for files backfilled into
+#                 older months). The listing can be narrowed down:
+#                   python3 openS3.py -t entry -i 007 -a AstonMartinDB5 -s 20240501 -e 20240531
+#                 and netCDFs that never produced a BUFR can be listed with:
+#                   python3 openS3.py -t entry -i 007 -m
 #
 #  DEPENDENCIES : Boto3 Python module supported for Python 3.8+ 
 
 
 
 # Get your modules out
-import boto3, os, argparse
-from boto3 import client
-from access_info import access_info
+import argparse
+from PSL_UASDC_uploadfiles import get_s3
+from PSL_UASDC_s3index import default_index, open_index, refresh_index, query_index
 
 # entry if you want to see the entry bucket, product if you want to see the product bucket, buckets if you want a list of available buckets.
 parser = argparse.ArgumentParser()
 parser.add_argument('-t', '--task', metavar='str', help='Where do you want to look: buckets, product, or entry?')
 parser.add_argument('-i', '--id', metavar='str', help='Operator ID')
+parser.add_argument('-a', '--airframeID', metavar='str', help='Only this airframe')
+parser.add_argument('-s', '--start', metavar='yyyymmdd', help='Only flights on or after this date')
+parser.add_argument('-e', '--end', metavar='yyyymmdd', help='Only flights on or before this date')
+parser.add_argument('-m', '--missing_bufr', action='store_true', help='Only netCDFs in the entry bucket without a BUFR in the product bucket')
+parser.add_argument('-c', '--cached', action='store_true', help='Do not refresh the index from S3 first')
+parser.add_argument('--full', action='store_true', help='Relist every month, not only the recent ones (done once a week anyway)')
+parser.add_argument('--index', metavar='str', default=default_index, help='Index file')
 args = parser.parse_args()
 task = ''
 opid = ''
@@ -40,49 +55,42 @@ if args.task: task = args.task
 if args.id: opid = args.id+'/'
 
 
-# this information is stored in a separate file, access_info.py
-username, aws_key, aws_secret_key, entry_bucket, product_bucket = access_info()
-
 # We are using AWS S3
 print('')
-print('    Accessing Amazon AWS S3.')
+s3, entry_bucket, product_bucket = get_s3()
 print('')
 
-# Setauthentication credentials as environment variables
-os.environ['AWS_ACCESS_KEY_ID'] = aws_key
-os.environ['AWS_SECRET_ACCESS_KEY'] = aws_secret_key
-
-# Also, set directly, just in case
-s3 = boto3.resource('s3',aws_access_key_id=aws_key,aws_secret_access_key= aws_secret_key)
-
 
+if task in ['entry', 'product']:
 
-if task == 'entry':
+    bucket = entry_bucket if task == 'entry' else product_bucket
+    conn = open_index(args.index)
 
-    print('    Printing contents of UASDC entry bucket:')
-    print('')
+    # bring the index up to date, both buckets if we need to match them
+    if not args.cached:
+        for b in ([entry_bucket, product_bucket] if args.missing_bufr else [bucket]):
+            refresh_index(conn, b, opid, full=args.full)
+        print('')
 
-    conn = client('s3')  # again assumes boto.cfg setup, assume AWS S3
-    for key in conn.list_objects(Bucket=entry_bucket,Prefix=opid)['Contents']: print(key['Key'])    
+    print('    Printing contents of UASDC '+task+' bucket:')
     print('')
-
-elif task == 'product':
- 
-    print('    Printing contents of UASDC product bucket:')
+    
+    rows = query_index(conn, bucket, args.id, args.airframeID, args.start, args.end, args.missing_bufr and task == 'entry', product_bucket)
+    for key, size, last_modified in rows: print(key)
     print('')
-    conn = client('s3')  # again assumes boto.cfg setup, assume AWS S3
-    for key in conn.list_objects(Bucket=product_bucket,Prefix=opid)['Contents']: print(key['Key'])
+    print('    '+str(len(rows))+' objects.')
     print('')
+    conn.close()
 
 elif task == 'buckets':
 
     print('    Printing UASDC S3 buckets list:')
     print('')
     
-    for bucket in s3.buckets.all(): 
+    for bucket in s3.list_buckets()['Buckets']: 
         try: 
-            print(bucket.name) 
+            print(bucket['Name']) 
         except:
             print('no access')
 
-    print('')
\ No newline at end of file
+    print('')
@@ -29,6 +29,55 @@
 #                 Note that -a and -t are optional arguments. -o, -d, and -f are required. -a is needed if you want to change what is in the raw file. 
 #                 The order arguments are entered does not matter.
 #
+#                 Unattended (batch) use: instead of -f, give a glob with -g
+#                 and/or watch RAW for new files with -w. The y/n prompts are
+#                 then answered by the -y policy (see policies below) and
+#                 files are processed -n at a time by a pool of workers:
+#
+#                 python3 process_UASDC.py -o 007 -d /Users/Connery/London/ -g '2024*.nc' -w -y new -n 4
+#
+#                 To clear a backlog faster, --pipeline overlaps the steps
+#                 across files (see PSL_UASDC_pipeline.py), with the number
+#                 of workers for check, upload, BUFR wait and GSL given by
+#                 --stage_limits:
+#
+#                 python3 process_UASDC.py -o 007 -d /Users/Connery/London/ -g '2024*.nc' -y new --pipeline --stage_limits 2,4,16,2
+#
+#                 A backlog of STAGE files (and their BUFR) can be pushed to
+#                 GSL on its own, over one connection; files already there
+#                 with the same size are skipped:
+#
+#                 python3 process_UASDC.py -d /Users/Connery/London/ -g 'UASDC_007_*.nc' --gsl_backlog
+#
+#                 Every step is timed (with bytes, retries and peak memory)
+#                 into UASDC_metrics.jsonl in the base directory (--metrics),
+#                 which --prometheus sums up into a textfile for the
+#                 node_exporter when the run ends. --profile saves cProfile
+#                 and tracemalloc reports of the check next to the STAGE file.
+#
+#                 In the field, start a warm daemon once; it loads netCDF4,
+#                 boto3 (and the quicklooks libraries) once, keeps -n worker
+#                 processes with their S3 and GSL connections open, and
+#                 takes jobs from submit_UASDC.py, which has the same
+#                 -o/-a/-t/-d/-f arguments and starts in milliseconds:
+#
+#                 python3 process_UASDC.py --daemon -n 2
+#                 python3 submit_UASDC.py -o 007 -a AstonMartinDB5 -d /Users/Connery/London/ -f goldfinger.nc
+#
+#                 Files wait in the outbox (OUTBOX/ in the base directory)
+#                 until S3 and GSL have them. When either cannot be reached
+#                 they are sent, newest flight first, once it can by the
+#                 sender in the daemon or batch mode, or on its own:
+#
+#                 python3 process_UASDC.py -d /Users/Connery/London/ --outbox
+#
+#                 During the flight, the ground-station telemetry (CSV or
+#                 JSON lines, see PSL_UASDC_stream.py) can be ingested as it
+#                 comes, with snapshots of the profile uploaded every
+#                 --snapshot_every s or --snapshot_dz m:
+#
+#                 python3 process_UASDC.py -o 007 -a AstonMartinDB5 -d /Users/Connery/London/ --stream telemetry.csv --template RAW/goldfinger.nc
+#
 #  PREP         : Create two folders, RAW and STAGE in the base directory,
 #                 which is the directory you specify as an argument when
 #                 executing the function. When you transfer a file from the 
@@ -39,150 +88,482 @@
 #python3 process_UASDC.py -o 007 -a AstonMartinDB5 -t 19641222000000 -d /Users/ccox/Documents/Projects/2024/FireWeather/compare_files/ -f 20240501221756_Lat_47.5738578_Lon_9.0461255.nc
 
 # Prologue    
-import argparse, shutil, sys, os, time
-import netCDF4 as nc
-from PSL_UASDC_check_attributes import check_vars_atts
-from PSL_UASDC_uploadfiles import upload_file, download_bufr
-import ftplib
-from datetime import datetime
-
-# parse arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('-o', '--operatorID', metavar='str', help='Operator ID')
-parser.add_argument('-a', '--airframeID', metavar='str', help='Airframe ID')
-parser.add_argument('-t', '--flighttime', metavar='str', help='Flight time yyyymmddhhmmss')
-parser.add_argument('-d', '--basedir', metavar='str', help='Parent directory of RAW and STAGE')
-parser.add_argument('-f', '--filename', metavar='str', help='File to process')
-args = parser.parse_args()
-
-if args.operatorID: operatorID = args.operatorID
-if args.basedir:    base_dir = args.basedir
-if args.filename:   fname = args.filename
-
-# check basedir for format
-if base_dir[-1] != '/':
-    base_dir = base_dir+'/'
-
-# and open the file
-file = nc.Dataset(base_dir+'RAW/'+fname,'r')
-
-# try to get the flight time from the file name if not passed as arg. if that 
-# fails, tell user to manually supply it.
-if args.flighttime: 
-    flighttime = args.flighttime
-    if flighttime[-1] != 'Z':
-        flighttime = flighttime+'Z'
-else:
-    #flighttime = fname[0:14] # datetime.strptime(file.variables['time'].getncattr('units')[14:-1], '%Y-%m-%dT%H:%M:%S')
-    ftmp = file.variables['time'].getncattr('units')[14:-1]
-    flighttime = ftmp[0:4]+ftmp[5:7]+ftmp[8:10]+ftmp[11:13]+ftmp[14:16]+ftmp[17:19] 
-    if not flighttime.isdigit():
-        print('')
-        print('    Exiting. Filename unexpected format. Please supply flighttime as argument; i.e., -t yyyymmddhhmmss')
-        print('')
-        sys.exit()        
-    flighttime = flighttime+'Z'
-
-# try to get the platform ID (airframe ID) from the globals if not provided
-if args.airframeID: 
-    airframeID = args.airframeID
-else:
-    try:
-        airframeID = file.getncattr('platform_name')
-    except:       
+import argparse, asyncio, runpy, sys, os, threading, time
+from PSL_UASDC_uploadfiles import poll_bufr, set_transfer_config, get_s3, s3_endpoint
+from PSL_UASDC_batch import find_files, process_batch
+from PSL_UASDC_ledger import file_hash, stage_done, mark_done
+from PSL_UASDC_gsl import set_gsl, send_files, gsl_files, close_sessions, get_session, put_session, gsl_endpoint
+from PSL_UASDC_outbox import open_outbox, enqueue, dequeue, deliver, reachable, run_sender, outbox_dir
+from PSL_UASDC_stream import stream_flight
+from PSL_UASDC_flight import flight_info, stage_flight
+from PSL_UASDC_pipeline import run_pipeline
+from PSL_UASDC_metrics import set_metrics, write_prometheus
+from PSL_UASDC_daemon import serve, default_socket, default_spool, has_unix_sockets
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PSL_UASDC_schema import set_profile, get_schema
+from PSL_UASDC_convert import set_storage
+from PSL_UASDC_qc import set_qc, qc_held
+from wmo_definitions import define_profiles
+from functools import partial
+
+# GSL ftp server
+gsl_host = ***REMOVED***
+gsl_dir  = 'its/psl_uas_fire_wx'
+
+# Answers given to the three y/n prompts (overwrite STAGE, upload to bucket,
+# upload to GSL) when running unattended. 'ask' prompts the user as usual.
+policies = {
+    'ask'    : None, 
+    'all'    : {'overwrite':'y', 'upload':'y', 'gsl':'y'}, # reprocess everything
+    'new'    : {'overwrite':'n', 'upload':'y', 'gsl':'y'}, # skip files already in STAGE
+    'bucket' : {'overwrite':'n', 'upload':'y', 'gsl':'n'}, # as new, but no GSL
+    'stage'  : {'overwrite':'y', 'upload':'n', 'gsl':'n'}, # local check only, no uploads
+}
+
+
+# answer a y/n question, either by asking or from the policy
+def ask(question, prompt, policy):
+
+    if policies[policy] is None:
         print('')
-        print('    Exiting. platform_name not found in global atts. Please supply it as airframeID argument; i.e., -a name')
+        answer = input('    '+prompt+' enter y or n: ')
         print('')
+    else:
+        answer = policies[policy][question]
+    
+    return answer == 'y'
+
+
+# settings for each worker process (or the main one): S3 transfers, the
+# GSL ftp session pool, the metrics file, the schema profile (None to pick
+# one per airframe) and the storage of STAGE files (see set_storage). With
+# warm the S3 client, a GSL session and the schema are made right away 
+# rather than by the first file. qc_hold holds back files that fail QC
+# (see set_qc).
+def init_worker(transfer_args, gsl_args, metrics=None, warm=False, schema=None, storage_args=(), qc_hold=None):
+
+    set_transfer_config(*transfer_args)
+    set_gsl(*gsl_args)
+    set_metrics(metrics)
+    set_profile(schema)
+    set_storage(*storage_args)
+    set_qc(qc_hold)
+
+    if warm:
+        get_s3()
+        get_schema()
+        try:
+            put_session(get_session())
+        except Exception as e:
+            print('    GSL not reachable yet ('+str(e)+').')
+
+
+# Process a single file in RAW from rename to GSL. Returns a short status
+# string. When policy is 'ask' the user is prompted at each step. The
+# product bucket is checked for the BUFR for up to bufr_deadline seconds.
+# Steps the ledger says are already done for this RAW file are skipped 
+# unless redo is set. profile saves a profile of step 2 next to the STAGE file.
+# Files go to S3 and GSL through the outbox (PSL_UASDC_outbox.py), so what
+# cannot be delivered now, because S3 or GSL cannot be reached, is sent by
+# the outbox sender later.
+def process_file(base_dir, fname, operatorID, airframeID=None, flighttime=None, policy='ask', bufr_deadline=120., redo=False, profile=False):
+
+    # flight time and airframe from the arguments or the RAW file
+    flighttime, airframeID, status = flight_info(base_dir+'RAW/'+fname, airframeID, flighttime)
+    if status:
+        return status
     
 
+    # # # STEP 1. Move and rename the file  # # #
 
-# # # STEP 1. Move and rename the file  # # #
+    # format: UASDC_operatorID_airframeID_YYYYMMDDHHMMSSZ.nc
+    new_fname = 'UASDC_'+operatorID+'_'+airframeID+'_'+flighttime+'.nc'
 
-# format: UASDC_operatorID_airframeID_YYYYMMDDHHMMSSZ.nc
-new_fname = 'UASDC_'+operatorID+'_'+airframeID+'_'+flighttime+'.nc'
+    # what has already been done with this file?
+    ledger = open_outbox(base_dir)
+    key = (file_hash(base_dir+'RAW/'+fname), get_schema(airframeID)['version'])
+    done = {stage: None if redo else stage_done(ledger, key, stage) for stage in ['stage', 'upload', 'bufr', 'gsl', 'qc']}
 
+    # # # STEP 2. Check vars and atts # # #
 
-if os.path.exists(base_dir+'STAGE/'+new_fname):
-    
-    print('')
-    proceed = input('    The file already exists in STAGE. Do you want to overwrite it? enter y or n: ')
-    print('')
-    
-    if proceed != 'y':
-        print('    Exiting. Nothing was accomplished.')
-        print('')
-        sys.exit()
-    else:
-        os.remove(base_dir+'STAGE/'+new_fname)
+    # write the file from RAW to STAGE, renaming and correcting as we go
+    done = stage_flight(base_dir, fname, new_fname, airframeID, ledger, key, done,
+                        lambda: ask('overwrite', 'The file already exists in STAGE. Do you want to overwrite it?', policy), profile)
+    if done is None:
+        ledger.close()
+        return 'skipped, already in STAGE'
 
-# copy file from RAW to STAGE, renaming as we go
-shutil.copyfile(base_dir+'RAW/'+fname, base_dir+'STAGE/'+new_fname)
+    # too much of the profile flagged to go out?
+    if qc_held(done['qc']) and not done['upload']:
+        print('    '+new_fname+' failed QC (see STAGE/'+os.path.splitext(new_fname)[0]+'_qc.json), not uploading.')
+        ledger.close()
+        return 'staged, held back by QC'
 
 
-# # # STEP 2. Check vars and atts # # #
+    # # # STEP 3. Upload # # #
 
-check_vars_atts(base_dir+'STAGE/',new_fname,airframeID)
+    # what goes out waits in the outbox until it is delivered
+    flight = {'fname':fname, 'new_fname':new_fname, 'operatorID':operatorID, 'airframeID':airframeID, 'key':key}
+    bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
 
+    uploaded = bool(done['upload'])
+    if done['upload']:
+        print('    Already uploaded to bucket (ETag '+done['upload']+'), skipping upload.')
+    elif not ask('upload', 'Your file is ready to upload to the bucket. Would you like to proceed?', policy):
+        print('    Exiting without upload to bucket.')
+        ledger.close()
+        return 'staged, not uploaded'
+    else:
+        enqueue(ledger, base_dir, base_dir+'STAGE/'+new_fname, 's3', flight)
+        if not reachable(s3_endpoint()):
+            print('')
+            print('    S3 cannot be reached. '+new_fname+' waits in '+base_dir+outbox_dir+' and goes as soon as it can')
+            print('    (python3 process_UASDC.py -d '+base_dir+' --outbox, or a running daemon).')
+        else:
+            uploaded = deliver(base_dir, new_fname, 's3')
+            if uploaded is None:
+                print('    '+new_fname+' is being uploaded by the outbox sender.')
+            elif not uploaded:
+                print('    Upload failed, '+new_fname+' stays in '+base_dir+outbox_dir+'.')
+        
+        
+    # # # STEP 4. check for success # # #
+
+    if uploaded and done['bufr'] and os.path.exists(base_dir+'BUFR/'+bufr_name):
+        print('    BUFR file already downloaded, skipping check.')
+
+    elif uploaded:
+        print('')
+        print('    Checking for BUFR file in product bucket.')
+
+        if poll_bufr(base_dir+'BUFR/',[(new_fname,operatorID,airframeID)],deadline=bufr_deadline)[new_fname]:
+            print('')
+            print('    BUFR file found in product bucket and downloaded.')
+            mark_done(ledger, key, 'bufr', fname, bufr_name)
+            dequeue(ledger, base_dir, new_fname, 'bufr')
+        else:
+            print('')
+            print('    No bufr file found in product bucket. Only the netCDF can go to GSL;')
+            print('    the outbox sender keeps looking for the BUFR.')
+            print('')   
+
+
+    # # # STEP 5. Upload to GSL ftp # # #
+
+    status = 'uploaded' if uploaded else 'queued for upload'
+
+    # a netCDF sent without its BUFR will be sent again once the BUFR is in
+    if done['gsl'] is not None and done['gsl'] == (stage_done(ledger, key, 'bufr') or ''):
+        print('    Already sent to GSL, skipping.')
+    elif not ask('gsl', 'You may now upload *nc and *.bufr to GSL. Would you like to proceed?', policy):
+        print('    Exiting without upload to GSL.')
+        ledger.close()
+        return status+', not sent to GSL'
+    else:    
+        names = []
+        if os.path.exists(base_dir+'BUFR/'+bufr_name) and done['gsl'] != bufr_name and (redo or stage_done(ledger, key, 'gsl_bufr') != bufr_name):
+            enqueue(ledger, base_dir, base_dir+'BUFR/'+bufr_name, 'gsl', flight)
+            names.append(bufr_name)
+        if done['gsl'] is None:
+            enqueue(ledger, base_dir, base_dir+'STAGE/'+new_fname, 'gsl', flight)
+            names.append(new_fname)
+        if not reachable(gsl_endpoint()):
+            print('')
+            print('    GSL cannot be reached. The files wait in '+base_dir+outbox_dir+' and go as soon as it can.')
+            ledger.close()
+            return status+', queued for GSL'
+        if not all([deliver(base_dir, name, 'gsl') for name in names]):
+            ledger.close()
+            return status+', GSL transfer failed, queued for GSL'
+        print('')
+        print('    Files uploaded to GSL.')    
+    
+    ledger.close()
+    return 'uploaded and sent to GSL' if uploaded else status+', sent to GSL'
 
-# # # STEP 3. Upload # # #
 
-print('')
-proceed = input('    Your file is ready to upload to the bucket. Would you like to proceed? enter y or n: ')
-print('')
+# # # DAEMON # # #
 
-if proceed != 'y':
-    print('    Exiting without upload to bucket.')
-    sys.exit()
-else:
-    upload_file(base_dir+'STAGE/',new_fname,operatorID,airframeID)
-    
-    
-# # # STEP 4. check for success # # #
+# A process job from submit_UASDC.py, run in a warm worker process. The
+# metrics go to the base directory of the job unless it names a file.
+def process_job(job):
 
-print('')
-print('    Checking for BUFR file in product bucket. Wait 5 sec.')
-time.sleep(5)    # Pause 5 seconds
+    base_dir = os.path.join(job['basedir'], '')
+    set_metrics(job['metrics'] if job.get('metrics') else base_dir+'UASDC_metrics.jsonl')
 
-try:
-    download_bufr(base_dir+'BUFR/',new_fname,operatorID,airframeID)
-except:
-    print('')
-    print('    No bufr file found in product bucket.')
-    print('')   
+    return process_file(base_dir, job['filename'], job['operatorID'], job.get('airframeID'), job.get('flighttime'),
+                        job.get('policy', 'new'), job.get('bufr_deadline', 120.), job.get('redo', False), job.get('profile', False))
 
-print('')
-print('    BUFR file found in product bucket and downloaded.')
 
+# quicklooks.py runs in the daemon process itself, where its libraries are
+# already imported, one run at a time (it changes sys.argv and the cwd)
+quicklooks_lock = threading.Lock()
 
-# # # STEP 5. Upload to GSL ftp # # #
+def run_quicklooks(job):
 
-print('')
-proceed = input('    You may now upload *nc and *.bufr to GSL. Would you like to proceed? enter y or n: ')
-print('')
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'quicklooks.py')
+    with quicklooks_lock:
+        argv, cwd = sys.argv, os.getcwd()
+        sys.argv = [script]+job['argv']
+        try:
+            os.chdir(job.get('cwd', cwd))
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit as e:
+            if e.code:
+                return 'quicklooks failed (exit '+str(e.code)+')'
+        finally:
+            sys.argv = argv
+            os.chdir(cwd)
 
+    return 'quicklooks done'
+
+
+# Run the daemon: nworkers warm processes for process jobs, quicklooks in
+# this process, until a stop job or Ctrl-C. The outbox of each base 
+# directory it gets jobs for is sent by a sender thread of this process,
+# probing S3 and GSL every probe_every seconds. Files that fail QC are
+# held back as qc_hold says (see init_worker).
+def run_daemon(sock, spool, nworkers, transfer_args, gsl_args, schema=None, storage_args=(), probe_every=30., qc_hold=None):
 
-if proceed != 'y':
-    print('    Exiting without upload to GSL.')
-    sys.exit()
-else:    
-    # upload the bufr
-    os.chdir(base_dir+'BUFR/')
-    bufr_name = os.path.splitext(new_fname)[0]+'.bufr'
-    session = ftplib.FTP(***REMOVED***)
-    session.cwd('its/psl_uas_fire_wx')
-    with open(bufr_name, 'rb') as file: session.storbinary('STOR '+bufr_name, file)
-    file.close()                                    # close file and FTP
-    session.quit()    
-    # upload the netcdf
-    os.chdir(base_dir+'STAGE/')
-    session = ftplib.FTP(***REMOVED***)
-    session.cwd('its/psl_uas_fire_wx')
-    with open(new_fname, 'rb') as file: session.storbinary('STOR '+new_fname, file)
-    file.close()                                    # close file and FTP
-    session.quit()
     print('')
-    print('    Files uploaded to GSL.')    
-    
-    
+    print('    Warming up '+str(nworkers)+' workers.')
+    try:
+        import matplotlib, pandas, xarray
+        quicklooks_ready = True
+    except ImportError:
+        quicklooks_ready = False
+        print('    The quicklooks libraries are not installed, only process jobs will be taken.')
+
+    def start_workers():
+        executor = ProcessPoolExecutor(max_workers=nworkers, initializer=init_worker, initargs=(transfer_args, gsl_args, None, True, schema, storage_args, qc_hold))
+        for future in [executor.submit(os.getpid) for n in range(nworkers)]:
+            future.result()
+        return executor
+
+    processes = [start_workers()]
+    plots = ThreadPoolExecutor(max_workers=1)
+    lock = threading.Lock()
+
+    # one outbox sender per base directory
+    init_worker(transfer_args, gsl_args, None, False, schema, storage_args, qc_hold)
+    senders = dict()
+    stopping = threading.Event()
+
+    def run_job(job):
+        cmd = job.get('cmd')
+        print('    '+time.strftime('%H:%M:%S')+' '+str(cmd)+' '+str(job.get('filename', ' '.join(job.get('argv', [])))))
+        if cmd == 'ping':
+            future = Future()
+            future.set_result('alive, '+str(nworkers)+' workers')
+            return future
+        if cmd == 'quicklooks':
+            if not quicklooks_ready:
+                raise ValueError('the daemon cannot make quicklooks, their libraries are not installed')
+            return plots.submit(run_quicklooks, job)
+        if cmd != 'process':
+            raise ValueError('unknown job '+str(cmd))
+        if job.get('policy') == 'ask':
+            raise ValueError('the daemon cannot ask, use a policy; i.e., -y new')
+        with lock:
+            base_dir = os.path.join(job['basedir'], '')
+            if base_dir not in senders:
+                senders[base_dir] = threading.Thread(target=run_sender, args=(base_dir, stopping, probe_every), daemon=True)
+                senders[base_dir].start()
+            try:
+                return processes[0].submit(process_job, job)
+            except BrokenProcessPool:
+                # a worker died, start over with fresh ones
+                print('    A worker died, restarting the workers.')
+                processes[0] = start_workers()
+                return processes[0].submit(process_job, job)
+
+    print('    Ready.')
+    try:
+        serve(run_job, sock, spool)
+    finally:
+        print('    Finishing jobs already started.')
+        stopping.set()
+        plots.shutdown()
+        processes[0].shutdown()
+        for sender in senders.values():
+            sender.join()
+
+
+if __name__ == '__main__':
+
+    # parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--operatorID', metavar='str', help='Operator ID')
+    parser.add_argument('-a', '--airframeID', metavar='str', help='Airframe ID')
+    parser.add_argument('-t', '--flighttime', metavar='str', help='Flight time yyyymmddhhmmss')
+    parser.add_argument('-d', '--basedir', metavar='str', help='Parent directory of RAW and STAGE')
+    parser.add_argument('-f', '--filename', metavar='str', help='File to process')
+    parser.add_argument('-g', '--glob', metavar='str', help='Process all files in RAW matching this pattern, e.g. \'2024*.nc\'')
+    parser.add_argument('-w', '--watch', action='store_true', help='Keep watching RAW and process new files as they arrive')
+    parser.add_argument('-y', '--policy', metavar='str', choices=list(policies), help='Answers to the y/n prompts: '+', '.join(policies)+' (batch default: new)')
+    parser.add_argument('-n', '--nworkers', metavar='int', type=int, default=4, help='Number of files processed at once in batch mode')
+    parser.add_argument('--chunk_mb', metavar='MB', type=float, default=8., help='S3 multipart threshold and part size')
+    parser.add_argument('--s3_concurrency', metavar='int', type=int, default=10, help='Parallel S3 connections per transfer')
+    parser.add_argument('--max_kbps', metavar='kbit/s', type=float, default=None, help='Cap on the S3 upload rate of the whole run, to leave room on the link (default: none)')
+    parser.add_argument('--redo', action='store_true', help='Process again even if the ledger says it was done')
+    parser.add_argument('--gsl_sessions', metavar='int', type=int, default=2, help='GSL ftp sessions kept open (and files sent at once) per worker')
+    parser.add_argument('--pipeline', action='store_true', help='Batch mode as an asyncio pipeline that overlaps the steps across files')
+    parser.add_argument('--stage_limits', metavar='c,u,b,g', default='2,4,16,2', help='Pipeline workers for check, upload, BUFR wait and GSL')
+    parser.add_argument('--gsl_backlog', action='store_true', help='Only send the STAGE files matching -g, and their BUFR, to GSL over one connection')
+    parser.add_argument('--outbox', action='store_true', help='Only send what waits in the outbox of the base directory, as S3 and GSL can be reached, until stopped')
+    parser.add_argument('--probe_every', metavar='sec', type=float, default=30., help='How often the outbox sender probes S3 and GSL')
+    parser.add_argument('--stream', metavar='str', help='Ingest the telemetry in this file (- for stdin) during the flight and upload snapshots of the profile')
+    parser.add_argument('--template', metavar='str', help='With --stream, a RAW file of the same UAS for the attributes the telemetry does not carry')
+    parser.add_argument('--snapshot_every', metavar='sec', type=float, default=60., help='With --stream, upload a snapshot every this many seconds of flight')
+    parser.add_argument('--snapshot_dz', metavar='m', type=float, default=50., help='With --stream, and every this many meters of climb or descent')
+    parser.add_argument('--stream_idle', metavar='sec', type=float, default=120., help='With --stream, the flight is over when no telemetry came for this long')
+    parser.add_argument('-b', '--bufr_deadline', metavar='sec', type=float, default=120., help='How long to wait for the BUFR file in the product bucket')
+    parser.add_argument('--metrics', metavar='str', help='Append the timings of every step to this JSON lines file (default: base directory/UASDC_metrics.jsonl)')
+    parser.add_argument('--prometheus', metavar='str', help='When the run ends, write the metrics summed up by step to this Prometheus textfile')
+    parser.add_argument('--profile', action='store_true', help='Save cProfile and tracemalloc reports of the check of each file next to the STAGE file')
+    parser.add_argument('--schema', metavar='str', choices=list(define_profiles()), help='Check every file against this profile of wmo_definitions.py (default: picked by airframe)')
+    parser.add_argument('--complevel', metavar='int', type=int, default=4, help='Deflate level of the STAGE files, 0 for none')
+    parser.add_argument('--no_shuffle', action='store_true', help='Compress the STAGE files without the shuffle filter')
+    parser.add_argument('--chunk_records', metavar='int', type=int, default=8192, help='Records per chunk of the STAGE variables')
+    parser.add_argument('--float32', action='store_true', help='Write the variables listed in define_storage() as float32')
+    parser.add_argument('--qc_hold', metavar='frac', type=float, help='Do not upload files with a variable flagged by QC in more than this fraction of its records')
+    parser.add_argument('--daemon', action='store_true', help='Stay up with -n warm workers and take jobs from submit_UASDC.py')
+    parser.add_argument('--socket', metavar='str', default=None, help='Unix socket of the daemon (default: '+default_socket()+')')
+    parser.add_argument('--spool', metavar='str', default=None, help='Also take daemon jobs dropped in this spool directory (default where there are no Unix sockets: '+default_spool()+')')
+    args = parser.parse_args()
+
+    # S3 transfer settings, shared by all transfers in a process, so the
+    # bandwidth cap is split between the worker processes
+    processes = args.nworkers if args.daemon or ((args.glob or args.watch) and not (args.pipeline or args.gsl_backlog)) else 1
+    bandwidth = args.max_kbps*1000/8/processes if args.max_kbps else None
+    transfer_args = (int(args.chunk_mb*1024**2), int(args.chunk_mb*1024**2), args.s3_concurrency, bandwidth)
+    gsl_args = (gsl_host, gsl_dir, '', '', args.gsl_sessions)
+    storage_args = (args.complevel, not args.no_shuffle, args.chunk_records, args.float32)
+
+    if args.daemon:
+        sock = (args.socket if args.socket else default_socket()) if has_unix_sockets else None
+        spool = args.spool if args.spool else (None if has_unix_sockets else default_spool())
+        run_daemon(sock, spool, args.nworkers, transfer_args, gsl_args, args.schema, storage_args, args.probe_every, args.qc_hold)
+        sys.exit()
+
+    if args.operatorID: operatorID = args.operatorID
+    if args.basedir:    base_dir = args.basedir
 
+    # check basedir for format
+    if base_dir[-1] != '/':
+        base_dir = base_dir+'/'
 
+    metrics = args.metrics if args.metrics else base_dir+'UASDC_metrics.jsonl'
+    init_worker(transfer_args, gsl_args, metrics, False, args.schema, storage_args, args.qc_hold)
+    sender, stop_sender = None, threading.Event()
+
+    try:
+        if args.gsl_backlog:
+
+            # files already on GSL with the right size are not sent again
+            fnames = find_files(base_dir+'STAGE/', args.glob if args.glob else 'UASDC_*.nc')
+            print('')
+            print('    Sending '+str(len(fnames))+' STAGE files (and BUFR) to GSL.')
+            sent = send_files([f for fname in fnames for f in gsl_files(base_dir, fname)], nthreads=1, skip_same_size=True)
+            close_sessions()
+            print('')
+            print('    Done. '+str(sum(sent.values()))+' of '+str(len(sent))+' files on GSL.')
+            for f in sent:
+                if not sent[f]: print('    Failed: '+f)
+            print('')
+
+        elif args.outbox:
+
+            print('')
+            print('    Sending the outbox as S3 and GSL can be reached, probing every '+str(args.probe_every)+' s. Ctrl-C to stop.')
+            try:
+                run_sender(base_dir, interval=args.probe_every)
+            except KeyboardInterrupt:
+                print('')
+                print('    Stopped. What was not sent stays in '+base_dir+outbox_dir)
+                print('')
+
+        elif args.stream:
+
+            # snapshots that cannot go up right away go from the outbox meanwhile
+            sender = threading.Thread(target=run_sender, args=(base_dir, stop_sender, args.probe_every), daemon=True)
+            sender.start()
+
+            print('')
+            print('    Streaming '+args.stream+', a snapshot every '+str(args.snapshot_every)+' s or '+str(args.snapshot_dz)+' m. Ctrl-C to end.')
+            status = stream_flight(base_dir, args.stream, operatorID, args.airframeID, args.flighttime, args.template,
+                                   args.snapshot_every, args.snapshot_dz, args.stream_idle)
+            print('')
+            print('    Done, '+status+'. Process the RAW file as usual after the flight.')
+            print('')
+
+        elif args.glob or args.watch:
+
+            # nobody is around to answer prompts
+            policy = args.policy if args.policy else 'new'
+            if policy == 'ask':
+                print('')
+                print('    Exiting. Batch mode needs a policy other than ask; i.e., -y new')
+                print('')
+                sys.exit()
+
+            # one flight time for every file would give them all the same name
+            if args.flighttime:
+                print('')
+                print('    Exiting. -t is for a single file (-f); in batch mode the flight time comes from each RAW file.')
+                print('')
+                sys.exit()
+
+            fnames = find_files(base_dir+'RAW/', args.glob) if args.glob else []
+
+            # what cannot be delivered right away goes from the outbox meanwhile
+            sender = threading.Thread(target=run_sender, args=(base_dir, stop_sender, args.probe_every), daemon=True)
+            sender.start()
+
+            if args.pipeline:
+
+                if args.watch:
+                    print('')
+                    print('    Exiting. --pipeline works through the files matching -g, it does not watch RAW.')
+                    print('')
+                    sys.exit()
+
+                limits = dict(zip(['check', 'upload', 'bufr', 'gsl'], [int(n) for n in args.stage_limits.split(',')]))
+                print('')
+                print('    Processing '+str(len(fnames))+' files in a pipeline ('+args.stage_limits+' workers for check, upload, BUFR, GSL).')
+                results, busy = asyncio.run(run_pipeline(base_dir, fnames, operatorID, args.airframeID, args.flighttime, policies[policy], args.redo,
+                                                         limits=limits, bufr_deadline=args.bufr_deadline, initializer=init_worker, initargs=(transfer_args, gsl_args, metrics, False, args.schema, storage_args, args.qc_hold), profile=args.profile))
+                close_sessions()
+                print('')
+                for fname in fnames: print('    '+fname+': '+results.get(fname, 'not processed'))
+                print('')
+                print('    Done. '+str(len(results))+' files in '+'%.1f' % busy['total']+' s. Time spent per stage: '+
+                      ', '.join(stage+' %.1f s' % busy[stage] for stage in ['check', 'upload', 'bufr', 'gsl']))
+                print('')
+
+            else:
+
+                worker = partial(process_file, base_dir, operatorID=operatorID, airframeID=args.airframeID, flighttime=args.flighttime, policy=policy, bufr_deadline=args.bufr_deadline, redo=args.redo, profile=args.profile)
+
+                print('')
+                print('    Processing '+str(len(fnames))+' files, '+str(args.nworkers)+' at a time.')
+                results = process_batch(worker, fnames, nworkers=args.nworkers, pool='process',
+                                        watch_dir=base_dir+'RAW/' if args.watch else None, pattern=args.glob or '*.nc',
+                                        initializer=init_worker, initargs=(transfer_args, gsl_args, metrics, False, args.schema, storage_args, args.qc_hold))
+                print('')
+                print('    Done. '+str(len(results))+' files processed.')
+                print('')
+
+        else:
+        
+            process_file(base_dir, args.filename, operatorID, args.airframeID, args.flighttime, args.policy if args.policy else 'ask', args.bufr_deadline, args.redo, args.profile)
+            close_sessions()
+
+    finally:
+        if sender is not None:
+            stop_sender.set()
+            sender.join()
+        # also when a watch is stopped with Ctrl-C
+        if args.prometheus and os.path.exists(metrics):
+            write_prometheus(metrics, args.prometheus)
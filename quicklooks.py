@@ -6,9 +6,27 @@
 #  AUTHOR       : Christopher J. Cox, NOAA/PSL
 #  DATE         : 21 June 2024  
 #
-#  SUMMARY      :
+#  SUMMARY      : Time-height curtain plots of a set of flights, drawn by
+#                 worker processes from the list of panels below. Only the
+#                 variables the plots need are read, by a few worker 
+#                 processes at a time (netCDF4/HDF5 is not thread safe), 
+#                 and each file is closed as soon as it has been read. The 
+#                 regridded columns are cached in .quicklooks_<prefix>_<legs>.nc
+#                 in the same directory, so only new or changed files are read
+#                 and regridded on the next run (-r to start over).
+#
+#                 The curtains can be held as float32 (-d), on a coarser or
+#                 stretched height grid (-z, -s, -m), and drawn one day or N 
+#                 flights at a time (-w) so memory does not grow with the 
+#                 length of a campaign.
+#
+#                 --profile does the regrid and the plots in this process
+#                 under cProfile and tracemalloc, and saves the reports as
+#                 quicklooks_regrid_<prefix> and quicklooks_render_<prefix>
+#                 (.prof and _profile.txt) next to the plots.
 #
 #  USAGE        : python3 quicklooks.py -f file_prefix -p /path/to/RAW/
+#                 python3 quicklooks.py -f file_prefix -p /path/to/RAW/ -d float32 -s 1.02 -m 25 -w day
 #
 #  DEPENDENCIES : netCDF4, metpy
 
@@ -19,191 +37,443 @@ import argparse
 import netCDF4 as nc
 import pandas as pd
 import xarray as xr
-import matplotlib.pyplot as plt
+import matplotlib
 import matplotlib.dates as mdates
+from matplotlib.figure import Figure
 import numpy as np
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from PSL_UASDC_metrics import profiled
 
 
 # OPTIONS
 wind_barbs_dz = 10 # vertical spacing (in meters) between plotted wind barbs
 paths_dz = 10 # vertical spacing (in meters) between plotted dots for path of the drone
 
+# The figures. Each panel is a filled contour plot of one curtain with the 
+# drone path on top, written to <name>_<prefix>.png, and again with wind 
+# barbs added to <wind_name>_<prefix>.png if wind_name is given. levels is
+# (lowest, highest, step, tick step); None takes the lowest/highest from 
+# the data.
+panels = [
+    {'field':'rh',   'name':'rh',    'title':'Relative Humidity',     'label':'RH [%]',          'cmap':'YlGnBu', 'levels':(0, 100, 2, 10),
+     'wind_name':None,         'wind_title':None},
+    {'field':'temp', 'name':'temp',  'title':'Air Temperature',       'label':'Temperature [K]', 'cmap':'YlOrRd', 'levels':(None, None, 0.25, 1),
+     'wind_name':'temp_wind',  'wind_title':'Air Temperature & Winds'},
+    {'field':'wspd', 'name':'wspd',  'title':'Wind Velocity',         'label':'Wind Velocity [m/s]', 'cmap':'YlOrRd', 'levels':(0, None, 0.5, 1),
+     'wind_name':None,         'wind_title':None},
+    {'field':'thet', 'name':'theta', 'title':'Potential Temperature', 'label':r'$\Theta$ [K]',   'cmap':'YlOrRd', 'levels':(None, None, 0.25, 1),
+     'wind_name':'theta_wind', 'wind_title':'Potential Temperature'},
+]
 
-# parse arguments
-parser = argparse.ArgumentParser()
-parser.add_argument('-p', '--filepath', metavar='str', help='Path to file')
-parser.add_argument('-f', '--filename', metavar='str', help='Filename')
-args = parser.parse_args()
+# the only variables the plots need
+plot_vars = ['altitude', 'wind_u', 'wind_v', 'wind_w', 'temp', 'rel_hum', 'air_press', 'potential_temp']
 
-if args.filepath:   path = args.filepath
-if args.filename:   fname = args.filename
 
+# Read the variables the plots need from one file into compact arrays and
+# close the file again: float32 for the data, float64 nanoseconds for time.
+def load_flight(fullfile):
 
-# Load files 
-print('    Loading files.')
-print('')
+    with xr.open_dataset(fullfile) as f:
+        flight = {var: f[var].values.astype(np.float32) for var in plot_vars}
+        flight['time'] = f.time.values.astype('datetime64[ns]').astype('float64')
 
-file_list = sorted(os.listdir(path))
-netcdf_files = [f for f in file_list if f.startswith(fname) and f.endswith('.nc')]
+    return flight
 
-datasets = [xr.open_dataset(path+f) for f in netcdf_files]
 
+# Split a flight into its ascent (up to the highest point) and descent.
+# Returns a list of slices, one per leg asked for ('ascent', 'descent' or 
+# 'both'). A leg with fewer than two samples is left out.
+def split_legs(alt, legs='both'):
 
-# Regrid
-print('    Regridding data.')
-print('')
-# Figure out the maximum height above surface
-maxHt = []
-times = []
-for f in datasets: 
-    maxHt.append(np.array(f.altitude.max())-np.array(f.altitude[0]))
-    times.append(f.time[0].values)
-maxHt = np.ceil(maxHt)
-
-# Make a common height grid with 1 m resolution
-# Note that the meteodrone data is reported closer to 3-4 m
-hts = np.arange(int(max(maxHt))+1)
-hts2d = np.transpose(np.tile(hts,(len(times),1)))
-
-# Define some flight_n x ht arrays
-wind_v = np.full((len(hts),len(datasets)), np.nan) 
-wind_u = np.full((len(hts),len(datasets)), np.nan) 
-wind_w = np.full((len(hts),len(datasets)), np.nan) 
-temp = np.full((len(hts),len(datasets)), np.nan)
-rh = np.full((len(hts),len(datasets)), np.nan)
-pr = np.full((len(hts),len(datasets)), np.nan)
-thet = np.full((len(hts),len(datasets)), np.nan)
-times2d = np.full((len(hts),len(datasets)), np.nan)
-
-# Now loop back through the datasets and interpolate onto the regular grid
-counter = 0 
-for f in datasets: 
-    alts = np.array(f.altitude)-np.array(f.altitude[0])
-    wind_u[:,counter] = np.interp(hts,alts,f.wind_u) 
-    wind_v[:,counter] = np.interp(hts,alts,f.wind_v) 
-    wind_w[:,counter] = np.interp(hts,alts,f.wind_w) 
-    temp[:,counter] = np.interp(hts,alts,f.temp)
-    rh[:,counter] = np.interp(hts,alts,f.rel_hum) 
-    pr[:,counter] = np.interp(hts,alts,f.air_press) 
-    thet[:,counter] = np.interp(hts,alts,f.potential_temp)
-    times2d[:,counter] = np.interp(hts,alts,f.time.astype('datetime64[ns]').astype('float64'))
-    counter = counter + 1
-    
-times2d=times2d.astype('datetime64[ns]')
-
-wspd = np.sqrt(wind_u**2+wind_v**2+wind_w**2)
-wdir = np.mod(180/np.pi * np.arctan2(-wind_u,-wind_v),360)
-
-
-# Make some plots
-print('    Making plots.')
-print('')
-# Define the figure object and primary axes
-plt.rc('font', size=14) 
-
-# Plot RH using contourf
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, rh,levels=np.arange(0, 101, 2), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, rh,levels=np.arange(0, 101, 2), cmap='YlGnBu')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(0,101,10))
-cbar.ax.set_ylabel('RH [%]')
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Relative Humidity')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'rh_'+fname+'.png')
-fig.clear()
-
-
-# Plot temp using contourf
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, temp,levels=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp)), 0.25), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, temp,levels=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp)), 0.25), cmap='YlOrRd')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp))+1, 1))
-cbar.ax.set_ylabel('Temperature [K]')
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Air Temperature')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'temp_'+fname+'.png')
-fig.clear()
-
-
-# Plot wind speed using contourf
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, wspd,levels=np.arange(0,np.ceil(np.max(wspd))+1, 0.5), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, wspd,levels=np.arange(0,np.ceil(np.max(wspd))+1, 0.5), cmap='YlOrRd')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(0,15, 1))
-cbar.ax.set_ylabel('Wind Velocity [m/s]')
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Wind Velocity')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'wspd_'+fname+'.png')
-fig.clear()
-
-
-# Plot Theta using contourf
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, thet,levels=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet)), 0.25), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, thet,levels=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet)), 0.25), cmap='YlOrRd')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet))+1, 1))
-cbar.ax.set_ylabel('$\Theta$ [K]')
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Potential Temperature')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'theta_'+fname+'.png')
-fig.clear()
-
-# Plot temp with wind barbs
-fig.clear()
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, temp,levels=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp)), 0.25), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, temp,levels=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp)), 0.25), cmap='YlOrRd')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(np.floor(np.min(temp)),np.ceil(np.max(temp))+1, 1))
-cbar.ax.set_ylabel('Temperature [K]')
-wind_slc_vert = np.arange(1,int(max(maxHt))+1,wind_barbs_dz)
-ax.barbs(times2d[wind_slc_vert,:], hts2d[wind_slc_vert,:], wind_u[wind_slc_vert, :], wind_v[wind_slc_vert, :], color='k', barb_increments=dict(half=1, full=5, flag=10),clip_on=False)
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Air Temperature & Winds')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'temp_wind_'+fname+'.png')
-fig.clear()
-
-
-# Plot theta with wind barbs
-fig.clear()
-fig = plt.figure(1, figsize=(16., 9.))
-ax = plt.axes()
-contour1 = ax.contour(times2d, hts2d, thet,levels=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet)), 0.25), colors='k', linewidths=0.2)
-contour2 = ax.contourf(times2d, hts2d, thet,levels=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet)), 0.25), cmap='YlOrRd')
-ax.scatter(times2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), hts2d[1::paths_dz,:].reshape((len(times)*len(hts[1::paths_dz]),1)), color='black', s=1, marker='.')
-cbar = rh_colorbar = fig.colorbar(contour2,ticks=np.arange(np.floor(np.min(thet)),np.ceil(np.max(thet))+1, 1))
-cbar.ax.set_ylabel('$\Theta$ [K]')
-wind_slc_vert = np.arange(1,int(max(maxHt))+1,wind_barbs_dz)
-ax.barbs(times2d[wind_slc_vert,:], hts2d[wind_slc_vert,:], wind_u[wind_slc_vert, :], wind_v[wind_slc_vert, :], color='k', barb_increments=dict(half=1, full=5, flag=10),clip_on=False)
-myFmt = mdates.DateFormatter('%b%d %H:%M')
-ax.xaxis.set_major_formatter(myFmt)
-ax.tick_params(axis='x', labelrotation=30)
-ax.set_title('Potential Temperature')
-ax.set_ylabel('Height AGL [m]')
-fig.savefig(path+'theta_wind_'+fname+'.png')
-fig.clear()
+    top = int(np.argmax(alt))
+    slices = []
+    if legs in ['ascent', 'both']:
+        slices.append(slice(0, top+1))
+    if legs in ['descent', 'both']:
+        slices.append(slice(top, len(alt)))
+
+    return [s for s in slices if s.stop-s.start > 1]
+
+
+# Fill the NaNs between valid values of each column of a (height x column)
+# array by linear interpolation along height, all columns at once. With 
+# extend, NaNs below/above the valid range take the first/last valid value.
+def fill_gaps(a, extend=False):
+
+    nh, ncol = a.shape
+    idx = np.broadcast_to(np.arange(nh)[:,None], a.shape)
+    valid = ~np.isnan(a)
+    cols = np.arange(ncol)[None,:]
+
+    # index of the closest valid value below and above each point
+    below = np.maximum.accumulate(np.where(valid, idx, -1), axis=0)
+    above = np.minimum.accumulate(np.where(valid, idx, nh)[::-1], axis=0)[::-1]
+
+    inside = ~valid & (below >= 0) & (above < nh)
+    lo = a[np.clip(below, 0, nh-1), cols]
+    hi = a[np.clip(above, 0, nh-1), cols]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = (idx-below)/(above-below)
+    a = np.where(inside, lo+w*(hi-lo), a)
+
+    if extend:
+        a = np.where(~valid & (below < 0) & (above < nh), hi, a)
+        a = np.where(~valid & (below >= 0) & (above >= nh), lo, a)
+
+    return a
+
+
+# Bin all flights onto the height grid hts in one pass. Each flight is split
+# into legs (see split_legs) and every leg becomes one column. Samples are
+# assigned to the nearest height and averaged with bincount over all
+# columns at once; gaps between samples are then filled by linear
+# interpolation. Returns a dict of variable : (height x column) array, the
+# number of samples in each bin, the start time of each column and the index
+# in flights of each column.
+def regrid_flights(flights, hts, legs='both'):
+
+    # bin edges halfway between grid heights
+    edges = np.concatenate([[hts[0]-(hts[1]-hts[0])/2], (hts[1:]+hts[:-1])/2, [hts[-1]+(hts[-1]-hts[-2])/2]]) if len(hts) > 1 else np.array([hts[0]-0.5, hts[0]+0.5])
+    nh = len(hts)
+
+    # one padded batch: the samples of every leg, with their column number
+    col, hbin, times, col_flight = [], [], [], []
+    data = {var: [] for var in plot_vars[1:]+['time']}
+    for n, f in enumerate(flights):
+        h = f['altitude']-f['altitude'][0]
+        for leg in split_legs(f['altitude'], legs):
+            col.append(np.full(leg.stop-leg.start, len(times)))
+            hbin.append(np.searchsorted(edges, h[leg])-1)
+            times.append(f['time'][leg.start])
+            col_flight.append(n)
+            for var in data:
+                data[var].append(f[var][leg])
+    ncol = len(times)
+
+    col = np.concatenate(col)
+    hbin = np.concatenate(hbin)
+    inside = (hbin >= 0) & (hbin < nh)
+    flat = col*nh+hbin
+
+    count = np.bincount(flat[inside], minlength=ncol*nh).reshape(ncol, nh).T
+
+    grid = dict()
+    for var, values in data.items():
+        values = np.concatenate(values).astype(np.float64)
+        ok = inside & ~np.isnan(values)
+        n = np.bincount(flat[ok], minlength=ncol*nh)
+        total = np.bincount(flat[ok], weights=values[ok], minlength=ncol*nh)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (total/n).reshape(ncol, nh).T
+        grid[var] = fill_gaps(mean, extend=(var == 'time'))
+
+    return grid, count, times, col_flight
+
+
+# Height grid from the surface to at least top: dz apart at the surface, 
+# each step stretch times the one below, up to dz_max. The grid for a higher
+# top starts with the grid for a lower one, so cached columns stay valid as
+# taller flights come in.
+def height_grid(top, dz=1., stretch=1., dz_max=None):
+
+    hts = [0.]
+    step = dz
+    while hts[-1] < top:
+        hts.append(hts[-1]+step)
+        step = step*stretch if dz_max is None else min(step*stretch, dz_max)
+
+    return np.array(hts)
+
+
+# the first row of hts at or above every dz meters, e.g. for barbs and dots
+def rows_every(hts, dz):
+
+    return np.unique(np.searchsorted(hts, np.arange(1, hts[-1]+1, dz)))
+
+
+# The curtain cache keeps the regridded columns of every file already seen,
+# with the name, modification time and size of the file each column came 
+# from, in a compressed netCDF next to the files. Columns are only ever 
+# written up to the height of their own grid, the rest is left as fill.
+def create_cache(cachefile):
+
+    with nc.Dataset(cachefile, 'w') as f:
+        f.createDimension('height', None)
+        f.createDimension('column', None)
+        f.createVariable('height', 'f8', ('height',))
+        f['height'][:1] = [0.]
+        for var in plot_vars[1:]:
+            f.createVariable(var, 'f4', ('height', 'column'), zlib=True, chunksizes=(512, 8), fill_value=np.nan)
+        f.createVariable('time', 'f8', ('height', 'column'), zlib=True, chunksizes=(512, 8), fill_value=np.nan)
+        f.createVariable('count', 'i4', ('height', 'column'), zlib=True, chunksizes=(512, 8), fill_value=0)
+        f.createVariable('source', str, ('column',))
+        f.createVariable('source_mtime', 'f8', ('column',))
+        f.createVariable('source_size', 'i8', ('column',))
+
+
+# The height grid of the cache, the (name, mtime, size) of the file of each
+# column and the start time of each column, without reading the curtains.
+# None if there is no cache.
+def cache_index(cachefile):
+
+    if not os.path.exists(cachefile):
+        return None
+
+    with nc.Dataset(cachefile) as f:
+        f.set_auto_mask(False)
+        hts = f['height'][:]
+        sources = list(zip(f['source'][:], f['source_mtime'][:], f['source_size'][:]))
+        t0 = f['time'][0,:] if sources else np.zeros(0)
+
+    return hts, sources, t0
+
+
+# Read the columns listed (in increasing order) from the cache, cut at the 
+# highest bin with samples in any of them. Returns (hts, grid, count, 
+# sources) with the curtains as dtype and time as float64 nanoseconds.
+def read_cache(cachefile, columns, dtype=np.float64):
+
+    with nc.Dataset(cachefile) as f:
+        f.set_auto_mask(False)
+        count = f['count'][:, columns]
+        nh = np.nonzero(count.any(axis=1))[0][-1]+1 if count.any() else 1
+        count = count[:nh]
+        hts = f['height'][:nh]
+        grid = {var: f[var][:nh, columns].astype(dtype, copy=False) for var in plot_vars[1:]}
+        grid['time'] = fill_gaps(f['time'][:nh, columns], extend=True)
+        sources = [(f['source'][n], f['source_mtime'][n], f['source_size'][n]) for n in columns]
+
+    return hts, grid, count, sources
+
+
+# Write columns to the cache after the first start columns, growing its 
+# height axis to len(hts) if needed.
+def save_cache(cachefile, hts, grid, count, sources, start):
+
+    ncol = len(sources)
+    with nc.Dataset(cachefile, 'a') as f:
+        if len(hts) > len(f.dimensions['height']):
+            f['height'][:len(hts)] = hts
+        for var in grid:
+            f[var][:grid[var].shape[0], start:start+ncol] = grid[var]
+        f['count'][:count.shape[0], start:start+ncol] = count
+        for n, (name, mtime, size) in enumerate(sources):
+            f['source'][start+n] = name
+            f['source_mtime'][start+n] = mtime
+            f['source_size'][start+n] = size
+
+
+# Start the cache again with only the columns listed in keep, copied over 
+# block columns at a time.
+def rewrite_cache(cachefile, keep, block=256):
+
+    create_cache(cachefile+'.tmp')
+    for start in range(0, len(keep), block):
+        hts, grid, count, sources = read_cache(cachefile, keep[start:start+block])
+        save_cache(cachefile+'.tmp', hts, grid, count, sources, start)
+    os.replace(cachefile+'.tmp', cachefile)
+
+
+# Group the columns (in time order, with the file each came from) into the
+# windows that are drawn as separate figures: window None is one figure,
+# 'day' one per UTC day and an integer N one per N flights. Returns a list 
+# of (tag for the file names, column positions).
+def split_windows(t0, names, window=None):
+
+    if window is None:
+        return [('', np.arange(len(t0)))]
+
+    t0 = t0.astype('datetime64[ns]')
+    if window == 'day':
+        groups = t0.astype('datetime64[D]').astype(np.int64)
+        fmt = '%Y%m%d'
+    else:
+        first = dict()
+        groups = np.array([first.setdefault(n, len(first)) for n in names])//int(window)
+        fmt = '%Y%m%d%H%M'
+
+    windows = []
+    for g in np.unique(groups):
+        cols = np.nonzero(groups == g)[0]
+        windows.append((pd.Timestamp(t0[cols[0]]).strftime(fmt), cols))
+
+    return windows
+
+
+# contour levels and colorbar ticks for a curtain, see panels. (None, None)
+# if the field has no values at all (nothing to draw).
+def panel_levels(field, spec):
+
+    if not np.isfinite(field).any():
+        return None, None
+
+    lo, hi, step, tick = spec
+    lo = np.floor(np.nanmin(field)) if lo is None else lo
+    hi = np.ceil(np.nanmax(field)) if hi is None else hi
+
+    return np.arange(lo, hi+step/2, step), np.arange(lo, hi+tick/2, tick)
+
+
+# Draw one panel (see panels) and save it, then add the wind barbs and save
+# it again if the panel has a wind version, so the contours are only
+# computed once. Runs in a worker process without pyplot, i.e. on the Agg
+# canvas. Returns the files written.
+def render_panel(panel, times2d, hts, field, levels, ticks, drone_path, barbs, path, fname):
+
+    matplotlib.rcParams['font.size'] = 14
+    hts2d = np.broadcast_to(hts[:,None], times2d.shape)
+
+    fig = Figure(figsize=(16., 9.))
+    ax = fig.add_subplot()
+    ax.contour(times2d, hts2d, field, levels=levels, colors='k', linewidths=0.2)
+    contour2 = ax.contourf(times2d, hts2d, field, levels=levels, cmap=panel['cmap'])
+    ax.scatter(drone_path[0], drone_path[1], color='black', s=1, marker='.')
+    cbar = fig.colorbar(contour2, ticks=ticks)
+    cbar.ax.set_ylabel(panel['label'])
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%b%d %H:%M'))
+    ax.tick_params(axis='x', labelrotation=30)
+    ax.set_title(panel['title'])
+    ax.set_ylabel('Height AGL [m]')
+    files = [path+panel['name']+'_'+fname+'.png']
+    fig.savefig(files[-1])
+
+    if panel['wind_name']:
+        ax.barbs(*barbs, color='k', barb_increments=dict(half=1, full=5, flag=10), clip_on=False)
+        ax.set_title(panel['wind_title'])
+        files.append(path+panel['wind_name']+'_'+fname+'.png')
+        fig.savefig(files[-1])
+
+    return files
+
+
+if __name__ == '__main__':
+
+    # parse arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--filepath', metavar='str', help='Path to file')
+    parser.add_argument('-f', '--filename', metavar='str', help='Filename')
+    parser.add_argument('-l', '--legs', metavar='str', default='both', choices=['ascent', 'descent', 'both'], help='Flight legs to plot: ascent, descent or both')
+    parser.add_argument('-r', '--rebuild', action='store_true', help='Ignore the curtain cache and regrid every file')
+    parser.add_argument('-n', '--nworkers', metavar='int', type=int, default=4, help='Files read at once')
+    parser.add_argument('-b', '--batch', metavar='int', type=int, default=50, help='Files regridded at once')
+    parser.add_argument('-z', '--dz', metavar='m', type=float, default=1., help='Height grid spacing at the surface')
+    parser.add_argument('-s', '--stretch', metavar='float', type=float, default=1., help='Factor by which the grid spacing grows per level')
+    parser.add_argument('-m', '--dz_max', metavar='m', type=float, default=None, help='Largest grid spacing when stretched')
+    parser.add_argument('-w', '--window', metavar='str', default=None, help='One figure per "day" or per N flights instead of one for all')
+    parser.add_argument('-d', '--dtype', metavar='str', default='float64', choices=['float32', 'float64'], help='Precision of the curtains in memory')
+    parser.add_argument('--profile', action='store_true', help='Profile the regrid and the plots (in this process) and save the reports next to the plots')
+    args = parser.parse_args()
+
+    if args.filepath:   path = args.filepath
+    if args.filename:   fname = args.filename
+    grid_args = (args.dz, args.stretch, args.dz_max)
+
+    # the work stays in this process when profiled, where the profiler sees it
+    profile = lambda step: profiled(path+'quicklooks_'+step+'_'+fname) if args.profile else nullcontext()
+
+
+    # Load files 
+    print('    Loading files.')
+    print('')
+
+    file_list = sorted(os.listdir(path))
+    netcdf_files = [f for f in file_list if f.startswith(fname) and f.endswith('.nc') and not f.startswith('.quicklooks_')]
+    stats = {f: (os.path.getmtime(path+f), os.path.getsize(path+f)) for f in netcdf_files}
+
+    # columns of files we have already regridded, unless the file changed
+    # or the cache was made on another height grid
+    cachefile = path+'.quicklooks_'+fname+'_'+args.legs+'.nc'
+    index = None if args.rebuild else cache_index(cachefile)
+    if index is not None and not np.array_equal(index[0], height_grid(index[0][-1], *grid_args)):
+        print('    Height grid changed, regridding every file.')
+        index = None
+    cached_hts, cached_sources = (index[0], index[1]) if index is not None else (np.zeros(1), [])
+    keep = [n for n, (name, mtime, size) in enumerate(cached_sources) if stats.get(name) == (mtime, size)]
+    cached_files = set(cached_sources[n][0] for n in keep)
+    new_files = [f for f in netcdf_files if f not in cached_files]
+
+    print('    '+str(len(cached_files))+' files from cache, '+str(len(new_files))+' to load.')
+    print('')
+
+    if index is None:
+        create_cache(cachefile)
+    elif len(keep) < len(cached_sources):
+        rewrite_cache(cachefile, keep)
+
+
+    # Regrid
+    print('    Regridding data.')
+    print('')
+    # A batch of files at a time, each onto a grid up to the highest flight
+    # so far (the meteodrone data is reported closer to 3-4 m apart), and
+    # appended to the cache, so only one batch is ever held in memory.
+    ncol = len(keep)
+    top = cached_hts[-1]
+    with ProcessPoolExecutor(max_workers=args.nworkers) as executor, profile('regrid'):
+        mapper = map if args.profile else executor.map
+        for start in range(0, len(new_files), args.batch):
+            batch = new_files[start:start+args.batch]
+            # only one file is open per worker at any time
+            flights = list(mapper(load_flight, [path+f for f in batch]))
+            for f in flights: 
+                top = max(top, np.ceil(np.max(f['altitude'])-f['altitude'][0]))
+            hts = height_grid(top, *grid_args)
+
+            # ht x column arrays, one column per flight leg
+            grid, count, times, col_flight = regrid_flights(flights, hts, args.legs)
+            sources = [(batch[n],)+stats[batch[n]] for n in col_flight]
+            save_cache(cachefile, hts, grid, count, sources, ncol)
+            ncol = ncol+len(sources)
+            del flights, grid, count
+
+
+    # Make some plots
+    print('    Making plots.')
+    print('')
+
+    # one window of columns, in time order, in memory at a time
+    hts, sources, t0 = cache_index(cachefile)
+    order = np.argsort(t0)
+    windows = split_windows(t0[order], [sources[n][0] for n in order], args.window) if sources else []
+
+    with ProcessPoolExecutor(max_workers=args.nworkers) as executor, profile('render'):
+        mapper = map if args.profile else executor.map
+        for tag, cols in windows:
+            columns = np.sort(order[cols])
+            hts, grid, count, _ = read_cache(cachefile, columns, np.dtype(args.dtype))
+            inorder = np.argsort(grid['time'][0])
+            grid = {var: grid[var][:, inorder] for var in grid}
+            count = count[:, inorder]
+
+            wind_u = grid['wind_u']
+            wind_v = grid['wind_v']
+            wind_w = grid['wind_w']
+            times2d = grid['time'].astype('datetime64[ns]')
+
+            wspd = np.sqrt(wind_u**2+wind_v**2+wind_w**2)
+
+            curtains = {'rh': grid['rel_hum'], 'temp': grid['temp'], 'thet': grid['potential_temp'], 'wspd': wspd}
+
+            # the drone path and the wind barbs are the same in every figure
+            path_rows = rows_every(hts, paths_dz)
+            path_t = np.where(count[path_rows,:] > 0, grid['time'][path_rows,:], np.nan).astype('datetime64[ns]').ravel()
+            path_h = np.repeat(hts[path_rows], count.shape[1])
+            wind_slc_vert = rows_every(hts, wind_barbs_dz)
+            barbs = (times2d[wind_slc_vert,:], np.broadcast_to(hts[wind_slc_vert,None], (len(wind_slc_vert), count.shape[1])), wind_u[wind_slc_vert, :], wind_v[wind_slc_vert, :])
+
+            # one job per panel, each with its levels worked out once
+            jobs = []
+            for panel in panels:
+                field = curtains[panel['field']]
+                levels, ticks = panel_levels(field, panel['levels'])
+                if levels is None:
+                    print('    No '+panel['field']+' data'+(' for '+tag if tag else '')+', skipping that panel.')
+                    continue
+                jobs.append((panel, times2d, hts, field, levels, ticks, (path_t, path_h), barbs, path, fname+('_'+tag if tag else '')))
+
+            for files in mapper(render_panel, *zip(*jobs)) if jobs else []:
+                for f in files: print('    Wrote '+f)
+            del grid, count, curtains, jobs
+    print('')
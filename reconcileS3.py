@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : reconcileS3.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Matches every netCDF in the UASDC entry bucket to the BUFR
+#                 the Synoptic pipeline should have put in the product bucket
+#                 (same key layout as upload_file/download_bufr) and reports
+#                 (a) how long the conversion took, as percentiles per
+#                 operator and airframe, and (b) the uploads that never
+#                 produced a BUFR. Uses the bucket index of openS3.py, which
+#                 is refreshed first unless -c is given.
+#
+#  USAGE        : Note that you cannot access AWS S3 while using PSL VPN.
+#                   python3 reconcileS3.py -i 007
+#                   python3 reconcileS3.py -i 007 -a AstonMartinDB5 -s 20240501 -e 20240531
+#                 Uploads younger than -g minutes without a BUFR are counted
+#                 as pending rather than orphans.
+#
+#  DEPENDENCIES : Boto3 Python module supported for Python 3.8+, numpy
+
+import argparse, time
+import numpy as np
+from PSL_UASDC_uploadfiles import get_s3
+from PSL_UASDC_s3index import default_index, open_index, refresh_index
+
+
+# Join the entry and product listings of the index. Returns a dict of
+# (operator, airframe) : list of latencies in seconds, the list of orphan
+# entry keys, the list of pending entry keys (younger than grace seconds) and
+# the number of netCDFs re-uploaded after their BUFR was made.
+def reconcile(conn, entry_bucket, product_bucket, operator=None, airframe=None, start=None, end=None, grace=1800.):
+
+    sql = "SELECT key, last_modified, operator, airframe, product_key FROM objects WHERE bucket=? AND product_key!=''"
+    args = [entry_bucket]
+    for column, value in [('operator', operator), ('airframe', airframe)]:
+        if value:
+            sql = sql+' AND '+column+'=?'
+            args.append(value)
+    if start:
+        sql = sql+' AND flighttime>=?'
+        args.append(start.ljust(14, '0'))
+    if end:
+        sql = sql+' AND flighttime<=?'
+        args.append(end.ljust(14, '9'))
+    entries = conn.execute(sql, args).fetchall()
+
+    # the product listing as a key : last modified lookup
+    products = dict(conn.execute('SELECT key, last_modified FROM objects WHERE bucket=?', (product_bucket,)).fetchall())
+
+    now = time.time()
+    latencies, orphans, pending, reuploads = dict(), [], [], 0
+    for key, entry_time, op, af, product_key in entries:
+        product_time = products.get(product_key)
+        if product_time is None:
+            if now-entry_time < grace:
+                pending.append(key)
+            else:
+                orphans.append(key)
+        elif product_time < entry_time:
+            reuploads = reuploads+1
+        else:
+            latencies.setdefault((op, af), []).append(product_time-entry_time)
+
+    return latencies, sorted(orphans), sorted(pending), reuploads
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--id', metavar='str', help='Operator ID')
+    parser.add_argument('-a', '--airframeID', metavar='str', help='Only this airframe')
+    parser.add_argument('-s', '--start', metavar='yyyymmdd', help='Only flights on or after this date')
+    parser.add_argument('-e', '--end', metavar='yyyymmdd', help='Only flights on or before this date')
+    parser.add_argument('-g', '--grace', metavar='min', type=float, default=30., help='Uploads younger than this without BUFR are pending, not orphans')
+    parser.add_argument('-c', '--cached', action='store_true', help='Do not refresh the index from S3 first')
+    parser.add_argument('--index', metavar='str', default=default_index, help='Index file')
+    args = parser.parse_args()
+
+    print('')
+    s3, entry_bucket, product_bucket = get_s3()
+    print('')
+
+    conn = open_index(args.index)
+    if not args.cached:
+        for bucket in [entry_bucket, product_bucket]:
+            refresh_index(conn, bucket, args.id+'/' if args.id else '')
+        print('')
+
+    latencies, orphans, pending, reuploads = reconcile(conn, entry_bucket, product_bucket, args.id, args.airframeID, args.start, args.end, 60*args.grace)
+    conn.close()
+
+    print('    netCDF to BUFR latency [s]:')
+    print('')
+    print('    %-10s %-20s %7s %9s %9s %9s %9s %9s' % ('operator', 'airframe', 'n', 'p10', 'p50', 'p90', 'p99', 'max'))
+    for (op, af), lat in sorted(latencies.items()):
+        p = np.percentile(lat, [10, 50, 90, 99])
+        print('    %-10s %-20s %7d %9.1f %9.1f %9.1f %9.1f %9.1f' % ((op, af, len(lat))+tuple(p)+(max(lat),)))
+    print('')
+
+    print('    netCDFs without BUFR ('+str(len(orphans))+'):')
+    print('')
+    for key in orphans: print(key)
+    print('')
+    print('    '+str(len(pending))+' uploads still pending, '+str(reuploads)+' re-uploaded after their BUFR was made.')
+    print('')
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : submit_UASDC.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Thin client of the warm daemon (process_UASDC.py --daemon).
+#                 Takes the same arguments as process_UASDC.py for one file,
+#                 hands the file to the daemon, which starts on it right
+#                 away in a worker that already has netCDF4, boto3 and its
+#                 S3/GSL connections, and prints the result. Imports nothing
+#                 outside the standard library, so it starts in milliseconds.
+#                 The daemon cannot prompt, so the y/n answers come from the
+#                 -y policy (default new, see process_UASDC.py).
+#
+#  USAGE        : python3 process_UASDC.py --daemon -n 2       (once, e.g. at boot)
+#
+#                 python3 submit_UASDC.py -o 007 -a AstonMartinDB5 -t 19641222000000 -d /Users/Connery/London/ -f goldfinger.nc
+#
+#                 Quicklooks are made by the daemon too, with the arguments
+#                 of quicklooks.py after the word quicklooks:
+#
+#                 python3 submit_UASDC.py quicklooks -f 2024 -p /Users/Connery/London/RAW/
+#
+#                 --ping checks that the daemon is up, --stop stops it.
+#
+#  DEPENDENCIES : none
+
+import argparse, os, sys, time
+from PSL_UASDC_daemon import submit, default_socket, default_spool, has_unix_sockets
+
+if __name__ == '__main__':
+
+    # the quicklooks.py arguments after the word quicklooks are passed on as they are
+    quicklooks = 'quicklooks' in sys.argv[1:]
+    argv, rest = (sys.argv[1:sys.argv.index('quicklooks')], sys.argv[sys.argv.index('quicklooks')+1:]) if quicklooks else (sys.argv[1:], [])
+
+    parser = argparse.ArgumentParser()
+    if not quicklooks:
+        parser.add_argument('-o', '--operatorID', metavar='str', help='Operator ID')
+        parser.add_argument('-a', '--airframeID', metavar='str', help='Airframe ID')
+        parser.add_argument('-t', '--flighttime', metavar='str', help='Flight time yyyymmddhhmmss')
+        parser.add_argument('-d', '--basedir', metavar='str', help='Parent directory of RAW and STAGE')
+        parser.add_argument('-f', '--filename', metavar='str', help='File to process')
+        parser.add_argument('-y', '--policy', metavar='str', default='new', help='Answers to the y/n prompts (see process_UASDC.py)')
+        parser.add_argument('-b', '--bufr_deadline', metavar='sec', type=float, default=120., help='How long to wait for the BUFR file in the product bucket')
+        parser.add_argument('--redo', action='store_true', help='Process again even if the ledger says it was done')
+        parser.add_argument('--profile', action='store_true', help='Save cProfile and tracemalloc reports of the check next to the STAGE file')
+        parser.add_argument('--metrics', metavar='str', help='Metrics file (default: base directory/UASDC_metrics.jsonl)')
+        parser.add_argument('--ping', action='store_true', help='Only check that the daemon is up')
+        parser.add_argument('--stop', action='store_true', help='Stop the daemon once the jobs it has are done')
+    parser.add_argument('--socket', metavar='str', default=None, help='Unix socket of the daemon (default: '+default_socket()+')')
+    parser.add_argument('--spool', metavar='str', default=None, help='Hand the job over through this spool directory instead of the socket')
+    parser.add_argument('--nowait', action='store_true', help='Return once the daemon has the job instead of waiting for the result')
+    args = parser.parse_args(argv)
+
+    if quicklooks:
+        job = {'cmd':'quicklooks', 'argv':rest, 'cwd':os.getcwd()}
+    elif args.ping:
+        job = {'cmd':'ping'}
+    elif args.stop:
+        job = {'cmd':'stop'}
+    else:
+        if not (args.operatorID and args.basedir and args.filename):
+            parser.error('-o, -d and -f are required')
+        # the daemon runs somewhere else
+        base_dir = os.path.join(os.path.abspath(args.basedir), '')
+        if not os.path.exists(base_dir+'RAW/'+args.filename):
+            print('')
+            print('    Exiting. '+base_dir+'RAW/'+args.filename+' not found.')
+            print('')
+            sys.exit(1)
+        job = {'cmd':'process', 'operatorID':args.operatorID, 'airframeID':args.airframeID, 'flighttime':args.flighttime,
+               'basedir':base_dir, 'filename':args.filename, 'policy':args.policy, 'bufr_deadline':args.bufr_deadline,
+               'redo':args.redo, 'profile':args.profile, 'metrics':os.path.abspath(args.metrics) if args.metrics else None}
+
+    if args.spool or not has_unix_sockets:
+        sock, spool = None, args.spool if args.spool else default_spool()
+    else:
+        sock, spool = args.socket if args.socket else default_socket(), None
+
+    start = time.time()
+    try:
+        reply = submit(job, sock, spool, wait=not (args.nowait or job['cmd'] == 'stop'))
+    except ConnectionError as e:
+        print('')
+        print('    Exiting. The daemon is not running ('+str(e)+'). Start it with: python3 process_UASDC.py --daemon')
+        print('')
+        sys.exit(1)
+
+    print('')
+    if 'error' in reply:
+        print('    '+reply['error'])
+        print('')
+        sys.exit(1)
+    if 'result' in reply:
+        print('    '+str(job.get('filename', job['cmd']))+': '+str(reply['result'])+' ('+'%.1f' % (time.time()-start)+' s)')
+    else:
+        print('    Handed to the daemon ('+'%.0f' % (1000*(time.time()-start))+' ms).')
+    print('')
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : conftest.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Fixtures shared by the tests: a base directory with RAW,
+#                 STAGE and BUFR, small RAW netCDF files, S3 mocked by moto
+#                 (the buckets of access_info.py are not touched) and a
+#                 local pyftpdlib server standing in for GSL.
+#
+#  USAGE        : python3 -m pytest tests
+#
+#  DEPENDENCIES : pytest, netCDF4, numpy, moto[s3] and pyftpdlib (the tests
+#                 that need them are skipped without them)
+
+import os, sys, threading
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+entry_bucket, product_bucket = 'test-entry', 'test-product'
+
+
+# a base directory (ending in /) with RAW, STAGE and BUFR
+@pytest.fixture
+def base_dir(tmp_path):
+
+    for d in ['RAW', 'STAGE', 'BUFR']:
+        os.makedirs(tmp_path/d)
+
+    return str(tmp_path)+'/'
+
+
+# Write a small Meteodrone-style RAW file: the names and units of the drone
+# (seconds since the flight, rel_hum as a fraction, temp in K), 1 Hz, up to
+# top m and back down.
+def make_raw(fullfile, n=120, start='2024-05-01T22:17:56', top=200.):
+
+    import netCDF4 as nc
+
+    alt = np.concatenate([np.linspace(0, top, n//2), np.linspace(top, 0, n-n//2)])+272.
+    temp = 293.15-0.0065*(alt-272.)+0.01*np.sin(np.arange(n))
+    with nc.Dataset(fullfile, 'w') as f:
+        f.createDimension('time', n)
+        for name, units, data in [('time', 'seconds since '+start+'Z', np.arange(n, dtype=float)),
+                                  ('latitude', 'degrees_north', 47.57+np.zeros(n)),
+                                  ('longitude', 'degrees_east', 9.04+np.zeros(n)),
+                                  ('altitude', 'm', alt),
+                                  ('temp', 'K', temp),
+                                  ('rel_hum', '1', 0.5+0.01*np.cos(np.arange(n))),
+                                  ('air_press', 'Pa', 101325*np.exp(-(alt-272.)/8000.))]:
+            var = f.createVariable(name, 'f8', ('time',))
+            var.units = units
+            var[:] = data
+        f.platform_name = 'meteodrone-12'
+        f.flight_id = 'TEST'
+
+
+# S3 mocked by moto, with the two buckets, as the shared client of
+# PSL_UASDC_uploadfiles (so get_s3 never reads access_info.py)
+@pytest.fixture
+def s3(monkeypatch):
+
+    moto = pytest.importorskip('moto')
+    import boto3
+    import PSL_UASDC_uploadfiles as uploadfiles
+
+    for var in ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY']:
+        monkeypatch.setenv(var, 'testing')
+    monkeypatch.delenv('AWS_ENDPOINT_URL', raising=False)
+
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.meta.events.register('before-send.s3', uploadfiles.start_pacing)
+        for bucket in [entry_bucket, product_bucket]:
+            client.create_bucket(Bucket=bucket)
+        monkeypatch.setattr(uploadfiles, '_s3', client)
+        monkeypatch.setattr(uploadfiles, '_buckets', (entry_bucket, product_bucket))
+        uploadfiles.set_transfer_config()
+        yield client
+        uploadfiles.set_transfer_config()
+
+
+# A pyftpdlib server on a free local port standing in for GSL, set up with
+# set_gsl. Yields the directory the files land in.
+@pytest.fixture
+def gsl(tmp_path):
+
+    pytest.importorskip('pyftpdlib')
+    import logging
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+    from PSL_UASDC_gsl import set_gsl, close_sessions
+
+    logging.getLogger('pyftpdlib').setLevel(logging.WARNING)
+    root = tmp_path/'ftp'
+    os.makedirs(root/'gsl')
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root), perm='elradfmwMT')
+    handler = type('Handler', (FTPHandler,), {'authorizer':authorizer})
+    server = ThreadedFTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'timeout':0.1}, daemon=True)
+    thread.start()
+
+    set_gsl('127.0.0.1', 'gsl', pool_size=1, timeout=10., port=server.address[1])
+    yield root/'gsl'
+    close_sessions()
+    server.close_all()
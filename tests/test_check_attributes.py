@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_check_attributes.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Writing STAGE files (PSL_UASDC_check_attributes.convert_file):
+#                 the file appears under its name only once it is complete.
+#
+#  USAGE        : python3 -m pytest tests/test_check_attributes.py
+#
+#  DEPENDENCIES : pytest, netCDF4, numpy
+
+import os
+import netCDF4 as nc
+import pytest
+import PSL_UASDC_convert
+from conftest import make_raw
+from PSL_UASDC_check_attributes import convert_file
+
+new_fname = 'UASDC_007_meteodrone-12_20240501221756Z.nc'
+
+
+def test_convert_file(base_dir):
+
+    make_raw(base_dir+'RAW/raw.nc')
+    convert_file(base_dir+'RAW/raw.nc', base_dir+'STAGE/', new_fname, 'meteodrone-12')
+
+    assert os.listdir(base_dir+'STAGE/') == [new_fname]
+    with nc.Dataset(base_dir+'STAGE/'+new_fname) as f:
+        assert 'air_temperature' in f.variables and len(f.variables['time']) == 120
+
+
+def test_failed_write_leaves_nothing(base_dir, monkeypatch):
+
+    make_raw(base_dir+'RAW/raw.nc')
+    def failing(block, scale, offset):
+        raise OSError('disk full')
+    monkeypatch.setattr(PSL_UASDC_convert, 'convert_block', failing)
+
+    with pytest.raises(OSError):
+        convert_file(base_dir+'RAW/raw.nc', base_dir+'STAGE/', new_fname, 'meteodrone-12')
+    assert os.listdir(base_dir+'STAGE/') == []
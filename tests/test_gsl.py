@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_gsl.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Delivery to GSL (PSL_UASDC_gsl.py) against a local
+#                 pyftpdlib server: a transfer that drops half way is resumed
+#                 with REST and the file on the server checked by size and
+#                 content, files already there are skipped, and pooled
+#                 sessions are reused (or replaced when they died).
+#
+#  USAGE        : python3 -m pytest tests/test_gsl.py
+#
+#  DEPENDENCIES : pytest, pyftpdlib
+
+import ftplib, io, os, socket
+import pytest
+import PSL_UASDC_gsl as gsl_mod
+from PSL_UASDC_gsl import send_file, send_files, _sessions
+
+
+@pytest.fixture
+def payload(tmp_path):
+
+    data = os.urandom(300*1024)
+    fullfile = tmp_path/'UASDC_007_meteodrone-12_20240501221756Z.bufr'
+    fullfile.write_bytes(data)
+
+    return str(fullfile), data
+
+
+# count the connections made to the server
+@pytest.fixture
+def connects(monkeypatch):
+
+    calls = []
+    connect = ftplib.FTP.connect
+    def counted(self, *args, **kwargs):
+        calls.append(args)
+        return connect(self, *args, **kwargs)
+    monkeypatch.setattr(ftplib.FTP, 'connect', counted)
+    monkeypatch.setattr(gsl_mod.time, 'sleep', lambda s: None)
+
+    return calls
+
+
+def test_resume_dropped_transfer(gsl, payload, connects, monkeypatch):
+
+    fullfile, data = payload
+    half = len(data)//2
+
+    # the first STOR gets half the file through, then the connection drops
+    rests = []
+    storbinary = ftplib.FTP.storbinary
+    def dropping(self, cmd, fp, blocksize=8192, callback=None, rest=None):
+        rests.append(rest)
+        if len(rests) == 1:
+            storbinary(self, cmd, io.BytesIO(fp.read(half)), blocksize, callback, rest)
+            raise ftplib.error_temp('426 Connection closed; transfer aborted.')
+        return storbinary(self, cmd, fp, blocksize, callback, rest)
+    monkeypatch.setattr(ftplib.FTP, 'storbinary', dropping)
+
+    assert send_file(fullfile)
+    # the retry asked where the server left it and sent only the rest
+    assert rests == [None, half]
+    remote = gsl/os.path.basename(fullfile)
+    assert os.path.getsize(remote) == len(data)
+    assert remote.read_bytes() == data
+    # the failed session was thrown away, not pooled
+    assert len(connects) == 2 and len(_sessions) == 1
+
+
+def test_skip_same_size(gsl, payload, connects, capsys):
+
+    fullfile, data = payload
+    (gsl/os.path.basename(fullfile)).write_bytes(b'x'*len(data))
+    assert send_file(fullfile, skip_same_size=True)
+    assert 'already on GSL' in capsys.readouterr().out
+    assert (gsl/os.path.basename(fullfile)).read_bytes() == b'x'*len(data)
+
+    # a different size is sent again, from the start
+    (gsl/os.path.basename(fullfile)).write_bytes(b'x'*10)
+    assert send_file(fullfile, skip_same_size=True)
+    assert (gsl/os.path.basename(fullfile)).read_bytes() == data
+
+
+def test_sessions_reused(gsl, payload, connects, tmp_path):
+
+    fullfile, data = payload
+    others = []
+    for k in range(3):
+        others.append(str(tmp_path/('file'+str(k)+'.nc')))
+        with open(others[-1], 'wb') as f:
+            f.write(data[k::3])
+
+    # one after the other over the session kept in the pool (checked by NOOP)
+    assert send_file(fullfile)
+    assert send_files(others+[str(tmp_path/'missing.nc')], nthreads=1) == {f: True for f in others}
+    assert len(connects) == 1
+    for k, f in enumerate(others):
+        assert (gsl/os.path.basename(f)).read_bytes() == data[k::3]
+
+    # a pooled session that died is replaced
+    _sessions[0].sock.shutdown(socket.SHUT_RDWR)
+    assert send_file(fullfile)
+    assert len(connects) == 2 and len(_sessions) == 1
+
+
+def test_no_wait_after_last_attempt(gsl, payload, monkeypatch):
+
+    fullfile, data = payload
+    sleeps = []
+    monkeypatch.setattr(gsl_mod.time, 'sleep', sleeps.append)
+    def down(self, *args, **kwargs):
+        raise ConnectionRefusedError('connection refused')
+    monkeypatch.setattr(ftplib.FTP, 'connect', down)
+
+    assert send_file(fullfile, retries=2) is False
+    assert sleeps == [1, 2]
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_ledger.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The ledger (PSL_UASDC_ledger.py) and the skip-on-rerun of
+#                 the STAGE step (PSL_UASDC_flight.stage_flight).
+#
+#  USAGE        : python3 -m pytest tests/test_ledger.py
+#
+#  DEPENDENCIES : pytest, netCDF4, numpy
+
+import os
+from conftest import make_raw
+from PSL_UASDC_ledger import file_hash, open_ledger, stage_done, mark_done, forget
+from PSL_UASDC_flight import stage_flight
+from PSL_UASDC_schema import get_schema
+
+stages = ['stage', 'upload', 'bufr', 'gsl', 'qc']
+new_fname = 'UASDC_007_meteodrone-12_20240501221756Z.nc'
+
+
+def test_mark_stage_forget(base_dir):
+
+    conn = open_ledger(base_dir)
+    key, other = ('abc', 'spec-1'), ('abc', 'spec-2')
+    assert stage_done(conn, key, 'upload') is None
+
+    mark_done(conn, key, 'upload', 'raw.nc', 'etag-1')
+    mark_done(conn, key, 'upload', 'raw.nc', 'etag-2')
+    mark_done(conn, key, 'bufr', 'raw.nc')
+    assert stage_done(conn, key, 'upload') == 'etag-2'
+    assert stage_done(conn, key, 'bufr') == ''
+    # done under one spec version is not done under another
+    assert stage_done(conn, other, 'upload') is None
+
+    forget(conn, key, ['upload'])
+    assert stage_done(conn, key, 'upload') is None
+    assert stage_done(conn, key, 'bufr') == ''
+    forget(conn, key)
+    assert stage_done(conn, key, 'bufr') is None
+    conn.close()
+
+    # and it is all on disk
+    conn = open_ledger(base_dir)
+    mark_done(conn, key, 'gsl', 'raw.nc', 'x.bufr')
+    conn.close()
+    assert stage_done(open_ledger(base_dir), key, 'gsl') == 'x.bufr'
+
+
+def test_stage_skipped_on_rerun(base_dir):
+
+    make_raw(base_dir+'RAW/raw.nc')
+    conn = open_ledger(base_dir)
+    key = (file_hash(base_dir+'RAW/raw.nc'), get_schema('meteodrone-12')['version'])
+    stagefile = base_dir+'STAGE/'+new_fname
+
+    done = stage_flight(base_dir, 'raw.nc', new_fname, 'meteodrone-12', conn, key, {s: None for s in stages}, False)
+    assert os.path.exists(stagefile)
+    assert done['stage'] is None and done['qc'] is not None
+    assert stage_done(conn, key, 'stage') == new_fname
+    assert stage_done(conn, key, 'stage_hash') == file_hash(stagefile)
+    mark_done(conn, key, 'upload', 'raw.nc', 'etag')
+
+    # the second time the STAGE file is the one we wrote: left alone
+    mtime = os.stat(stagefile).st_mtime_ns
+    done = {s: stage_done(conn, key, s) for s in stages}
+    assert stage_flight(base_dir, 'raw.nc', new_fname, 'meteodrone-12', conn, key, done, False) == done
+    assert os.stat(stagefile).st_mtime_ns == mtime
+    assert stage_done(conn, key, 'upload') == 'etag'
+
+    # a STAGE file changed since is not ours, and may only be replaced if allowed
+    with open(stagefile, 'ab') as f:
+        f.write(b'\0')
+    assert stage_flight(base_dir, 'raw.nc', new_fname, 'meteodrone-12', conn, key, done, False) is None
+    done = stage_flight(base_dir, 'raw.nc', new_fname, 'meteodrone-12', conn, key, done, lambda: True)
+    assert done['upload'] is None
+    assert stage_done(conn, key, 'stage_hash') == file_hash(stagefile)
+    # what was done with the old STAGE file no longer counts
+    assert stage_done(conn, key, 'upload') is None
+    conn.close()
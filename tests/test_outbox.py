@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_outbox.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The outbox (PSL_UASDC_outbox.py): entries are claimed by
+#                 one sender at a time and given back after a failure, a
+#                 spooled file stays in OUTBOX/ while any entry needs it,
+#                 and delivery to S3 (moto) records the upload and queues
+#                 the BUFR, which once fetched is queued for GSL.
+#
+#  USAGE        : python3 -m pytest tests/test_outbox.py
+#
+#  DEPENDENCIES : pytest, moto[s3], boto3
+
+import os, time
+from PSL_UASDC_outbox import open_outbox, enqueue, dequeue, pending, claim, release, deliver, outbox_dir
+from PSL_UASDC_ledger import stage_done
+from PSL_UASDC_uploadfiles import entry_key, bufr_key
+from conftest import entry_bucket, product_bucket
+
+
+# a flight as the pipeline passes it around, with its STAGE file
+def staged(base_dir, flighttime='20240501221756'):
+
+    new_fname = 'UASDC_007_meteodrone-12_'+flighttime+'Z.nc'
+    with open(base_dir+'STAGE/'+new_fname, 'wb') as f:
+        f.write(os.urandom(1024))
+
+    return {'fname':'raw_'+flighttime+'.nc', 'new_fname':new_fname, 'operatorID':'007',
+            'airframeID':'meteodrone-12', 'key':('hash'+flighttime, 'spec')}
+
+
+def test_claim_release(base_dir):
+
+    conn = open_outbox(base_dir)
+    flight = staged(base_dir)
+    name = flight['new_fname']
+    enqueue(conn, base_dir, base_dir+'STAGE/'+name, 's3', flight)
+
+    entry = claim(conn, name, 's3')
+    assert entry['name'] == name and entry['attempts'] == 0
+    # one sender at a time
+    assert claim(conn, name, 's3') is None
+    assert claim(conn, name, 'gsl') is None
+
+    release(conn, name, 's3', 'no link')
+    entry = claim(conn, name, 's3')
+    assert entry['attempts'] == 1 and entry['error'] == 'no link'
+
+    # not before it is due
+    release(conn, name, 's3', 'not yet', time.time()+60.)
+    assert claim(conn, name, 's3') is None
+    conn.close()
+
+
+def test_pending_newest_first(base_dir):
+
+    conn = open_outbox(base_dir)
+    for flighttime in ['20240501221756', '20240502120000', '20240430080000']:
+        flight = staged(base_dir, flighttime)
+        enqueue(conn, base_dir, base_dir+'STAGE/'+flight['new_fname'], 's3', flight)
+    enqueue(conn, base_dir, None, 'bufr', flight)
+
+    assert [e['flighttime'] for e in pending(conn, ['s3'])] == ['20240502120000', '20240501221756', '20240430080000']
+    assert [e['name'] for e in pending(conn, ['bufr'])] == [flight['new_fname']]
+    assert len(pending(conn)) == 4
+    conn.close()
+
+
+def test_dequeue_keeps_file_in_use(base_dir):
+
+    conn = open_outbox(base_dir)
+    flight = staged(base_dir)
+    name = flight['new_fname']
+    for dest in ['s3', 'gsl']:
+        enqueue(conn, base_dir, base_dir+'STAGE/'+name, dest, flight)
+    enqueue(conn, base_dir, None, 'bufr', flight)
+    assert os.listdir(base_dir+outbox_dir) == [name]
+    with open(base_dir+outbox_dir+name, 'rb') as f, open(base_dir+'STAGE/'+name, 'rb') as g:
+        assert f.read() == g.read()
+
+    # the file goes with the last entry that sends it, whatever bufr waits for
+    dequeue(conn, base_dir, name, 's3')
+    assert os.path.exists(base_dir+outbox_dir+name)
+    dequeue(conn, base_dir, name, 'gsl')
+    assert not os.path.exists(base_dir+outbox_dir+name)
+    assert [e['dest'] for e in pending(conn)] == ['bufr']
+    conn.close()
+
+
+def test_deliver_s3_then_bufr(s3, base_dir):
+
+    conn = open_outbox(base_dir)
+    flight = staged(base_dir)
+    name = flight['new_fname']
+    bufr_name = os.path.splitext(name)[0]+'.bufr'
+    for dest in ['s3', 'gsl']:
+        enqueue(conn, base_dir, base_dir+'STAGE/'+name, dest, flight)
+
+    # someone else is sending it
+    claim(conn, name, 's3')
+    assert deliver(base_dir, name, 's3') is None
+    release(conn, name, 's3')
+
+    assert deliver(base_dir, name, 's3') is True
+    with open(base_dir+'STAGE/'+name, 'rb') as f:
+        assert s3.get_object(Bucket=entry_bucket, Key=entry_key(name, '007', 'meteodrone-12'))['Body'].read() == f.read()
+    assert stage_done(conn, flight['key'], 'upload') is not None
+    assert sorted(e['dest'] for e in pending(conn)) == ['bufr', 'gsl']
+    # still needed for GSL
+    assert os.path.exists(base_dir+outbox_dir+name)
+
+    # no BUFR yet: looked for again later
+    assert deliver(base_dir, name, 'bufr', bufr_every=60.) is False
+    assert claim(conn, name, 'bufr') is None
+
+    # once it is there, it is fetched and queued for GSL with the netCDF
+    s3.put_object(Bucket=product_bucket, Key=bufr_key(name, '007', 'meteodrone-12'), Body=b'BUFR')
+    with conn:
+        conn.execute('UPDATE outbox SET claimed=0 WHERE dest=?', ('bufr',))
+    assert deliver(base_dir, name, 'bufr') is True
+    assert stage_done(conn, flight['key'], 'bufr') == bufr_name
+    assert sorted((e['name'], e['dest']) for e in pending(conn)) == [(bufr_name, 'gsl'), (name, 'gsl')]
+    with open(base_dir+outbox_dir+bufr_name, 'rb') as f:
+        assert f.read() == b'BUFR'
+    conn.close()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_qc.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : QC of STAGE files (PSL_UASDC_qc.py): each check flags the
+#                 records it should, a stuck sensor is found across block
+#                 edges, and a file gives the same flags whatever the size
+#                 of the blocks it is read in.
+#
+#  USAGE        : python3 -m pytest tests/test_qc.py
+#
+#  DEPENDENCIES : pytest, netCDF4, numpy
+
+import json, os
+import numpy as np
+import netCDF4 as nc
+import pytest
+from PSL_UASDC_qc import flag_bits, block_flags, stuck_flags, qc_file, qc_held, set_qc
+
+new_fname = 'UASDC_007_meteodrone-12_20240501221756Z.nc'
+
+
+def test_block_flags():
+
+    x = np.array([1., 2., 3., 40., 5., 6., 7., -1., 9., np.nan, 11.])
+    flags = block_flags(x, None, {'range':(0., 20.), 'spike':5.}, 0, len(x), 5., 1)
+    assert list(np.flatnonzero(flags & flag_bits['out_of_range'])) == [3, 7]
+    # the spike, not its neighbours; nothing next to the gap
+    assert 3 in np.flatnonzero(flags & flag_bits['spike'])
+    assert not flags[[2, 4, 9]].any()
+
+    t = np.array([0., 1., 2., 2., 4., 3., 6.])
+    flags = block_flags(t, None, {'increasing':True}, 0, len(t), 5., 1)
+    assert list(np.flatnonzero(flags)) == [3, 5]
+    # the records before the block (x[:pad]) are only looked at
+    assert list(np.flatnonzero(block_flags(t, None, {'increasing':True}, 3, len(t), 5., 1))) == [0, 2]
+
+    # 1 K over 1 m, taken over 5 m
+    z = np.arange(20.)
+    x = np.zeros(20)
+    x[12:] = 10.
+    flags = block_flags(x, z, {'gradient':0.5}, 0, 20, 5., 5)
+    assert list(np.flatnonzero(flags)) == list(range(12, 17))
+
+
+def test_stuck_across_blocks():
+
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=200)
+    x[20:80] = 1.5  # 60 s, stuck
+    x[100:110] = 2.5  # 10 s, fine
+    x[150:] = 0.5  # stuck up to the end
+    t = np.arange(200.)
+
+    whole = np.zeros(200, dtype=np.int8)
+    stuck_flags(x, t, 0, whole, 30., dict())
+    assert list(np.flatnonzero(whole)) == list(range(20, 80))+list(range(150, 200))
+
+    for step in range(1, 201):
+        flags, state = np.zeros(200, dtype=np.int8), dict()
+        for i in range(0, 200, step):
+            stuck_flags(x[i:i+step], t[i:i+step], i, flags, 30., state)
+        assert (flags == whole).all(), step
+
+
+# a STAGE-like file of n records with a fault of each kind
+def make_stage(fullfile, n=600):
+
+    t = np.arange(n, dtype=float)
+    t[300] = t[299]
+    z = 272.+t
+    temp = 293.15-0.0065*t+0.01*np.sin(t)
+    temp[10] = 400.
+    temp[50] = temp[50]+5.
+    temp[200:260] = temp[200]
+    with nc.Dataset(fullfile, 'w') as f:
+        f.createDimension('time', n)
+        for name, dtype, data in [('time', 'f8', t), ('altitude', 'f4', z), ('air_temperature', 'f4', temp),
+                                  ('relative_humidity', 'f4', 50.+np.cos(t))]:
+            f.createVariable(name, dtype, ('time',), chunksizes=(64,))[:] = data
+        f.variables['time'].units = 'seconds since 2024-05-01T22:17:56Z'
+
+
+def test_qc_file_blocks(tmp_path):
+
+    path = str(tmp_path)+'/'
+    make_stage(path+new_fname)
+    result = qc_file(path, new_fname, 'meteodrone-12')
+    with nc.Dataset(path+new_fname) as f:
+        flags = {name: f.variables[name+'_qc'][:] for name in ['time', 'altitude', 'air_temperature', 'relative_humidity']}
+        assert f.variables['air_temperature'].ancillary_variables == 'air_temperature_qc'
+        assert f.variables['air_temperature_qc'].flag_meanings.split() == list(flag_bits)
+
+    assert list(np.flatnonzero(flags['time'])) == [300]
+    assert not flags['altitude'].any() and not flags['relative_humidity'].any()
+    temp = flags['air_temperature']
+    assert np.flatnonzero(temp & flag_bits['out_of_range']).tolist() == [10]
+    assert 50 in np.flatnonzero(temp & flag_bits['spike'])
+    assert np.flatnonzero(temp & flag_bits['stuck_sensor']).tolist() == list(range(200, 260))
+    with open(path+os.path.splitext(new_fname)[0]+'_qc.json') as f:
+        assert json.load(f)['variables'] == json.loads(json.dumps(result['variables']))
+    assert result['worst'] == pytest.approx(result['variables']['air_temperature']['flagged']/600)
+
+    # the same flags however small the blocks, and on a second run
+    for max_bytes in [1, 100, 1000, 5000]:
+        assert qc_file(path, new_fname, 'meteodrone-12', max_bytes)['variables'] == result['variables']
+        with nc.Dataset(path+new_fname) as f:
+            for name in flags:
+                assert (f.variables[name+'_qc'][:] == flags[name]).all(), (name, max_bytes)
+
+
+def test_qc_held():
+
+    set_qc(0.05)
+    assert qc_held('0.100000') and not qc_held('0.010000')
+    assert not qc_held(None) and not qc_held('')
+    set_qc()
+    assert not qc_held('1.000000')
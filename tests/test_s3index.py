@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_s3index.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : The index of the buckets (PSL_UASDC_s3index.py) against
+#                 moto: deleted objects leave the index when their month is
+#                 relisted, months that are gone leave it, and keys
+#                 backfilled into older months are picked up by a full
+#                 relist, asked for or due.
+#
+#  USAGE        : python3 -m pytest tests/test_s3index.py
+#
+#  DEPENDENCIES : pytest, moto[s3], boto3
+
+from PSL_UASDC_s3index import open_index, refresh_index, query_index
+from conftest import entry_bucket
+
+
+# key of a flight in month m at day/time t (ddhhmmss)
+def key(m, t):
+
+    return '007/meteodrone-12/2024/%02d/UASDC_007_meteodrone-12_2024%02d%sZ.nc' % (m, m, t)
+
+
+def test_refresh(s3, tmp_path):
+
+    conn = open_index(str(tmp_path/'index.sqlite'))
+    indexed = lambda: [k for k, size, modified in query_index(conn, entry_bucket)]
+    for m in [1, 2, 3]:
+        for t in ['01000000', '20000000']:
+            s3.put_object(Bucket=entry_bucket, Key=key(m, t), Body=b'x')
+
+    # the first time is a full listing
+    assert refresh_index(conn, entry_bucket, '007/', recent=1) == 6
+    assert indexed() == sorted(key(m, t) for m in [1, 2, 3] for t in ['01000000', '20000000'])
+
+    # the newest month is relisted, older months only listed after their last key
+    s3.delete_object(Bucket=entry_bucket, Key=key(3, '20000000'))
+    s3.delete_object(Bucket=entry_bucket, Key=key(1, '01000000'))
+    s3.put_object(Bucket=entry_bucket, Key=key(1, '10000000'), Body=b'x')
+    s3.put_object(Bucket=entry_bucket, Key=key(2, '25000000'), Body=b'x')
+    refresh_index(conn, entry_bucket, '007/', recent=1)
+    assert key(3, '20000000') not in indexed()
+    assert key(2, '25000000') in indexed()
+    assert key(1, '01000000') in indexed() and key(1, '10000000') not in indexed()
+
+    # a full relist sees it all
+    refresh_index(conn, entry_bucket, '007/', full=True, recent=1)
+    assert indexed() == sorted([key(1, '10000000'), key(1, '20000000'), key(2, '01000000'), key(2, '20000000'),
+                                key(2, '25000000'), key(3, '01000000')])
+
+    # and is done by itself once full_every has passed
+    s3.put_object(Bucket=entry_bucket, Key=key(2, '05000000'), Body=b'x')
+    refresh_index(conn, entry_bucket, '007/', recent=1)
+    assert key(2, '05000000') not in indexed()
+    refresh_index(conn, entry_bucket, '007/', recent=1, full_every=0.)
+    assert key(2, '05000000') in indexed()
+
+    # a month that is gone
+    for t in ['10000000', '20000000']:
+        s3.delete_object(Bucket=entry_bucket, Key=key(1, t))
+    refresh_index(conn, entry_bucket, '007/', recent=1)
+    assert not [k for k in indexed() if '/2024/01/' in k]
+    conn.close()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+#  FILE NAME    : test_uploadfiles.py
+#
+#  AUTHOR       : Christopher J. Cox, NOAA/PSL
+#  DATE         : 18 October 2026
+#
+#  SUMMARY      : Uploads to S3 (PSL_UASDC_uploadfiles.py) against moto: a
+#                 multipart upload cut off part way is resumed from its
+#                 .upload state file, sending only the parts S3 does not
+#                 have, and a file that changed since starts over. Waiting
+#                 for the BUFR goes on through S3 errors.
+#
+#  USAGE        : python3 -m pytest tests/test_uploadfiles.py
+#
+#  DEPENDENCIES : pytest, moto[s3], boto3
+
+import json, os
+import pytest
+import PSL_UASDC_uploadfiles as uploadfiles
+from PSL_UASDC_uploadfiles import upload_file, upload_parts, set_transfer_config, entry_key, bufr_key, poll_bufr
+from conftest import entry_bucket, product_bucket
+
+MB = 1024**2
+new_fname = 'UASDC_007_meteodrone-12_20240501221756Z.nc'
+
+
+# 12 MB in STAGE, in parts of 5 MB (5, 5 and 2), one at a time
+@pytest.fixture
+def bigfile(s3, base_dir):
+
+    set_transfer_config(5*MB, 5*MB, 1)
+    data = os.urandom(12*MB)
+    with open(base_dir+'STAGE/'+new_fname, 'wb') as f:
+        f.write(data)
+
+    return base_dir+'STAGE/', data
+
+
+# make upload_part of the client fail for the part numbers in fail
+def failing_parts(s3, monkeypatch, fail):
+
+    upload_part = s3.upload_part
+    def failing(**kwargs):
+        if kwargs['PartNumber'] in fail:
+            fail.remove(kwargs['PartNumber'])
+            raise ConnectionError('connection dropped')
+        return upload_part(**kwargs)
+    monkeypatch.setattr(s3, 'upload_part', failing)
+
+
+def test_resume_multipart(s3, bigfile, monkeypatch):
+
+    path, data = bigfile
+    key, statefile = entry_key(new_fname, '007', 'meteodrone-12'), path+'.'+new_fname+'.upload'
+    failing_parts(s3, monkeypatch, [3])
+
+    with pytest.raises(ConnectionError):
+        upload_parts(path+new_fname, entry_bucket, key, statefile)
+    with open(statefile) as f:
+        assert sorted(json.load(f)['parts']) == ['1', '2']
+
+    # only the last part goes the second time
+    assert upload_parts(path+new_fname, entry_bucket, key, statefile) == (2*MB, 10*MB)
+    assert s3.get_object(Bucket=entry_bucket, Key=key)['Body'].read() == data
+    assert not os.path.exists(statefile)
+    assert 'Uploads' not in s3.list_multipart_uploads(Bucket=entry_bucket)
+
+
+def test_changed_file_starts_over(s3, bigfile, monkeypatch):
+
+    path, data = bigfile
+    key, statefile = entry_key(new_fname, '007', 'meteodrone-12'), path+'.'+new_fname+'.upload'
+    failing_parts(s3, monkeypatch, [2])
+
+    with pytest.raises(ConnectionError):
+        upload_parts(path+new_fname, entry_bucket, key, statefile)
+    data = data[:11*MB]
+    with open(path+new_fname, 'wb') as f:
+        f.write(data)
+
+    # the old upload is aborted, and nothing of it is kept
+    assert upload_parts(path+new_fname, entry_bucket, key, statefile) == (11*MB, 0)
+    assert s3.get_object(Bucket=entry_bucket, Key=key)['Body'].read() == data
+    assert 'Uploads' not in s3.list_multipart_uploads(Bucket=entry_bucket)
+
+
+def test_upload_file_retries(s3, bigfile, monkeypatch):
+
+    path, data = bigfile
+    monkeypatch.setattr(uploadfiles.time, 'sleep', lambda s: None)
+    failing_parts(s3, monkeypatch, [2, 3])
+
+    # each retry goes on from the parts already in S3
+    etag = upload_file(path, new_fname, '007', 'meteodrone-12')
+    response = s3.head_object(Bucket=entry_bucket, Key=entry_key(new_fname, '007', 'meteodrone-12'))
+    assert etag == response['ETag'] and response['ContentLength'] == len(data)
+    assert not os.path.exists(path+'.'+new_fname+'.upload')
+
+    # and a small file goes up in one PUT
+    with open(path+new_fname, 'wb') as f:
+        f.write(data[:MB])
+    assert upload_file(path, new_fname, '007', 'meteodrone-12') is not None
+    assert s3.get_object(Bucket=entry_bucket, Key=entry_key(new_fname, '007', 'meteodrone-12'))['Body'].read() == data[:MB]
+
+
+def test_poll_bufr_through_errors(s3, base_dir, monkeypatch):
+
+    from botocore.exceptions import EndpointConnectionError
+
+    # the link drops on the first two checks
+    drops = [1, 2]
+    head_object = s3.head_object
+    def dropping(**kwargs):
+        if drops:
+            drops.pop()
+            raise EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+        return head_object(**kwargs)
+    monkeypatch.setattr(s3, 'head_object', dropping)
+
+    bufr_name = new_fname[:-3]+'.bufr'
+    s3.put_object(Bucket=product_bucket, Key=bufr_key(new_fname, '007', 'meteodrone-12'), Body=b'BUFR')
+    jobs = [(new_fname, '007', 'meteodrone-12')]
+    assert poll_bufr(base_dir+'BUFR/', jobs, deadline=10., first_wait=0.02, max_wait=0.05) == {new_fname: True}
+    with open(base_dir+'BUFR/'+bufr_name, 'rb') as f:
+        assert f.read() == b'BUFR'
+
+    # and gives up at the deadline rather than raising
+    def down(**kwargs):
+        raise EndpointConnectionError(endpoint_url='https://s3.amazonaws.com')
+    monkeypatch.setattr(s3, 'head_object', down)
+    assert poll_bufr(base_dir+'BUFR/', jobs, deadline=0.2, first_wait=0.02, max_wait=0.05) == {new_fname: False}
@@ -138,4 +138,111 @@ def define_alt_names():
     namelist['non_coordinate_geopotential'] = {'gpt'}
     namelist['geopotential_height'] = {'gph','gpt_height'}
 
-    return namelist
\ No newline at end of file
+    return namelist
+
+# Keys are WMO variable names, value pairs describe how to convert the values
+# from the units a UAS might report to the units WMO expects, as
+# new = old*scale + offset. An offset of 'flighttime' means seconds since the
+# flight time in the file name (i.e., seconds since flight to seconds since
+# epoch). A conversion is only applied while the maximum of the variable is
+# below if_max_below, i.e. while the values are still in the UAS units, so 
+# converting a file twice does no harm.
+def define_unit_conversions():
+
+    conversions = OrderedDict()
+
+    conversions['time'] =                  {'scale' : 1.,   'offset' : 'flighttime', 'if_max_below' : 86400.} # s since flight -> s since epoch
+    conversions['relative_humidity'] =     {'scale' : 100., 'offset' : 0.,           'if_max_below' : 1.5}    # fraction -> %
+    conversions['air_pressure'] =          {'scale' : 100., 'offset' : 0.,           'if_max_below' : 1100.}  # hPa -> Pa
+    conversions['air_temperature'] =       {'scale' : 1.,   'offset' : 273.15,       'if_max_below' : 150.}   # C -> K
+    conversions['dew_point_temperature'] = {'scale' : 1.,   'offset' : 273.15,       'if_max_below' : 150.}   # C -> K
+
+    return conversions
+
+
+# Checks of the values of the WMO variables before a file is uploaded (see
+# PSL_UASDC_qc.py), in WMO units, i.e. after the unit conversions. Each is
+# only made if its key is there:
+#
+#   range    : (min, max) of a valid value
+#   spike    : largest departure of a value from its two neighbours beyond
+#              what the gradient between them explains
+#   stuck    : seconds a value may stay exactly the same before the sensor
+#              is taken to be stuck
+#   gradient : largest change per m of altitude, between records at least
+#              gradient_dz m apart
+#   increasing : time has to increase from one record to the next
+def define_qc():
+
+    qc = OrderedDict()
+
+    qc['gradient_dz'] = 5.
+
+    qc['time'] =                        {'increasing' : True}
+    qc['lat'] =                         {'range' : (-90., 90.)}
+    qc['lon'] =                         {'range' : (-180., 180.)}
+    qc['altitude'] =                    {'range' : (-500., 12000.),  'spike' : 50.}
+    qc['air_temperature'] =             {'range' : (183.15, 333.15), 'spike' : 2.,   'stuck' : 30.,  'gradient' : 0.5}
+    qc['dew_point_temperature'] =       {'range' : (163.15, 333.15), 'spike' : 3.,   'stuck' : 30.,  'gradient' : 1.}
+    qc['relative_humidity'] =           {'range' : (0., 105.),       'spike' : 10.,  'stuck' : 120., 'gradient' : 10.}
+    qc['humidity_mixing_ratio'] =       {'range' : (0., 0.05),       'spike' : 0.003}
+    qc['wind_speed'] =                  {'range' : (0., 75.),        'spike' : 10.,  'stuck' : 60.}
+    qc['wind_direction'] =              {'range' : (0., 360.)}
+    qc['air_pressure'] =                {'range' : (10000., 110000.), 'spike' : 200., 'stuck' : 60.,  'gradient' : 25.}
+    qc['turbulent_kinetic_energy'] =    {'range' : (0., 100.)}
+    qc['eddy_dissipation_rate'] =       {'range' : (0., 1.)}
+    qc['non_coordinate_geopotential'] = {'range' : (-5000., 120000.)}
+    qc['geopotential_height'] =         {'range' : (-500., 12000.),  'spike' : 50.}
+
+    return qc
+
+
+# How STAGE files are stored: deflate level (0 for none) and shuffle for the
+# variables with dimensions, chunked every chunk_records records along the
+# first (time) dimension. Variables in float32 have enough precision in 
+# single precision and are written that way when asked (process_UASDC.py
+# --float32); time, lat and lon are not, they need double precision. Plain
+# deflate and shuffle are in every netCDF-4/HDF5 build, so any netCDF reader
+# (e.g. the Synoptic netCDF to BUFR converter) can read the files.
+def define_storage():
+
+    storage = {
+        'complevel'     : 4,
+        'shuffle'       : True,
+        'chunk_records' : 8192,
+        'float32'       : {'altitude', 'air_temperature', 'dew_point_temperature', 'wind_direction', 'wind_speed',
+                           'relative_humidity', 'humidity_mixing_ratio', 'turbulent_kinetic_energy', 
+                           'eddy_dissipation_rate', 'air_pressure', 'non_coordinate_geopotential', 'geopotential_height'},
+    }
+
+    return storage
+
+
+# Airframe/firmware profiles, each applied on top of the definitions above.
+# 'platforms' are the airframeIDs (fnmatch patterns) a profile is picked for,
+# 'alt_names' adds names a UAS may use (WMO name : set of names), 'wmo_atts'
+# adds or replaces attributes of WMO variables, and 'globals' and 
+# 'conversions' add or replace entries of define_wmo_globals() and 
+# define_unit_conversions(), and 'qc' those of define_qc(). Files checked under a profile other than 
+# default carry its name in their spec version (see PSL_UASDC_schema.py).
+def define_profiles():
+
+    profiles = OrderedDict()
+
+    profiles['default'] = {}
+
+    # e.g., a firmware that reports pressure as press, in bar
+    # profiles['meteodrone-fw2'] = {'platforms'   : ['meteodrone-2*'],
+    #                               'alt_names'   : {'air_pressure' : {'press'}},
+    #                               'conversions' : {'air_pressure' : {'scale' : 100000., 'offset' : 0., 'if_max_below' : 1.2}}} # bar -> Pa
+
+    return profiles
+
+
+# Version of the definitions in this file. Bump it whenever the globals, 
+# attributes, names, conversions, QC or profiles above change, so that files
+# processed under the old definitions are processed again (see 
+# PSL_UASDC_ledger.py).
+def define_spec_version():
+
+    return 'FM 303-2024/psl-2'